@@ -1,10 +1,27 @@
 import argparse
-from dataclasses import dataclass
+import asyncio
+from dataclasses import dataclass, field, fields
+import json
+import tempfile
 import time
 
+from meru import create_event_loop
 from meru.actions import Action
+from meru.base import MeruObject
+from meru.introspection import get_subclasses
+from meru.latency import LATENCIES
+from meru.metrics import disable_metrics, enable_metrics
+from meru.persistence import StateJournal
 from meru.serialization import decode_object, encode_object
-from meru.state import StateField, StateNode
+from meru.sockets import (
+    CollectorSocket,
+    PublisherSocket,
+    PushSocket,
+    StateConsumerSocket,
+    StateManagerSocket,
+    SubscriberSocket,
+)
+from meru.state import StateNode, register_state, update_state
 
 
 parser = argparse.ArgumentParser(description='Benchmark Meru')
@@ -21,9 +38,18 @@ class DummyAction(Action):
     dict_field: dict
 
 
+@dataclass
+class UrgentAction(DummyAction):
+    priority = 1
+
+
+@dataclass
 class DummyState(StateNode):
-    string_state = StateField('some_string')
-    int_state = StateField(666)
+    string_state: str = field(default='some_string')
+    int_state: int = field(default=666)
+
+    def handle_dummy_action(self, action: DummyAction):
+        self.int_state = action.int_field
 
 
 class MyTimer:
@@ -40,6 +66,31 @@ class MyTimer:
         print(f'The function "{self.name}" took {runtime} seconds to complete')
 
 
+def reflective_deserialize_objects(obj):
+    """The deserialization path without codec plans, kept for comparison."""
+    if "object_type" in obj.keys():
+        subclass = get_subclasses(MeruObject)[obj["object_type"]]
+        calling_args = []
+        for f in fields(subclass):
+            if not f.init:
+                continue
+
+            cast_to = f.metadata.get("cast", None)
+            if cast_to:
+                calling_args.append(cast_to(obj[f.name]))
+            else:
+                calling_args.append(obj[f.name])
+        action = subclass(*calling_args)
+
+        if isinstance(action, Action):
+            action.timestamp = obj["timestamp"]
+            action.origin = obj["origin"]
+
+        return action
+
+    return obj
+
+
 def benchmark_action_decoding():
     res = encode_object(DummyAction('some_random_String', 123, {'wtf': 123, 'abc': 'def'}))
 
@@ -47,6 +98,144 @@ def benchmark_action_decoding():
         decode_object(res)
 
 
+def benchmark_reflective_action_decoding():
+    res = encode_object(DummyAction('some_random_String', 123, {'wtf': 123, 'abc': 'def'}))
+
+    for _ in range(args.iterations):
+        json.loads(res, object_hook=reflective_deserialize_objects)
+
+
+def benchmark_method_roundtrip(method):
+    action = DummyAction('some_random_String', 123, {'wtf': 123, 'abc': 'def'})
+    print(f'{method} encoded size: {len(encode_object(action, method))} bytes')
+
+    for _ in range(args.iterations):
+        decode_object(encode_object(action, method), method)
+
+
+async def benchmark_transport_latency(transport):
+    collector = CollectorSocket(transport=transport)
+    pusher = PushSocket(transport=transport)
+    await asyncio.sleep(0.1)
+
+    action = DummyAction('some_random_String', 123, {'wtf': 123, 'abc': 'def'})
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        await pusher.push(action)
+        await collector.collect()
+    runtime = time.perf_counter() - start
+    print(f'{transport} push -> collect latency: {runtime / args.iterations * 1_000_000:.1f} µs')
+
+    pusher.close()
+    collector.close()
+
+
+async def benchmark_metrics_overhead():
+    collector = CollectorSocket()
+    pusher = PushSocket()
+    await asyncio.sleep(0.1)
+
+    action = DummyAction('some_random_String', 123, {'wtf': 123, 'abc': 'def'})
+    runtimes = {False: 0, True: 0}
+    # Alternating rounds, so warming up does not count against either side.
+    for enabled in (False, True) * 3:
+        if enabled:
+            enable_metrics()
+        else:
+            disable_metrics()
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            await pusher.push(action)
+            await collector.collect()
+        runtimes[enabled] += time.perf_counter() - start
+    disable_metrics()
+
+    overhead = (runtimes[True] - runtimes[False]) / (3 * args.iterations) * 1_000_000
+    print(f'metrics overhead per push -> collect: {overhead:.1f} µs')
+
+    pusher.close()
+    collector.close()
+
+
+async def benchmark_urgent_latency(lanes):
+    collector = CollectorSocket(lanes=lanes)
+    pusher = PushSocket(lanes=lanes)
+    await asyncio.sleep(0.1)
+
+    bulk = DummyAction('some_random_String', 123, {'wtf': 123, 'abc': 'def'})
+    urgent = UrgentAction('some_random_String', 123, {'wtf': 123, 'abc': 'def'})
+    for _ in range(args.iterations):
+        await pusher.push(bulk)
+
+    start = time.perf_counter()
+    await pusher.push(urgent)
+    while not isinstance(await collector.collect(), UrgentAction):
+        pass
+    runtime = time.perf_counter() - start
+    print(f'{lanes} lane(s) urgent latency behind {args.iterations} actions: '
+          f'{runtime * 1_000_000:.1f} µs')
+
+    pusher.close()
+    collector.close()
+
+
+async def benchmark_latency_percentiles():
+    publisher = PublisherSocket(stamp_hops=True)
+    subscriber = SubscriberSocket(track_latency=True)
+    await asyncio.sleep(0.1)
+
+    for i in range(args.iterations):
+        await publisher.publish(DummyAction('some_random_String', i, {'wtf': 123, 'abc': 'def'}))
+        await subscriber.receive_action()
+
+    for (action, segment), histogram in LATENCIES.items():
+        print(f'{action} {segment} latency: p50 {histogram.percentile(50) / 1000:.1f} µs, '
+              f'p99 {histogram.percentile(99) / 1000:.1f} µs, '
+              f'p99.9 {histogram.percentile(99.9) / 1000:.1f} µs')
+
+    publisher.close()
+    subscriber.close()
+
+
+async def benchmark_request_roundtrip(event_loop):
+    manager = StateManagerSocket()
+    consumer = StateConsumerSocket()
+    await asyncio.sleep(0.1)
+
+    async def answer():
+        while True:
+            request = await manager.receive_request()
+            await manager.reply(request, request.action)
+
+    answering = asyncio.create_task(answer())
+    action = DummyAction('some_random_String', 123, {'wtf': 123, 'abc': 'def'})
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        await consumer.request(action)
+    runtime = time.perf_counter() - start
+    print(f'{event_loop} request round trip: {runtime / args.iterations * 1_000_000:.1f} µs')
+
+    answering.cancel()
+    consumer.close()
+    manager.close()
+
+
+async def benchmark_journal_replay():
+    register_state(DummyState)
+
+    with tempfile.TemporaryDirectory() as directory:
+        journal = StateJournal(directory)
+        journal.open()
+        for i in range(args.iterations):
+            await update_state(DummyAction('some_random_String', i, {'wtf': 123, 'abc': 'def'}))
+        journal.close()
+
+        start = time.perf_counter()
+        replayed = await journal.replay()
+        runtime = time.perf_counter() - start
+    print(f'journal replay: {replayed / runtime:.0f} actions/s')
+
+
 def benchmark_state_decoding():
     res = encode_object(DummyState())
 
@@ -55,5 +244,32 @@ def benchmark_state_decoding():
 
 
 if __name__ == '__main__':
+    with MyTimer('benchmark_reflective_decoding'):
+        benchmark_reflective_action_decoding()
+
     with MyTimer('benchmark_encoding'):
         benchmark_action_decoding()
+
+    with MyTimer('benchmark_state_decoding'):
+        benchmark_state_decoding()
+
+    for method in ('json', 'pickle', 'msgpack'):
+        with MyTimer(f'benchmark_{method}_roundtrip'):
+            benchmark_method_roundtrip(method)
+
+    asyncio.run(benchmark_journal_replay())
+
+    for transport in ('tcp', 'ipc', 'inproc'):
+        asyncio.run(benchmark_transport_latency(transport))
+
+    asyncio.run(benchmark_metrics_overhead())
+
+    asyncio.run(benchmark_latency_percentiles())
+
+    for lanes in (1, 2):
+        asyncio.run(benchmark_urgent_latency(lanes))
+
+    for event_loop in ('asyncio', 'uvloop'):
+        loop = create_event_loop(event_loop)
+        loop.run_until_complete(benchmark_request_roundtrip(event_loop))
+        loop.close()
@@ -34,7 +34,13 @@ if __name__ == "__main__":
                 "pytest-mock==2.0.0",
                 "git-pylint-commit-hook==2.5.1",
                 "setuptools_scm==3.2.0",
-            ]
+            ],
+            "msgpack": [
+                "msgpack==1.0.3",
+            ],
+            "uvloop": [
+                "uvloop==0.16.0",
+            ],
         },
         install_requires=[
             "click==8.0.3",
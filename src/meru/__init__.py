@@ -7,7 +7,10 @@ import traceback
 from importlib import import_module
 from typing import Callable
 
-from meru.exceptions import PingTimeout
+from meru import constants
+from meru.constants import MERU_METRICS
+from meru.exceptions import MeruException, PingTimeout
+from meru.handlers import shutdown_executors
 from meru.log import setup_logging
 from meru.sockets import MessagingSocket
 
@@ -26,6 +29,9 @@ async def shutdown(loop, process_signal=None):
 
     await asyncio.gather(*tasks, return_exceptions=True)
 
+    logger.debug("Shutting down handler executors.")
+    shutdown_executors(wait=False)
+
     # https://github.com/zeromq/pyzmq/issues/1167
     logger.debug("Destroying ZMQ context.")
     MessagingSocket.ctx.destroy(linger=0)
@@ -55,16 +61,51 @@ def import_runner(full_path) -> Callable:
     return getattr(mod, func)
 
 
-def run_process(entry_point_path):
+def create_event_loop(event_loop=None):
+    """Create a new event loop and set it as the current one.
+
+    Parameters:
+        event_loop: Either ``"asyncio"`` or ``"uvloop"``.  Defaults to
+            :py:const:`meru.constants.MERU_EVENT_LOOP`.  Falls back to the asyncio event loop if
+            uvloop is not installed.
+
+    Returns:
+        The new event loop.
+    """
+    event_loop = event_loop or constants.MERU_EVENT_LOOP
+
+    if event_loop not in ("asyncio", "uvloop"):
+        raise MeruException(
+            f'Event loop "{event_loop}" not supported. Use either "asyncio" or "uvloop"'
+        )
+
+    loop = None
+    if event_loop == "uvloop":
+        try:
+            import uvloop  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            logger.warning("uvloop is not installed, falling back to the asyncio event loop.")
+        else:
+            # The global event loop policy is left unchanged.
+            loop = uvloop.new_event_loop()
+
+    if loop is None:
+        loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def run_process(entry_point_path, event_loop=None):
     """Start a process.
 
     Parameters:
         entry_point_path: Python module path to the entrypoint.  E.g. `"my_app.processes.a_process.func"`.
+        event_loop: The event loop implementation, see :py:func:`create_event_loop`.
     """
     setup_logging()
     entry_point = import_runner(entry_point_path)
     os.environ["MERU_PROCESS"] = entry_point.__name__
-    loop = asyncio.get_event_loop()
+    loop = create_event_loop(event_loop)
 
     # Python on Windows does not seem to support SetConsoleCtrlHandler() at the moment.
     if platform.system() != 'Windows':
@@ -75,8 +116,17 @@ def run_process(entry_point_path):
             )
 
     loop.set_exception_handler(handle_exception)
+
+    if MERU_METRICS:
+        # Imported on demand, the metrics instrument most other modules.
+        # pylint: disable=import-outside-toplevel
+        from meru.metrics import enable_metrics, serve_metrics
+
+        enable_metrics()
+        loop.create_task(serve_metrics())
+
     loop.create_task(entry_point())
 
-    logger.info(f"Process ID: {os.getpid()}")
+    logger.info(f"Process ID: {os.getpid()}, event loop: {loop.__class__.__module__}")
 
     loop.run_forever()
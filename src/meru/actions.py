@@ -5,26 +5,165 @@ The module also holds a global list of all available Actions which is populated
 
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from importlib import import_module
 import inspect
-from typing import List
+from typing import Dict, Iterable, List, Union
 
-from meru.base import Action, StateNode
+from meru.base import Action, MeruObject, StateNode
 from meru.helpers import get_full_path_to_class
 
 
+@dataclass
+class StateNodeDelta(MeruObject):
+    """Changes of a :py:class:`StateNode` up to a version.
+
+    Properties:
+        node: Absolute class name of the :py:class:`StateNode`.
+        version: The version of the node after applying the changes.
+        changed_fields: Replaced fields by field name.
+        changed_entries: Changed or added entries of dict fields by field name.
+        removed_entries: Removed keys of dict fields by field name.
+    """
+
+    node: str
+    version: int
+    changed_fields: dict = field(default_factory=dict)
+    changed_entries: dict = field(default_factory=dict)
+    removed_entries: dict = field(default_factory=dict)
+
+    def apply(self, state_node: StateNode):
+        """Apply the changes to a state node in place."""
+        for name, value in self.changed_fields.items():
+            setattr(state_node, name, value)
+        for name, entries in self.changed_entries.items():
+            getattr(state_node, name).update(entries)
+        for name, keys in self.removed_entries.items():
+            entries = getattr(state_node, name)
+            for key in keys:
+                entries.pop(key, None)
+
+    def project(self, projection: Dict[str, Union[List, None]]) -> "StateNodeDelta":
+        """Returns the part of the changes that is covered by a projection.
+
+        Parameters:
+            projection: The projected field names, mapped to the projected keys of dict fields or
+                ``None`` for complete fields.
+        """
+        return StateNodeDelta(
+            self.node,
+            self.version,
+            {
+                name: _project_value(value, projection[name])
+                for name, value in self.changed_fields.items()
+                if name in projection
+            },
+            {
+                name: _project_value(entries, projection[name])
+                for name, entries in self.changed_entries.items()
+                if name in projection
+            },
+            {
+                name: [key for key in keys if projection[name] is None or key in projection[name]]
+                for name, keys in self.removed_entries.items()
+                if name in projection
+            },
+        )
+
+    @classmethod
+    def from_projection(
+        cls, state_node: StateNode, version: int, projection: Dict[str, Union[List, None]]
+    ):
+        """Creates a delta that sets the projected fields of a state node.
+
+        Parameters:
+            state_node: The state node.
+            version: The current version of the node.
+            projection: The projected field names, mapped to the projected keys of dict fields or
+                ``None`` for complete fields.
+        """
+        return cls(
+            get_full_path_to_class(state_node.__class__),
+            version,
+            {
+                name: _project_value(getattr(state_node, name), keys)
+                for name, keys in projection.items()
+            },
+        )
+
+    @classmethod
+    def merge(cls, node: str, version: int, deltas: Iterable["StateNodeDelta"]):
+        """Combines consecutive deltas into a single one.
+
+        The given deltas are not modified.
+
+        Parameters:
+            node: Absolute class name of the :py:class:`StateNode`.
+            version: The version of the resulting delta.
+            deltas: The deltas in ascending order of their versions.
+        """
+        changed_fields = {}
+        changed_entries = {}
+        removed_entries = {}
+
+        for delta in deltas:
+            for name, value in delta.changed_fields.items():
+                changed_fields[name] = value
+                changed_entries.pop(name, None)
+                removed_entries.pop(name, None)
+
+            for name, entries in delta.changed_entries.items():
+                if name in changed_fields:
+                    changed_fields[name] = {**changed_fields[name], **entries}
+                else:
+                    changed_entries.setdefault(name, {}).update(entries)
+                    removed_entries.get(name, set()).difference_update(entries)
+
+            for name, keys in delta.removed_entries.items():
+                if name in changed_fields:
+                    changed_fields[name] = {
+                        key: value
+                        for key, value in changed_fields[name].items()
+                        if key not in keys
+                    }
+                else:
+                    removed_entries.setdefault(name, set()).update(keys)
+                    for key in keys:
+                        changed_entries.get(name, {}).pop(key, None)
+
+        return cls(
+            node,
+            version,
+            changed_fields,
+            changed_entries,
+            {name: list(keys) for name, keys in removed_entries.items() if keys},
+        )
+
+
+def _project_value(value, keys: Union[List, None]):
+    if keys is None:
+        return value
+    keys = set(keys)
+    return {key: entry for key, entry in value.items() if key in keys}
+
+
 @dataclass
 class StateUpdate(Action):
     """Sent to the broker to request the current state.
 
     Properties:
         nodes: Parts of the global state for which the state is requested.
+        versions: Versions of the transmitted ``nodes`` by absolute class name.
+        deltas: Changes for nodes the requesting process already knows.
+        epoch: Identifies the broker instance the versions belong to.
     """
 
     topic = b"StateUpdate"
 
     nodes: List[StateNode]
+    versions: Dict[str, int] = field(default_factory=dict)
+    deltas: List[StateNodeDelta] = field(default_factory=list)
+    epoch: str = ""
 
 
 @dataclass
@@ -59,11 +198,20 @@ class RequireState(Action):
         nodes: Parts of the global state for which the state is requested.
 
             Each entry is an absolute class name of the corresponding :py:class:`StateNode`.
+        versions: Versions of nodes the process already knows by absolute class name.  The broker
+            answers with :py:class:`StateNodeDelta` objects for those if possible.
+        epoch: The epoch of the broker the versions were received from.
+        projections: The fields of nodes the process needs by absolute class name, see
+            :py:func:`meru.state.register_state`.  The broker answers with
+            :py:class:`StateNodeDelta` objects that only contain those fields.
     """
 
     topic = b"state"
 
     nodes: List[str]
+    versions: Dict[str, int] = field(default_factory=dict)
+    epoch: str = ""
+    projections: Dict[str, Dict[str, Union[List, None]]] = field(default_factory=dict)
 
     def to_dict(self):
         sup = super().to_dict()
@@ -1,9 +1,8 @@
 """Base classes for the communication"""
 
 from dataclasses import dataclass, field
-import time
 
-from meru.helpers import get_process_identity
+from meru.helpers import get_process_identity, now_ns
 
 
 @dataclass
@@ -41,8 +40,15 @@ class Action(MeruObject):
 
     Attributes:
         origin: Identity of the sender process. See :py:func:`meru.helpers.get_process_identity`.
-        topic: Can be used to group Actions.
+        topic: Can be used to group Actions.  Unless set explicitly, the topic is derived from the
+            class name, which allows subscribers to filter actions by class.  Subclasses inherit an
+            explicitly set topic.
+        priority: Actions with a priority above 0 are sent through separate, faster lanes, see
+            :py:const:`meru.constants.MERU_PRIORITY_LANES`.  Higher lanes are received first.
+        ttl: Time in ms after ``timestamp`` an action is still useful.  Expired actions are dropped
+            by the subscribers and the relay without handling them.  ``None`` never expires.
         timestamp: Timestamp from the moment the Action was created (und usually sent).  Unix time in ms.
+        timestamp_ns: The same moment as ``timestamp`` in ns, see :py:func:`meru.helpers.now_ns`.
     """
 
     origin: str = field(
@@ -50,15 +56,32 @@ class Action(MeruObject):
         repr=False,
     )
     topic = b""
+    _explicit_topic = False
+    priority = 0
+    ttl = None
 
     timestamp: float = field(
         init=False,
         repr=False,
     )
+    timestamp_ns: int = field(
+        init=False,
+        repr=False,
+    )
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "topic" in cls.__dict__:
+            cls._explicit_topic = True
+        elif not cls._explicit_topic:
+            # The delimiter prevents a subscription to "Foo" from matching "FooBar".
+            cls.topic = f"{cls.__name__}\0".encode()
 
     def __post_init__(self):
-        self.timestamp = int(time.time() * 1000)
+        timestamp_ns = now_ns()
+        self.timestamp = timestamp_ns // 1_000_000
         self.origin = get_process_identity()
+        self.timestamp_ns = timestamp_ns
 
 
 # pylint: disable=protected-access,too-few-public-methods,no-member
@@ -1,20 +1,31 @@
 """A cli to launch one or more processes."""
 
 import multiprocessing
+import os
 from typing import List
 
 import time
 import click
 from click import ClickException
 
-from meru import run_process
+from meru import constants, run_process
 
 AVAILABLE_PROCESSES = {}
 
 
 @click.group()
-def main_cli():
-    pass
+@click.option(
+    "--event-loop",
+    type=click.Choice(["asyncio", "uvloop"]),
+    default=None,
+    help="Event loop used by the started processes. Defaults to $MERU_EVENT_LOOP or asyncio.",
+)
+def main_cli(event_loop):
+    if event_loop:
+        # Set in the environment as well, so it is inherited by processes started by
+        # multiprocessing that import the constants again.
+        os.environ["MERU_EVENT_LOOP"] = event_loop
+        constants.MERU_EVENT_LOOP = event_loop
 
 
 @main_cli.group(name="process", help="Start processes.")
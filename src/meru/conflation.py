@@ -0,0 +1,148 @@
+"""Conflation of actions that only carry the latest value of something.
+
+Actions like prices or positions supersede older actions of the same kind.  When a process can not
+keep up, handling the outdated actions is wasted work.  With conflation only the newest of the
+pending actions is delivered::
+
+    register_conflation(PriceUpdate, key=lambda action: action.symbol)
+
+Subscribers conflate the actions received at once by
+:py:meth:`meru.sockets.SubscriberSocket.receive_many`, which
+:py:meth:`meru.sockets.SubscriberSocket.handle_incoming_actions` uses with ``max_items`` above one.
+Actions received one at a time by :py:meth:`meru.sockets.SubscriberSocket.receive_action`, e.g. by
+:py:class:`meru.dispatch.ActionDispatcher`, are never conflated.
+
+The broker can additionally conflate the encoded actions in :py:class:`meru.relay.ActionRelay`.  The
+topic is the same for all actions of a class, so a key function is needed as well unless every
+action of the class supersedes all older ones::
+
+    ActionRelay(
+        conflate_topics=[PriceUpdate.topic],
+        conflation_key=lambda frames: decode_object(frames[-1]).symbol,
+    )
+"""
+
+from collections import defaultdict
+from typing import Callable, Hashable, List, Sequence, Type, Union
+
+from meru.base import Action
+
+# The conflation key functions by action class, ``None`` conflates all actions of a class.
+CONFLATION_POLICIES = {}
+
+
+class ConflationMetrics:
+    """Counters for the actions skipped by conflation.
+
+    Attributes:
+        skipped: Number of skipped actions by action class name or topic.
+    """
+
+    def __init__(self):
+        self.skipped = defaultdict(int)
+
+    def record(self, name, count: int = 1):
+        self.skipped[name] += count
+
+    @property
+    def total(self) -> int:
+        return sum(self.skipped.values())
+
+
+def register_conflation(
+    action_cls: Type[Action], key: Union[Callable[[Action], Hashable], None] = None
+):
+    """Deliver only the newest pending action of a class.
+
+    Parameters:
+        action_cls: The action class.
+        key: Returns the key of an action, only actions with the same key supersede each other.
+            Without a function, all actions of the class supersede each other.
+    """
+    CONFLATION_POLICIES[action_cls] = key
+
+
+def conflate_actions(
+    actions: List[Action], metrics: Union[ConflationMetrics, None] = None
+) -> List[Action]:
+    """Remove actions that are superseded by a newer action in the same list.
+
+    The remaining actions keep their order, the newest action of a key takes the position of its
+    last occurrence.
+
+    Parameters:
+        actions: The actions in the order they were received.
+        metrics: Counts the removed actions.
+
+    Returns:
+        The remaining actions.
+    """
+    if not CONFLATION_POLICIES or len(actions) < 2:
+        return actions
+
+    latest = {}
+    conflated = 0
+    for index, action in enumerate(actions):
+        action_cls = action.__class__
+        if action_cls in CONFLATION_POLICIES:
+            key = CONFLATION_POLICIES[action_cls]
+            latest[action_cls, key(action) if key is not None else None] = index
+            conflated += 1
+
+    if conflated == len(latest):
+        return actions
+
+    keep = set(latest.values())
+    remaining = []
+    for index, action in enumerate(actions):
+        if index in keep or action.__class__ not in CONFLATION_POLICIES:
+            remaining.append(action)
+        elif metrics is not None:
+            metrics.record(action.__class__.__name__)
+    return remaining
+
+
+def conflate_messages(
+    messages: List[List[bytes]],
+    topics: Sequence[bytes],
+    metrics: Union[ConflationMetrics, None] = None,
+    key: Union[Callable[[List[bytes]], Hashable], None] = None,
+) -> List[List[bytes]]:
+    """Remove encoded actions that are superseded by a newer action with the same topic and key.
+
+    Parameters:
+        messages: The multipart messages in the order they were received.
+        topics: Topic prefixes of the conflated messages.
+        metrics: Counts the removed messages by topic.
+        key: Returns the key of a conflated message, only messages with the same topic and key
+            supersede each other.  Without a function, all messages with the same topic supersede
+            each other.
+
+    Returns:
+        The remaining messages.
+
+    See Also:
+        :py:func:`conflate_actions`
+    """
+    if not topics or len(messages) < 2:
+        return messages
+
+    topics = tuple(topics)
+    latest = {}
+    conflated = 0
+    for index, frames in enumerate(messages):
+        if frames[0].startswith(topics):
+            latest[frames[0], key(frames) if key is not None else None] = index
+            conflated += 1
+
+    if conflated == len(latest):
+        return messages
+
+    keep = set(latest.values())
+    remaining = []
+    for index, frames in enumerate(messages):
+        if index in keep or not frames[0].startswith(topics):
+            remaining.append(frames)
+        elif metrics is not None:
+            metrics.record(frames[0])
+    return remaining
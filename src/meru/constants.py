@@ -1,6 +1,7 @@
 """Constants for the other modules."""
 
 import os
+import tempfile
 from distutils.util import strtobool
 
 from meru.exceptions import MeruException
@@ -8,20 +9,87 @@ from meru.exceptions import MeruException
 BIND_ADDRESS = os.environ.get("BIND_ADDRESS", "127.0.0.1")
 BROKER_ADDRESS = os.environ.get("BROKER_ADDRESS", "127.0.0.1")
 
-PUBLISHER_PORT = "24051"
-COLLECTOR_PORT = "24052"
-STATE_PORT = "24053"
+PUBLISHER_PORT = os.environ.get("MERU_PUBLISHER_PORT", "24051")
+COLLECTOR_PORT = os.environ.get("MERU_COLLECTOR_PORT", "24052")
+STATE_PORT = os.environ.get("MERU_STATE_PORT", "24053")
+
+# One of "tcp", "ipc" (Unix domain sockets) or "inproc" (processes within one interpreter).
+MERU_TRANSPORT = os.environ.get("MERU_TRANSPORT", "tcp")
+MERU_IPC_PATH = os.environ.get("MERU_IPC_PATH", tempfile.gettempdir())
+
+# Number of priority lanes, 1 disables them. Lane n uses the ports increased by n times the offset.
+MERU_PRIORITY_LANES = int(os.environ.get("MERU_PRIORITY_LANES", 1))
+MERU_LANE_PORT_OFFSET = int(os.environ.get("MERU_LANE_PORT_OFFSET", 10))
 
 SSH_TUNNEL = os.environ.get("SSH_TUNNEL", False)
 
 MERU_SERIALIZATION_METHOD = os.environ.get("MERU_SERIALIZATION_METHOD", "json")
+# One of "asyncio" or "uvloop", see meru.create_event_loop.
+MERU_EVENT_LOOP = os.environ.get("MERU_EVENT_LOOP", "asyncio")
 MERU_RECEIVE_TIMEOUT = int(os.environ.get("MERU_RECEIVE_TIMEOUT", 4000))
 
+# Batching of pushed actions, disabled with a batch size of 1. The interval is given in µs.
+MERU_BATCH_SIZE = int(os.environ.get("MERU_BATCH_SIZE", 1))
+MERU_BATCH_INTERVAL = int(os.environ.get("MERU_BATCH_INTERVAL", 1000))
+
+# Number of actions handled concurrently by meru.dispatch.ActionDispatcher.
+MERU_HANDLER_CONCURRENCY = int(os.environ.get("MERU_HANDLER_CONCURRENCY", 64))
+
+# Number of workers of the pools for action handlers registered with an executor.
+MERU_THREAD_POOL_SIZE = int(
+    os.environ.get("MERU_THREAD_POOL_SIZE", min(32, (os.cpu_count() or 1) + 4))
+)
+MERU_PROCESS_POOL_SIZE = int(os.environ.get("MERU_PROCESS_POOL_SIZE", os.cpu_count() or 1))
+
+# Default window of batch action handlers, see meru.handlers. The interval is given in µs.
+MERU_HANDLER_BATCH_SIZE = int(os.environ.get("MERU_HANDLER_BATCH_SIZE", 100))
+MERU_HANDLER_BATCH_INTERVAL = int(os.environ.get("MERU_HANDLER_BATCH_INTERVAL", 10000))
+
+# Number of state changes per StateNode the broker keeps to answer delta requests.
+MERU_STATE_HISTORY_SIZE = int(os.environ.get("MERU_STATE_HISTORY_SIZE", 1000))
+
+# State snapshots and journal of the broker, see meru.persistence. The interval is given in s.
+# Both are unpickled when the broker starts, so they default to a directory private to the user.
+_STATE_HOME = os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state")
+MERU_STATE_DIRECTORY = os.environ.get("MERU_STATE_DIRECTORY", os.path.join(_STATE_HOME, "meru"))
+MERU_STATE_SNAPSHOT_PATH = os.environ.get(
+    "MERU_STATE_SNAPSHOT_PATH", os.path.join(MERU_STATE_DIRECTORY, "state.snapshot")
+)
+MERU_STATE_SNAPSHOT_INTERVAL = float(os.environ.get("MERU_STATE_SNAPSHOT_INTERVAL", 60))
+MERU_STATE_JOURNAL_PATH = os.environ.get(
+    "MERU_STATE_JOURNAL_PATH", os.path.join(MERU_STATE_DIRECTORY, "journal")
+)
+MERU_STATE_JOURNAL_SEGMENT_SIZE = int(os.environ.get("MERU_STATE_JOURNAL_SEGMENT_SIZE", 64 * 2**20))
+
+# Hop stamps added by the broker and latency histograms of the subscribers, see meru.latency.
+MERU_STAMP_HOPS = strtobool(os.environ.get("MERU_STAMP_HOPS", "false"))
+MERU_TRACK_LATENCY = strtobool(os.environ.get("MERU_TRACK_LATENCY", "false"))
+
+# Metrics of every process started by meru.run_process, served on the port, see meru.metrics.
+# Port 0 picks a free port.
+MERU_METRICS = strtobool(os.environ.get("MERU_METRICS", "false"))
+MERU_METRICS_PORT = os.environ.get("MERU_METRICS_PORT", "0")
+
+# Subscribe only to the topics of actions with registered handlers, see meru.sockets.SubscriberSocket.
+MERU_AUTO_SUBSCRIBE = strtobool(os.environ.get("MERU_AUTO_SUBSCRIBE", "false"))
+
 MERU_HOSTNAME_IN_IDENTITY = strtobool(
     os.environ.get("MERU_HOSTNAME_IN_IDENTITY", "true")
 )
 
-if MERU_SERIALIZATION_METHOD not in ("json", "pickle"):
+if MERU_TRANSPORT not in ("tcp", "ipc", "inproc"):
+    raise MeruException(
+        f'Setting MERU_TRANSPORT "{MERU_TRANSPORT}" not supported. Use either "tcp", "ipc" or "inproc"'
+    )
+
+if MERU_SERIALIZATION_METHOD not in ("json", "pickle", "msgpack"):
+    raise MeruException(
+        f'Setting MERU_SERIALIZATION_METHOD "{MERU_SERIALIZATION_METHOD}" not supported. '
+        f'Use either "json", "pickle" or "msgpack"'
+    )
+
+if MERU_EVENT_LOOP not in ("asyncio", "uvloop"):
     raise MeruException(
-        f'Setting MERU_SERIALIZATION_METHOD "{MERU_SERIALIZATION_METHOD}" not supported. Use either "json" or "pickle"'
+        f'Setting MERU_EVENT_LOOP "{MERU_EVENT_LOOP}" not supported. '
+        f'Use either "asyncio" or "uvloop"'
     )
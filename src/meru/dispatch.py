@@ -0,0 +1,177 @@
+"""Concurrent handling of received actions.
+
+:py:meth:`meru.sockets.SubscriberSocket.handle_incoming_actions` handles one action after another,
+so a slow handler delays all following actions.  :py:class:`ActionDispatcher` runs the handlers
+concurrently instead::
+
+    dispatcher = ActionDispatcher(subscriber, max_concurrency=16, key=lambda action: action.account)
+
+    async for response in dispatcher.handle_incoming_actions():
+        await push_socket.push(response)
+"""
+
+import asyncio
+import logging
+from typing import Callable, Hashable, Union
+
+from meru.base import Action
+from meru.constants import MERU_HANDLER_CONCURRENCY
+from meru.handlers import flush_batches, handle_action, next_batch_deadline
+from meru.state import update_state
+
+logger = logging.getLogger("meru.dispatch")
+
+
+class ActionDispatcher:  # pylint: disable=too-many-instance-attributes
+    """Handles the actions received by a subscriber concurrently.
+
+    At most ``max_concurrency`` actions are handled at the same time.  When the limit is reached, no
+    further actions are received until a handler finishes, so the actions queue up in the socket.
+
+    Actions for which ``key`` returns the same value are handled one after another in the order
+    they were received, e.g. all actions concerning the same entity.  Actions with the key ``None``
+    are not ordered.  The states are updated by :py:meth:`dispatch` in the order the actions were
+    received, regardless of the key, only the action handlers run concurrently.
+
+    Parameters:
+        subscriber: The :py:class:`meru.sockets.SubscriberSocket` the actions are received from.
+        max_concurrency: Maximum number of actions handled at the same time.
+        key: Returns the ordering key of an action.  Without a function, the actions are not
+            ordered at all.
+    """
+
+    def __init__(
+        self,
+        subscriber,
+        max_concurrency: int = MERU_HANDLER_CONCURRENCY,
+        key: Union[Callable[[Action], Hashable], None] = None,
+    ):
+        self.subscriber = subscriber
+        self.max_concurrency = max_concurrency
+        self.key = key
+
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._responses = asyncio.Queue(maxsize=max_concurrency)
+        self._tails = {}
+        self._tasks = set()
+        self._failure = None
+
+    @property
+    def active(self) -> int:
+        """The number of actions that are currently handled."""
+        return len(self._tasks)
+
+    async def dispatch(self, action: Action):
+        """Start handling an action.
+
+        Waits until less than ``max_concurrency`` actions are handled.  The states are updated
+        before this method returns.
+
+        Parameters:
+            action: The action.
+        """
+        await self._slots.acquire()
+        try:
+            await update_state(action)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        key = self.key(action) if self.key is not None else None
+        previous = self._tails.get(key, None) if key is not None else None
+
+        task = asyncio.ensure_future(
+            self._handle(handle_action(action, update=False), previous)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        if key is not None:
+            self._tails[key] = task
+            task.add_done_callback(lambda _: self._release_key(key, task))
+
+    def _release_key(self, key, task):
+        if self._tails.get(key, None) is task:
+            del self._tails[key]
+
+    async def flush(self):
+        """Start calling the batch handlers whose batches are due.
+
+        Waits until less than ``max_concurrency`` actions are handled.
+        """
+        await self._slots.acquire()
+        task = asyncio.ensure_future(self._handle(flush_batches(), None))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, responses, previous: Union[asyncio.Future, None]):
+        try:
+            if previous is not None:
+                await asyncio.wait({previous})
+            async for response in responses:
+                await self._responses.put(response)
+        except Exception as exc:  # pylint: disable=broad-except
+            self._fail(exc)
+        finally:
+            self._slots.release()
+
+    def _fail(self, exc: Exception):
+        if self._failure is not None and not self._failure.done():
+            self._failure.set_exception(exc)
+        else:
+            # Nobody waits for the exception, e.g. if dispatch is used without
+            # handle_incoming_actions, or another exception was raised already.
+            logger.exception("Unhandled exception while handling actions", exc_info=exc)
+
+    async def _receive(self):
+        try:
+            loop = asyncio.get_event_loop()
+            while True:
+                deadline = next_batch_deadline()
+                if deadline is None:
+                    await self.dispatch(await self.subscriber.receive_action())
+                    continue
+
+                try:
+                    action = await asyncio.wait_for(
+                        self.subscriber.receive_action(), max(0, deadline - loop.time())
+                    )
+                except asyncio.TimeoutError:
+                    await self.flush()
+                else:
+                    await self.dispatch(action)
+        except Exception as exc:  # pylint: disable=broad-except
+            self._fail(exc)
+
+    async def handle_incoming_actions(self):
+        """Receive actions and handle them concurrently until the generator is closed.
+
+        Yields:
+            Actions returned by the handlers in the order they are returned.
+
+        Raises:
+            Exception: The first exception raised by a handler or the subscriber.
+        """
+        self._failure = asyncio.get_event_loop().create_future()
+        receiver = asyncio.ensure_future(self._receive())
+        response = None
+
+        try:
+            while True:
+                response = asyncio.ensure_future(self._responses.get())
+                done, _ = await asyncio.wait(
+                    {response, self._failure}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if response not in done:
+                    response.cancel()
+                    self._failure.result()
+                yield response.result()
+        finally:
+            receiver.cancel()
+            if response is not None:
+                response.cancel()
+            for task in list(self._tasks):
+                task.cancel()
+            if self._failure.done():
+                # The exception was raised already, do not report it as never retrieved.
+                self._failure.exception()
@@ -7,22 +7,46 @@ populated by the action handlers of the process that is run.
 """
 
 import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import inspect
 from collections import namedtuple
+from functools import partial
+from typing import Union
 
-from zmq import Again
-
+from meru import state
 from meru.actions import Ping
-from meru.exceptions import PingTimeout
-from meru.introspection import inspect_action_handler_args
-from meru.state import StateNode, get_state, register_state, update_state
+from meru.base import Action
+from meru.constants import (
+    MERU_HANDLER_BATCH_INTERVAL,
+    MERU_HANDLER_BATCH_SIZE,
+    MERU_PROCESS_POOL_SIZE,
+    MERU_THREAD_POOL_SIZE,
+)
+from meru.exceptions import HandlerException, PingTimeout
+from meru.introspection import inspect_action_handler_args, is_batch_action_handler
+from meru.state import StateNode, load_state, register_state, update_state
 
 HANDLERS = {}
-
-ActionHandler = namedtuple("ActionHandler", "func calling_args")
-
-
-def register_action_handler(func):
+# The pools of action handlers registered with an executor, created on first use.
+EXECUTORS = {}
+
+# Actions collected for batch action handlers by action class.
+PENDING_BATCHES = {}
+
+ActionHandler = namedtuple(
+    "ActionHandler", "func calling_args executor batch", defaults=(None, None)
+)
+BatchWindow = namedtuple("BatchWindow", "size interval")
+PendingBatch = namedtuple("PendingBatch", "deadline actions")
+
+
+def register_action_handler(
+    func=None,
+    *,
+    executor: str = None,
+    batch_size: int = MERU_HANDLER_BATCH_SIZE,
+    batch_interval: int = MERU_HANDLER_BATCH_INTERVAL,
+):
     """Register an action handler.
 
     This function can be used as an attribute::
@@ -31,11 +55,61 @@ def register_action_handler(func):
         def handle_example_action(action: ExampleAction):
             return AnotherAction()
 
+    Handlers annotated with a list of actions are batch handlers.  They are called with the actions
+    collected until ``batch_size`` actions arrived or ``batch_interval`` passed since the first
+    one::
+
+        @register_action_handler(batch_size=1000)
+        async def handle_example_actions(actions: List[ExampleAction]):
+            await bulk_insert(actions)
+            return AnotherAction(len(actions))
+
+    CPU-bound handlers can be run in a pool of threads or processes, so they do not block the event
+    loop.  Those handlers must not be coroutine functions::
+
+        @register_action_handler(executor="process")
+        def handle_example_action(action: ExampleAction, some_state: SomeState):
+            return AnotherAction(expensive_computation(action, some_state))
+
+    Handlers run in a process receive copies of the states, changes to those are lost.  The
+    handlers as well as their arguments and results have to be picklable.  The sizes of the pools
+    are set by :py:const:`meru.constants.MERU_THREAD_POOL_SIZE` and
+    :py:const:`meru.constants.MERU_PROCESS_POOL_SIZE`.
+
     Parameters:
         func: The action handler function.
+        executor: ``"thread"`` or ``"process"`` to run the handler in a pool, ``None`` to run it in
+            the event loop.
+        batch_size: Maximum number of actions passed to a batch handler.
+        batch_interval: Maximum time in µs an action waits for its batch to be handled.
+
+    Raises:
+        HandlerException: If the executor is not supported for the handler.
     """
+    if func is None:
+        return partial(
+            register_action_handler,
+            executor=executor,
+            batch_size=batch_size,
+            batch_interval=batch_interval,
+        )
+
+    if executor not in (None, "thread", "process"):
+        raise HandlerException(
+            f'Executor "{executor}" not supported. Use either "thread" or "process".'
+        )
+    if executor is not None and (
+        inspect.iscoroutinefunction(func) or inspect.isasyncgenfunction(func)
+    ):
+        raise HandlerException(
+            f"Handler '{func.__name__}' is a coroutine function and can not run in an executor."
+        )
+
     action, required_states = inspect_action_handler_args(func)
-    handler = ActionHandler(func, required_states)
+    batch = None
+    if is_batch_action_handler(func):
+        batch = BatchWindow(batch_size, batch_interval / 1_000_000)
+    handler = ActionHandler(func, required_states, executor, batch)
     HANDLERS[action] = handler
 
     for state_cls in required_states:
@@ -44,13 +118,75 @@ def register_action_handler(func):
     return func
 
 
-async def handle_action(action):
+def get_executor(executor: str):
+    """Returns the pool that runs the action handlers of an executor type.
+
+    Parameters:
+        executor: ``"thread"`` or ``"process"``.
+    """
+    pool = EXECUTORS.get(executor, None)
+    if pool is None:
+        if executor == "process":
+            pool = ProcessPoolExecutor(MERU_PROCESS_POOL_SIZE)
+        else:
+            pool = ThreadPoolExecutor(MERU_THREAD_POOL_SIZE, thread_name_prefix="meru-handler")
+        EXECUTORS[executor] = pool
+    return pool
+
+
+def shutdown_executors(wait: bool = True):
+    """Shut down the pools of action handlers registered with an executor.
+
+    Parameters:
+        wait: Wait for the running handlers to finish.
+    """
+    for pool in EXECUTORS.values():
+        pool.shutdown(wait=wait)
+    EXECUTORS.clear()
+
+
+def _run_handler(func, action, states):
+    # Runs in the executor, generators are exhausted there as well.
+    if inspect.isgeneratorfunction(func):
+        return list(func(action, *states))
+    return [func(action, *states)]
+
+
+def get_handled_topics():
+    """Returns the topics of all actions handled by this process.
+
+    This includes the actions of registered action handlers and of the state action handlers of
+    registered :py:class:`StateNode` classes.  State action handlers also handle the subclasses of
+    their action classes, so the topics of the subclasses are included as well.
+
+    Returns:
+        A set of topics.
+    """
+    state_action_classes = set()
+    pending = [
+        cls
+        for cls, handlers in state.STATE_ACTION_HANDLERS.items()
+        if handlers and inspect.isclass(cls) and issubclass(cls, Action)
+    ]
+    while pending:
+        cls = pending.pop()
+        if cls not in state_action_classes:
+            state_action_classes.add(cls)
+            pending.extend(cls.__subclasses__())
+    return {cls.topic for cls in state_action_classes.union(HANDLERS)}
+
+
+async def handle_action(action, update: bool = True):
     """Call the registered action handlers that handle ``action``.
 
-    This function does nothing if there is no handler registered for ``action``.
+    This function does nothing if there is no handler registered for ``action``.  Actions for batch
+    handlers are collected and the handler is only called once the batch is full.  Batches whose
+    interval passed are handled by :py:func:`flush_batches`.
 
     Parameters:
         action: An object of a class deriving from :py:class:`Action`.
+        update: Update the states with ``action`` before calling the handler.  Disabled by callers
+            that updated the states already, see :py:class:`meru.dispatch.ActionDispatcher`.
 
     Yields:
         Actions yielded by the handler, if one is found.
@@ -58,18 +194,72 @@ async def handle_action(action):
     action_cls = action.__class__
     handler = HANDLERS.get(action_cls, None)
 
-    await update_state(action)
+    if update:
+        await update_state(action)
 
     if not handler:
         return
 
-    states_to_inject = [get_state(cls) for cls in handler.calling_args]
+    if handler.batch is not None:
+        pending = PENDING_BATCHES.get(action_cls, None)
+        if pending is None:
+            deadline = asyncio.get_event_loop().time() + handler.batch.interval
+            pending = PENDING_BATCHES[action_cls] = PendingBatch(deadline, [])
+        pending.actions.append(action)
+
+        if len(pending.actions) >= handler.batch.size:
+            del PENDING_BATCHES[action_cls]
+            async for response in _call_handler(handler, pending.actions):
+                yield response
+        return
+
+    async for response in _call_handler(handler, action):
+        yield response
+
+
+def next_batch_deadline() -> Union[float, None]:
+    """Returns the event loop time at which the next batch is due, ``None`` if there is no batch."""
+    if not PENDING_BATCHES:
+        return None
+    return min(pending.deadline for pending in PENDING_BATCHES.values())
+
+
+async def flush_batches(force: bool = False):
+    """Call the batch handlers whose batches are due.
 
-    if inspect.isasyncgenfunction(handler.func):
-        async for action in handler.func(action, *states_to_inject):
+    Parameters:
+        force: Call the batch handlers of all collected actions.
+
+    Yields:
+        Actions yielded by the handlers.
+    """
+    now = asyncio.get_event_loop().time()
+    for action_cls, pending in list(PENDING_BATCHES.items()):
+        if force or pending.deadline <= now:
+            del PENDING_BATCHES[action_cls]
+            async for response in _call_handler(HANDLERS[action_cls], pending.actions):
+                yield response
+
+
+async def _call_handler(handler: ActionHandler, argument):
+    states_to_inject = [await load_state(cls) for cls in handler.calling_args]
+
+    if handler.executor is not None:
+        loop = asyncio.get_event_loop()
+        responses = await loop.run_in_executor(
+            get_executor(handler.executor),
+            _run_handler,
+            handler.func,
+            argument,
+            states_to_inject,
+        )
+        for response in responses:
+            yield response
+    elif inspect.isasyncgenfunction(handler.func):
+        async for action in handler.func(argument, *states_to_inject):
             yield action
     else:
-        yield await handler.func(action, *states_to_inject)
+        yield await handler.func(argument, *states_to_inject)
 
 
 async def ping_pong():
@@ -96,11 +286,10 @@ async def ping_pong():
 
     while True:
         action = Ping()
-        await state_consumer.send(action)
 
         try:
-            await state_consumer.receive()
-        except Again:
+            await state_consumer.request(action)
+        except asyncio.TimeoutError:
             raise PingTimeout() from None
 
         await asyncio.sleep(10)
@@ -1,12 +1,31 @@
 """Functionality related to action handlers."""
 import os
 import socket
+import time
 from datetime import datetime
 from functools import lru_cache
 from importlib import import_module
 from typing import Type
 
-from meru.constants import MERU_HOSTNAME_IN_IDENTITY
+from meru.constants import (
+    MERU_HOSTNAME_IN_IDENTITY,
+    MERU_IPC_PATH,
+    MERU_LANE_PORT_OFFSET,
+    MERU_TRANSPORT,
+)
+
+
+# Offset of the monotonic clock to the Unix time, fixed when the process starts.
+_monotonic_offset_ns = time.time_ns() - time.monotonic_ns()
+
+
+def now_ns() -> int:
+    """Returns the current Unix time in ns.
+
+    The time is based on the monotonic clock, so it has the full resolution of the clock and
+    does not jump when the wall clock is adjusted while the process runs.
+    """
+    return time.monotonic_ns() + _monotonic_offset_ns
 
 
 def get_full_path_to_class(cls: Type) -> str:
@@ -27,10 +46,12 @@ def get_full_path_to_class(cls: Type) -> str:
     return f"{mod}.{name}"
 
 
+@lru_cache(maxsize=None)
 def get_type_from_string(cls_path: str) -> Type:
     """Returns the class specified by the given absolute class name.
 
-    This is the inverse operation to :py:func:`get_full_path_to_class`.
+    This is the inverse operation to :py:func:`get_full_path_to_class`.  The result is cached, as
+    the broker resolves the same names for every state request.
 
     Parameters:
         cls_path: The absolute class name.
@@ -45,11 +66,37 @@ def get_type_from_string(cls_path: str) -> Type:
     return getattr(import_module(module_name), class_name)
 
 
-def build_address(ip_address, port):
-    """Build a TCP URL from the address and port."""
+def build_address(ip_address, port, transport=MERU_TRANSPORT):
+    """Build a ZeroMQ URL from the address and port.
+
+    For the ``ipc`` and ``inproc`` transports the port only serves as a name for the endpoint and
+    the address is ignored.
+
+    Parameters:
+        ip_address: The address to bind or connect to.
+        port: The port of the endpoint.
+        transport: One of ``"tcp"``, ``"ipc"`` or ``"inproc"``.
+    """
+    if transport == "ipc":
+        return f"ipc://{os.path.join(MERU_IPC_PATH, f'meru-{port}.ipc')}"
+    if transport == "inproc":
+        return f"inproc://meru-{port}"
     return f"tcp://{ip_address}:{port}"
 
 
+def get_lane_port(port, lane: int) -> str:
+    """Returns the port of a priority lane.
+
+    Parameters:
+        port: The port of lane 0.
+        lane: The priority lane.
+
+    Returns:
+        The port increased by ``lane`` times :py:const:`meru.constants.MERU_LANE_PORT_OFFSET`.
+    """
+    return str(int(port) + lane * MERU_LANE_PORT_OFFSET)
+
+
 @lru_cache
 def get_process_identity():
     """
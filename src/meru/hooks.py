@@ -0,0 +1,203 @@
+"""Hooks around encoding, decoding, sending, receiving, handling and state updates.
+
+Hooks are plain functions that are called before and after the instrumented functions::
+
+    def trace_send(result, elapsed, socket, action):
+        tracer.record(action.topic, elapsed)
+
+    register_hook("send", after=trace_send)
+
+``before`` hooks are called with the arguments of the instrumented function, ``after`` hooks with
+the return value, the elapsed time in seconds and the same arguments.  For methods of the sockets
+the first argument is the socket.  ``after`` hooks receive the return value, so they are not called
+if a function raises.  Async generators, like :py:func:`meru.handlers.handle_action`, return
+nothing, their ``after`` hooks are called with ``None`` whenever the generator finishes, i.e. also
+if it raises or is closed before it is exhausted.
+
+==================  ====================================================================
+Hook point          Instrumented functions
+==================  ====================================================================
+``"encode"``        :py:func:`meru.serialization.encode_object` and
+                    :py:func:`meru.serialization.encode_with_fragments`, which returns ``None``
+                    if the serialization method does not support fragments
+``"decode"``        :py:func:`meru.serialization.decode_object`
+``"send"``          ``publish``, ``push`` and the sending methods of the state sockets
+``"receive"``       ``collect``, ``receive_action``, ``receive_many`` and the receiving
+                    methods of the state sockets
+``"handle"``        :py:func:`meru.handlers.handle_action`, returns ``None``
+``"update_state"``  :py:func:`meru.state.update_state`
+==================  ====================================================================
+
+A hook point costs nothing while no hook is registered for it.  The instrumented functions are only
+replaced by wrappers when the first hook is registered, and restored when the last one is removed.
+"""
+
+from functools import wraps
+import inspect
+import time
+from typing import Callable, Union
+
+from meru import dispatch, handlers, persistence, relay, serialization, sockets, state
+from meru.exceptions import MeruException
+
+# The functions of every hook point by owner.  Modules that imported a function by name are listed
+# as owners as well.
+HOOK_POINTS = {
+    "encode": (
+        ((serialization, sockets, state, persistence), "encode_object"),
+        # The state manager assembles state replies from cached nodes.
+        ((serialization, state), "encode_with_fragments"),
+    ),
+    "decode": (
+        ((serialization, sockets, relay, persistence), "decode_object"),
+    ),
+    "send": (
+        ((sockets.PublisherSocket,), "publish"),
+        ((sockets.PushSocket,), "push"),
+        # answer_state_request, send and reply of the state manager go through reply_encoded.
+        ((sockets.StateManagerSocket,), "reply_encoded"),
+        ((sockets.StateConsumerSocket,), "send"),
+        ((sockets.StateConsumerSocket,), "request"),
+    ),
+    "receive": (
+        ((sockets.CollectorSocket,), "collect"),
+        ((sockets.SubscriberSocket,), "receive_action"),
+        ((sockets.SubscriberSocket,), "receive_many"),
+        # get_state_request goes through receive_request.
+        ((sockets.StateManagerSocket,), "receive_request"),
+        ((sockets.StateConsumerSocket,), "receive"),
+    ),
+    "handle": (
+        ((handlers, dispatch), "handle_action"),
+    ),
+    "update_state": (
+        ((state, handlers, dispatch), "update_state"),
+    ),
+}
+
+# The registered hooks by hook point.
+BEFORE_HOOKS = {point: [] for point in HOOK_POINTS}
+AFTER_HOOKS = {point: [] for point in HOOK_POINTS}
+
+# The original functions replaced by wrappers, by owner and attribute name.
+_originals = {}
+
+
+def register_hook(
+    point: str, before: Union[Callable, None] = None, after: Union[Callable, None] = None
+):
+    """Call functions before and after the functions of a hook point.
+
+    Parameters:
+        point: The hook point, one of the keys of :py:data:`HOOK_POINTS`.
+        before: Called with the arguments of the instrumented function.
+        after: Called with the return value, the elapsed time in seconds and the arguments of the
+            instrumented function.
+
+    Raises:
+        :py:class:`meru.exceptions.MeruException` if the hook point does not exist.
+    """
+    _check_point(point)
+    if before is not None:
+        BEFORE_HOOKS[point].append(before)
+    if after is not None:
+        AFTER_HOOKS[point].append(after)
+    _install(point)
+
+
+def remove_hook(
+    point: str, before: Union[Callable, None] = None, after: Union[Callable, None] = None
+):
+    """Remove hooks registered with :py:func:`register_hook`.
+
+    Raises:
+        :py:class:`meru.exceptions.MeruException` if the hook point does not exist.
+    """
+    _check_point(point)
+    if before in BEFORE_HOOKS[point]:
+        BEFORE_HOOKS[point].remove(before)
+    if after in AFTER_HOOKS[point]:
+        AFTER_HOOKS[point].remove(after)
+    if not BEFORE_HOOKS[point] and not AFTER_HOOKS[point]:
+        _uninstall(point)
+
+
+def clear_hooks():
+    """Remove all hooks and restore the instrumented functions."""
+    for point in HOOK_POINTS:
+        BEFORE_HOOKS[point].clear()
+        AFTER_HOOKS[point].clear()
+        _uninstall(point)
+
+
+def _check_point(point: str):
+    if point not in HOOK_POINTS:
+        raise MeruException(
+            f'Hook point "{point}" does not exist. Use one of {", ".join(HOOK_POINTS)}'
+        )
+
+
+def _install(point: str):
+    before_hooks = BEFORE_HOOKS[point]
+    after_hooks = AFTER_HOOKS[point]
+    for owners, name in HOOK_POINTS[point]:
+        for owner in owners:
+            if (owner, name) in _originals:
+                continue
+            original = getattr(owner, name)
+            _originals[owner, name] = original
+            setattr(owner, name, _wrap(original, before_hooks, after_hooks))
+
+
+def _uninstall(point: str):
+    for owners, name in HOOK_POINTS[point]:
+        for owner in owners:
+            original = _originals.pop((owner, name), None)
+            if original is not None:
+                setattr(owner, name, original)
+
+
+def _wrap(func, before_hooks: list, after_hooks: list):
+    # The hook lists are read on every call, so hooks registered later take effect immediately.
+    if inspect.isasyncgenfunction(func):
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            for hook in before_hooks:
+                hook(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                async for item in func(*args, **kwargs):
+                    yield item
+            finally:
+                elapsed = time.perf_counter() - start
+                for hook in after_hooks:
+                    hook(None, elapsed, *args, **kwargs)
+
+    elif inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            for hook in before_hooks:
+                hook(*args, **kwargs)
+            start = time.perf_counter()
+            result = await func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            for hook in after_hooks:
+                hook(result, elapsed, *args, **kwargs)
+            return result
+
+    else:
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            for hook in before_hooks:
+                hook(*args, **kwargs)
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            for hook in after_hooks:
+                hook(result, elapsed, *args, **kwargs)
+            return result
+
+    return wrapper
@@ -39,6 +39,11 @@ def inspect_action_handler_args(func: callable):
         async def do_something(action, some_param: int):
             pass
 
+    Batch handlers receive a list of actions instead::
+
+        async def do_something(actions: List[SomeActionClass], some_state: SomeStateClass):
+            pass
+
     Parameters:
         func:
 
@@ -49,7 +54,17 @@ def inspect_action_handler_args(func: callable):
     signature = inspect.signature(func)
 
     for param in signature.parameters.values():
-        if issubclass(param.annotation, Action):
+        if _is_action_list(param.annotation):
+            if found_action is not None:
+                raise HandlerException("An action handler can have only one action.")
+            found_action = get_args(param.annotation)[0]
+        elif not inspect.isclass(param.annotation):
+            raise HandlerException(
+                f"Error registering {func.__name__}. "
+                f"An action handler can only have Actions and StateNodes as calling args. "
+                f"'{param}' is invalid."
+            )
+        elif issubclass(param.annotation, Action):
             if found_action is not None:
                 raise HandlerException("An action handler can have only one action.")
             found_action = param.annotation
@@ -73,6 +88,23 @@ def inspect_action_handler_args(func: callable):
     return found_action, required_states
 
 
+def is_batch_action_handler(func: callable) -> bool:
+    """Returns whether an action handler receives a list of actions.
+
+    See Also:
+        :py:func:`inspect_action_handler_args`
+    """
+    signature = inspect.signature(func)
+    return any(_is_action_list(param.annotation) for param in signature.parameters.values())
+
+
+def _is_action_list(annotation) -> bool:
+    if get_origin(annotation) is not list:
+        return False
+    arguments = get_args(annotation)
+    return len(arguments) == 1 and inspect.isclass(arguments[0]) and issubclass(arguments[0], Action)
+
+
 @lru_cache(maxsize=None)
 def get_subclasses(base_cls: type):
     all_subclasses = {}
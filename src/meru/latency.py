@@ -0,0 +1,112 @@
+"""HDR-style latency histograms per action class.
+
+Subscribers created with ``track_latency`` record the latency of every received action, see
+:py:class:`meru.sockets.SubscriberSocket`.  The latency is split into segments:
+
+``"end_to_end"``
+    From :py:attr:`meru.base.Action.timestamp_ns` to the reception by the subscriber.
+``"producer_to_broker"``
+    From ``timestamp_ns`` to the first hop stamp added by the broker.
+``"broker_to_consumer"``
+    From the last hop stamp to the reception by the subscriber.
+
+Hop stamps are only added by brokers that use ``stamp_hops``, see
+:py:class:`meru.relay.ActionRelay` and :py:class:`meru.sockets.PublisherSocket`.  Latencies
+between processes depend on synchronized clocks.
+"""
+
+from collections import defaultdict
+import math
+from typing import Sequence, Type, Union
+
+from meru.base import Action
+from meru.helpers import now_ns
+
+# The histograms by action class name and segment.
+LATENCIES = {}
+
+
+class LatencyHistogram:
+    """Counts latencies in ns with a bounded relative error, like an HdrHistogram.
+
+    Every power of two is split into ``2 ** (significant_bits - 1)`` linear buckets, so the
+    relative error of the reported values stays below ``2 ** (1 - significant_bits)`` for any
+    magnitude while the number of buckets grows only logarithmically.
+
+    Parameters:
+        significant_bits: The precision of the buckets.
+
+    Attributes:
+        count: Number of recorded values.
+        total: Sum of the recorded values.
+        max: The largest recorded value.
+    """
+
+    def __init__(self, significant_bits: int = 7):
+        self.significant_bits = significant_bits
+        self.counts = defaultdict(int)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value: int):
+        value = max(int(value), 0)
+        shift = max(value.bit_length() - self.significant_bits, 0)
+        self.counts[(shift << self.significant_bits) + (value >> shift)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percentile: float) -> int:
+        """Returns the value below or equal to which ``percentile`` percent of the values are.
+
+        The value is the upper bound of the bucket, but never larger than :py:attr:`max`.
+        """
+        if not self.count:
+            return 0
+
+        rank = max(math.ceil(percentile / 100 * self.count), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                shift, sub_bucket = divmod(index, 1 << self.significant_bits)
+                return min(((sub_bucket + 1) << shift) - 1, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+def get_latency_histogram(
+    action_cls: Union[Type[Action], str], segment: str = "end_to_end"
+) -> LatencyHistogram:
+    """Returns the histogram of an action class and segment, it is created if necessary."""
+    name = action_cls if isinstance(action_cls, str) else action_cls.__name__
+    histogram = LATENCIES.get((name, segment), None)
+    if histogram is None:
+        histogram = LATENCIES[name, segment] = LatencyHistogram()
+    return histogram
+
+
+def record_latencies(action: Action, hops: Sequence[int] = (), now: Union[int, None] = None):
+    """Record the latencies of a received action.
+
+    Parameters:
+        action: The received action.
+        hops: The hop stamps of the message, see :py:func:`meru.sockets.get_hops`.
+        now: The time of the reception in ns, defaults to :py:func:`meru.helpers.now_ns`.
+    """
+    if now is None:
+        now = now_ns()
+    name = action.__class__.__name__
+    get_latency_histogram(name).record(now - action.timestamp_ns)
+    if hops:
+        get_latency_histogram(name, "producer_to_broker").record(hops[0] - action.timestamp_ns)
+        get_latency_histogram(name, "broker_to_consumer").record(now - hops[-1])
+
+
+def clear_latencies():
+    """Remove all histograms."""
+    LATENCIES.clear()
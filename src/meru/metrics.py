@@ -0,0 +1,353 @@
+"""Counters and histograms per action class with a Prometheus text endpoint.
+
+The metrics cost nothing until they are enabled.  :py:func:`enable_metrics` registers hooks for
+the serialization functions, the sending and receiving methods of the sockets in
+:py:mod:`meru.sockets`, :py:func:`meru.handlers.handle_action` and
+:py:func:`meru.state.update_state`, see :py:mod:`meru.hooks`::
+
+    enable_metrics()
+    asyncio.create_task(serve_metrics(9100))
+
+Processes started with :py:func:`meru.run_process` do this when ``MERU_METRICS`` is set.
+"""
+
+import asyncio
+from bisect import bisect_left
+import logging
+from typing import Dict, Sequence, Tuple, Union
+
+from meru.constants import BIND_ADDRESS, MERU_METRICS_PORT
+from meru.helpers import now_ns
+from meru.hooks import AFTER_HOOKS, register_hook, remove_hook
+from meru.latency import LATENCIES, clear_latencies
+from meru.sockets import CollectorSocket, PublisherSocket, PushSocket, SubscriberSocket
+
+logger = logging.getLogger("meru.metrics")
+
+# All metrics by name, in the order they are rendered.
+METRICS = {}
+
+# Upper bounds of the histogram buckets in seconds.
+DEFAULT_BUCKETS = (
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _format_labels(labelnames: Sequence[str], labels: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """A monotonically increasing value per combination of labels.
+
+    Parameters:
+        name: The metric name.
+        documentation: Rendered as the ``HELP`` line.
+        labelnames: The label names, the values are passed as a tuple in the same order.
+    """
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple, float] = {}
+        METRICS[name] = self
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+    def clear(self):
+        self.values.clear()
+
+
+class Gauge(Counter):
+    """A value per combination of labels that can go up and down."""
+
+    type_name = "gauge"
+
+    def set(self, labels: Tuple, value: float):
+        self.values[labels] = value
+
+
+class Histogram:
+    """Counts observed values in cumulative buckets per combination of labels.
+
+    Parameters:
+        name: The metric name.
+        documentation: Rendered as the ``HELP`` line.
+        labelnames: The label names, the values are passed as a tuple in the same order.
+        buckets: Sorted upper bounds of the buckets.
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per labels the counts of all buckets, the last one is +Inf, followed by the sum.
+        self.values: Dict[Tuple, list] = {}
+        METRICS[name] = self
+
+    def observe(self, labels: Tuple, value: float):
+        counts = self.values.get(labels, None)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def count(self, labels: Tuple = ()) -> int:
+        counts = self.values.get(labels, None)
+        return sum(counts[:-1]) if counts else 0
+
+    def render(self):
+        for labels, counts in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                label_str = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                yield f"{self.name}_bucket{label_str} {cumulative}"
+            label_str = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_str} {counts[-1]}"
+            yield f"{self.name}_count{label_str} {cumulative}"
+
+    def clear(self):
+        self.values.clear()
+
+
+class LatencySummary:
+    """Renders the latency histograms of :py:mod:`meru.latency` as a summary."""
+
+    type_name = "summary"
+    quantiles = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        METRICS[name] = self
+
+    def render(self):
+        for (action, segment), histogram in LATENCIES.items():
+            labels = f'action="{_escape(action)}",segment="{segment}"'
+            for quantile in self.quantiles:
+                value = histogram.percentile(quantile * 100) / 1e9
+                yield f'{self.name}{{{labels},quantile="{quantile}"}} {value}'
+            yield f"{self.name}_sum{{{labels}}} {histogram.total / 1e9}"
+            yield f"{self.name}_count{{{labels}}} {histogram.count}"
+
+    def clear(self):
+        clear_latencies()
+
+
+ACTIONS_SENT = Counter(
+    "meru_actions_sent_total", "Actions sent to the broker or subscribers.", ["action"]
+)
+ACTIONS_RECEIVED = Counter(
+    "meru_actions_received_total",
+    "Actions received from the broker or processes.",
+    ["action", "origin"],
+)
+ACTION_LATENCY = Histogram(
+    "meru_action_latency_seconds",
+    "Time between the creation of an action and its reception.",
+    ["action", "origin"],
+)
+# Only the messages unpacked by meru are counted, not the messages queued by ZeroMQ.
+UNPACKED_PENDING_MESSAGES = Gauge(
+    "meru_unpacked_pending_messages",
+    "Messages unpacked from received batches that were not received yet.",
+    ["socket"],
+)
+ENCODED_BYTES = Counter("meru_encoded_bytes_total", "Size of the encoded objects.", ["object"])
+ENCODE_DURATION = Histogram(
+    "meru_encode_duration_seconds", "Time to encode an object.", ["object"]
+)
+DECODED_BYTES = Counter("meru_decoded_bytes_total", "Size of the decoded objects.", ["object"])
+DECODE_DURATION = Histogram(
+    "meru_decode_duration_seconds", "Time to decode an object.", ["object"]
+)
+HANDLER_DURATION = Histogram(
+    "meru_handler_duration_seconds",
+    "Time to handle an action, including state updates.",
+    ["action"],
+)
+STATE_UPDATE_DURATION = Histogram(
+    "meru_state_update_duration_seconds", "Time to update the states with an action.", ["action"]
+)
+LATENCY_SUMMARY = LatencySummary(
+    "meru_latency_seconds", "Latencies per hop of the actions received by subscribers."
+)
+
+
+def render_metrics() -> str:
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS.values():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def clear_metrics():
+    """Reset all metrics."""
+    for metric in METRICS.values():
+        metric.clear()
+
+
+def _record_received(socket, action):
+    name = action.__class__.__name__
+    origin = getattr(action, "origin", "")
+    ACTIONS_RECEIVED.inc((name, origin))
+    ACTION_LATENCY.observe((name, origin), max(0, now_ns() - action.timestamp_ns) / 1e9)
+    UNPACKED_PENDING_MESSAGES.set((socket.__class__.__name__,), socket.unpacked_pending)
+
+
+def _after_encode(data, elapsed, obj, *_args, **_kwargs):
+    if data is None:
+        # encode_with_fragments falls back to encode_object, which is recorded on its own.
+        return
+    labels = (obj.__class__.__name__,)
+    ENCODE_DURATION.observe(labels, elapsed)
+    ENCODED_BYTES.inc(labels, len(data))
+
+
+def _after_decode(obj, elapsed, data, *_args, **_kwargs):
+    labels = (obj.__class__.__name__,)
+    DECODE_DURATION.observe(labels, elapsed)
+    DECODED_BYTES.inc(labels, len(data))
+
+
+def _after_send(_result, _elapsed, socket, *args, **_kwargs):
+    if isinstance(socket, (PushSocket, PublisherSocket)):
+        ACTIONS_SENT.inc((args[0].__class__.__name__,))
+
+
+def _after_receive(result, _elapsed, socket, *_args, **_kwargs):
+    if isinstance(socket, CollectorSocket):
+        _record_received(socket, result)
+    elif isinstance(socket, SubscriberSocket):
+        for action in result if isinstance(result, list) else (result,):
+            _record_received(socket, action)
+
+
+def _after_handle(_result, elapsed, action, *_args, **_kwargs):
+    HANDLER_DURATION.observe((action.__class__.__name__,), elapsed)
+
+
+def _after_update_state(_result, elapsed, action):
+    STATE_UPDATE_DURATION.observe((action.__class__.__name__,), elapsed)
+
+
+_METRIC_HOOKS = {
+    "encode": _after_encode,
+    "decode": _after_decode,
+    "send": _after_send,
+    "receive": _after_receive,
+    "handle": _after_handle,
+    "update_state": _after_update_state,
+}
+
+
+def enable_metrics():
+    """Start recording metrics.
+
+    The metrics are recorded by hooks, see :py:mod:`meru.hooks`, so there is no overhead while
+    the metrics are disabled.
+    """
+    if metrics_enabled():
+        return
+
+    for point, hook in _METRIC_HOOKS.items():
+        register_hook(point, after=hook)
+
+
+def disable_metrics():
+    """Stop recording metrics."""
+    for point, hook in _METRIC_HOOKS.items():
+        remove_hook(point, after=hook)
+
+
+def metrics_enabled() -> bool:
+    return all(hook in AFTER_HOOKS[point] for point, hook in _METRIC_HOOKS.items())
+
+
+async def _answer_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = render_metrics().encode()
+        writer.write(
+            b"HTTP/1.0 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            b"Content-Length: %d\r\n\r\n" % len(body)
+        )
+        writer.write(body)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(
+    port: Union[int, str] = MERU_METRICS_PORT, host: str = BIND_ADDRESS
+) -> asyncio.AbstractServer:
+    """Serve the metrics to Prometheus.
+
+    Every request is answered with :py:func:`render_metrics`, regardless of the path.
+
+    Parameters:
+        port: The TCP port, ``0`` picks a free port.  Defaults to
+            :py:const:`meru.constants.MERU_METRICS_PORT`.
+        host: The address to bind.
+
+    Returns:
+        The started server.
+    """
+    server = await asyncio.start_server(_answer_scrape, host, int(port))
+    port = server.sockets[0].getsockname()[1]
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+async def serve_metrics(port: Union[int, str] = MERU_METRICS_PORT, host: str = BIND_ADDRESS):
+    """Serve the metrics until cancelled, see :py:func:`start_metrics_server`."""
+    server = await start_metrics_server(port, host)
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,487 @@
+"""Persistence of the broker's state nodes.
+
+The broker keeps all state nodes in memory.  Snapshots of the nodes are written to a local file, so
+a restarted broker can continue with the previous state instead of waiting for the processes to send
+their data again.  Between two snapshots, the actions that change the state nodes are appended to a
+:py:class:`StateJournal`, so the changes since the last snapshot can be replayed after a crash::
+
+    register_state(SomeState)
+    journal = StateJournal()
+    await restore_states(journal=journal)
+    journal.open()
+    asyncio.create_task(run_snapshots(journal=journal))
+
+Snapshots and journal segments are unpickled when they are read, so they are only read if they
+belong to the current user and nobody else can write them.  Missing directories are created with
+access for the current user only.
+
+Snapshots consist of a short header followed by the pickled fields and versions of every registered
+state node.  The journal is split into numbered segment files, each a sequence of length prefixed,
+pickled actions.  Every snapshot starts a new segment and the older segments are deleted once the
+snapshot is written.
+"""
+
+import asyncio
+from dataclasses import fields
+import logging
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+from typing import List, Union
+
+from meru import state
+from meru.base import Action
+from meru.constants import (
+    MERU_STATE_JOURNAL_PATH,
+    MERU_STATE_JOURNAL_SEGMENT_SIZE,
+    MERU_STATE_SNAPSHOT_INTERVAL,
+    MERU_STATE_SNAPSHOT_PATH,
+)
+from meru.exceptions import MeruException
+from meru.helpers import get_full_path_to_class, get_type_from_string
+from meru.serialization import decode_object, encode_object
+
+logger = logging.getLogger("meru.persistence")
+
+SNAPSHOT_MAGIC = b"MERUSNAP\x01"
+JOURNAL_RECORD_HEADER = struct.Struct("!I")
+
+
+def _check_private(path: str, stat_result: os.stat_result):
+    """Make sure a file was written by the current user and can not be changed by anyone else.
+
+    Parameters:
+        path: The file, used in the error message.
+        stat_result: The status of the file.
+
+    Raises:
+        MeruException: If the file belongs to another user or is writable by the group or others.
+    """
+    if not hasattr(os, "getuid"):
+        return
+    if stat_result.st_uid != os.getuid() or stat_result.st_mode & 0o022:
+        raise MeruException(
+            f"{path} must belong to the current user and must not be writable by others."
+        )
+
+
+def _make_private_directory(directory: str):
+    """Create a directory only the current user can access, unless it exists already.
+
+    Files planted in an existing directory are still rejected by :py:func:`_check_private`, since
+    they belong to another user.
+
+    Parameters:
+        directory: The directory.
+    """
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+
+class StateJournal:
+    """An append-only log of the actions that change state nodes.
+
+    Once opened, :py:func:`meru.state.update_state` appends every action that has state action
+    handlers.  The records are flushed to the operating system after every action, so they survive
+    a crash of the broker, but not necessarily a crash of the machine.
+
+    Parameters:
+        directory: The directory of the segment files.
+        segment_size: Size in bytes after which a new segment is started.
+    """
+
+    def __init__(
+        self,
+        directory: str = MERU_STATE_JOURNAL_PATH,
+        segment_size: int = MERU_STATE_JOURNAL_SEGMENT_SIZE,
+    ):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segment = None
+        self._file = None
+
+    def segment_path(self, segment: int) -> str:
+        """Returns the file name of a segment."""
+        return os.path.join(self.directory, f"journal-{segment:08d}.log")
+
+    def segments(self) -> List[int]:
+        """Returns the numbers of all existing segments in ascending order."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+
+        return sorted(
+            int(name[8:-4])
+            for name in names
+            if name.startswith("journal-") and name.endswith(".log") and name[8:-4].isdigit()
+        )
+
+    def open(self):
+        """Start recording the actions passed to :py:func:`meru.state.update_state`.
+
+        Recording always starts with a new segment, so an incomplete record at the end of the
+        previous segment does not affect the new records.
+        """
+        _make_private_directory(self.directory)
+        segments = self.segments()
+        self._open_segment(segments[-1] + 1 if segments else 0)
+        state.enable_state_journal(self)
+
+    def close(self):
+        """Stop recording and close the current segment."""
+        if state._settings.journal is self:  # pylint: disable=protected-access
+            state.enable_state_journal(None)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open_segment(self, segment: int):
+        if self._file is not None:
+            self._file.close()
+        self.segment = segment
+        # The segment stays open until the next rotation.
+        self._file = os.fdopen(
+            os.open(self.segment_path(segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600),
+            "ab",
+        )
+        _check_private(self.segment_path(segment), os.fstat(self._file.fileno()))
+
+    def append(self, action: Action):
+        """Append an action to the current segment.
+
+        Parameters:
+            action: The action.
+        """
+        data = encode_object(action, "pickle")
+        self._file.write(JOURNAL_RECORD_HEADER.pack(len(data)))
+        self._file.write(data)
+        self._file.flush()
+
+        if self._file.tell() >= self.segment_size:
+            self.rotate()
+
+    def rotate(self) -> int:
+        """Start a new segment.
+
+        Returns:
+            The number of the new segment.
+        """
+        self._open_segment(self.segment + 1)
+        return self.segment
+
+    def compact(self, before: int):
+        """Delete all segments older than the given segment.
+
+        Parameters:
+            before: The oldest segment that is kept.
+        """
+        for segment in self.segments():
+            if segment >= before:
+                break
+            os.remove(self.segment_path(segment))
+            logger.debug(f"Deleted journal segment {segment}")
+
+    def read(self, since: int = 0):
+        """Iterate over the recorded actions.
+
+        Reading a segment stops at an incomplete record, which is left behind when the broker
+        crashes while appending.
+
+        Parameters:
+            since: The first segment that is read.
+
+        Yields:
+            The recorded actions in the order they were appended.
+
+        Raises:
+            MeruException: If a segment might have been written by another user.
+        """
+        for segment in self.segments():
+            if segment < since:
+                continue
+
+            with open(self.segment_path(segment), "rb") as segment_file:
+                _check_private(self.segment_path(segment), os.fstat(segment_file.fileno()))
+                data = segment_file.read()
+
+            offset = 0
+            while offset + JOURNAL_RECORD_HEADER.size <= len(data):
+                (length,) = JOURNAL_RECORD_HEADER.unpack_from(data, offset)
+                offset += JOURNAL_RECORD_HEADER.size
+                if offset + length > len(data):
+                    break
+                yield decode_object(data[offset : offset + length], "pickle")
+                offset += length
+
+            if offset != len(data):
+                logger.warning(f"Ignoring incomplete record at the end of journal {segment}")
+
+    async def replay(self, since: int = 0) -> int:
+        """Pass the recorded actions to :py:func:`meru.state.update_state` again.
+
+        The replayed actions are not recorded a second time.  Actions whose handlers raise an
+        exception are logged and skipped, so they can not prevent the broker from starting.
+
+        Parameters:
+            since: The first segment that is replayed.
+
+        Returns:
+            The number of replayed actions.
+
+        Raises:
+            MeruException: If a segment might have been written by another user.
+        """
+        journal = state._settings.journal  # pylint: disable=protected-access
+        state.enable_state_journal(None)
+        replayed = 0
+        try:
+            for action in self.read(since):
+                try:
+                    await state.update_state(action)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception(f"Skipping journalled action {action} that failed to replay")
+                    continue
+                replayed += 1
+        finally:
+            state.enable_state_journal(journal)
+
+        state.invalidate_encoded_state()
+        return replayed
+
+
+def capture_snapshot(journal: Union[StateJournal, None] = None) -> dict:
+    """Returns a copy of all registered state nodes that can be written with
+    :py:func:`write_snapshot`.
+
+    Only the fields are copied, containers inside the fields are shared with the state nodes.  The
+    snapshot therefore needs to be pickled before the state nodes change again, which
+    :py:func:`save_snapshot` does in the event loop.
+
+    Parameters:
+        journal: The opened journal of the broker.  A new segment is started, so the snapshot knows the
+            first segment with changes that are not contained in the snapshot.
+
+    Returns:
+        The snapshot, containing the version and fields of each state node and the first journal
+        segment to replay.
+    """
+    nodes = {}
+    for state_cls, state_node in state.STATES.items():
+        nodes[get_full_path_to_class(state_cls)] = (
+            state.STATE_VERSIONS.get(state_cls, 0),
+            state._snapshot_state(state_node),  # pylint: disable=protected-access
+        )
+
+    return {
+        "nodes": nodes,
+        "journal_segment": journal.rotate() if journal is not None else 0,
+    }
+
+
+def write_snapshot(snapshot: dict, path: str = MERU_STATE_SNAPSHOT_PATH):
+    """Write a snapshot to a file.
+
+    The snapshot is written to a temporary file first and then moved to ``path``, so a crash while
+    writing never leaves a corrupted snapshot behind.
+
+    Parameters:
+        snapshot: A snapshot returned by :py:func:`capture_snapshot`.
+        path: The snapshot file.
+    """
+    _write_snapshot_data(_dump_snapshot(snapshot), path)
+
+
+def _dump_snapshot(snapshot: dict) -> bytes:
+    return SNAPSHOT_MAGIC + pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _write_snapshot_data(data: bytes, path: str):
+    # Every write uses its own temporary file, so concurrent writes never mix their data.
+    directory, name = os.path.split(path)
+    _make_private_directory(directory)
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=directory or ".", prefix=f"{name}.", suffix=".tmp", delete=False
+    ) as snapshot_file:
+        try:
+            snapshot_file.write(data)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        except BaseException:
+            snapshot_file.close()
+            os.remove(snapshot_file.name)
+            raise
+    os.replace(snapshot_file.name, path)
+
+
+async def save_snapshot(
+    path: str = MERU_STATE_SNAPSHOT_PATH, journal: Union[StateJournal, None] = None
+):
+    """Write a snapshot of all registered state nodes without blocking the event loop.
+
+    The state nodes are copied and pickled in the event loop, so the snapshot is consistent, only the
+    writing happens in the default executor.  Afterwards the journal segments that are contained in
+    the snapshot are deleted in the background.
+
+    If the coroutine is cancelled, it still waits for the write to finish, so the write can not
+    replace a snapshot written afterwards.
+
+    Parameters:
+        path: The snapshot file.
+        journal: The opened journal of the broker.
+    """
+    snapshot = capture_snapshot(journal)
+    data = _dump_snapshot(snapshot)
+    loop = asyncio.get_event_loop()
+    write = loop.run_in_executor(None, _write_snapshot_data, data, path)
+    try:
+        await asyncio.shield(write)
+    except asyncio.CancelledError:
+        await asyncio.wait({write})
+        raise
+    logger.debug(f"Saved state snapshot to {path}")
+
+    if journal is not None:
+        loop.run_in_executor(None, journal.compact, snapshot["journal_segment"])
+
+
+def read_snapshot(path: str = MERU_STATE_SNAPSHOT_PATH) -> Union[dict, None]:
+    """Read a snapshot written by :py:func:`write_snapshot`.
+
+    Parameters:
+        path: The snapshot file.
+
+    Returns:
+        The snapshot or ``None`` if the file does not exist.
+
+    Raises:
+        MeruException: If the file is not a snapshot or might have been written by another user.
+    """
+    try:
+        snapshot_file = open(path, "rb")
+    except FileNotFoundError:
+        return None
+
+    with snapshot_file:
+        stat_result = os.fstat(snapshot_file.fileno())
+        _check_private(path, stat_result)
+        if stat_result.st_size <= len(SNAPSHOT_MAGIC):
+            raise MeruException(f"{path} is not a state snapshot.")
+
+        with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[: len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise MeruException(f"{path} is not a state snapshot.")
+            with memoryview(data) as view:
+                return pickle.loads(view[len(SNAPSHOT_MAGIC) :])
+
+
+def load_snapshot(path: str = MERU_STATE_SNAPSHOT_PATH) -> bool:
+    """Restore the registered state nodes from a snapshot.
+
+    The fields are assigned to the existing state nodes, so action handlers that were already
+    discovered stay valid.  State nodes in the snapshot that are not registered are ignored.  This
+    needs to be called after all states are registered.
+
+    Parameters:
+        path: The snapshot file.
+
+    Returns:
+        ``True`` if a snapshot was loaded, ``False`` if there was no snapshot.
+
+    Raises:
+        MeruException: If the file is not a snapshot or might have been written by another user.
+
+    See Also:
+        :py:func:`restore_states`
+    """
+    snapshot = read_snapshot(path)
+    if snapshot is None:
+        return False
+
+    _apply_snapshot(snapshot)
+    logger.info(f"Loaded state snapshot from {path}")
+    return True
+
+
+async def restore_states(
+    path: str = MERU_STATE_SNAPSHOT_PATH, journal: Union[StateJournal, None] = None
+) -> int:
+    """Restore the registered state nodes from the snapshot and the journal.
+
+    The snapshot is loaded first, then the actions recorded after the snapshot are replayed.  This
+    needs to be called after all states are registered and before the journal is opened.
+
+    Parameters:
+        path: The snapshot file.
+        journal: The journal of the broker, which is not opened yet.
+
+    Returns:
+        The number of replayed actions.
+
+    Raises:
+        MeruException: If the file is not a snapshot or the snapshot or a journal segment might have
+            been written by another user.
+    """
+    snapshot = read_snapshot(path)
+    since = 0
+    if snapshot is not None:
+        _apply_snapshot(snapshot)
+        since = snapshot["journal_segment"]
+        logger.info(f"Loaded state snapshot from {path}")
+
+    if journal is None:
+        return 0
+
+    replayed = await journal.replay(since)
+    logger.info(f"Replayed {replayed} actions from the state journal")
+    return replayed
+
+
+def _apply_snapshot(snapshot: dict):
+    for node_path, (version, values) in snapshot["nodes"].items():
+        try:
+            state_cls = get_type_from_string(node_path)
+        except (ImportError, AttributeError):
+            logger.warning(f"Ignoring unknown state node {node_path} in snapshot")
+            continue
+
+        if state_cls not in state.STATES:
+            logger.warning(f"Ignoring unregistered state node {node_path} in snapshot")
+            continue
+
+        state_node = state.STATES[state_cls]
+        field_names = {f.name for f in fields(state_node)}
+        for name, value in values.items():
+            if name in field_names:
+                setattr(state_node, name, value)
+        state.STATE_VERSIONS[state_cls] = version
+
+    state.invalidate_encoded_state()
+
+
+async def run_snapshots(
+    interval: float = MERU_STATE_SNAPSHOT_INTERVAL,
+    path: str = MERU_STATE_SNAPSHOT_PATH,
+    journal: Union[StateJournal, None] = None,
+):
+    """Periodically write snapshots of all registered state nodes.
+
+    A final snapshot is written when the coroutine is cancelled, e.g. when the broker shuts down.
+
+    Parameters:
+        interval: Seconds between two snapshots.
+        path: The snapshot file.
+        journal: The opened journal of the broker.
+    """
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await save_snapshot(path, journal)
+    finally:
+        snapshot = capture_snapshot(journal)
+        write_snapshot(snapshot, path)
+        if journal is not None:
+            journal.compact(snapshot["journal_segment"])
+        logger.info(f"Saved state snapshot to {path}")
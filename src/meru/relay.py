@@ -0,0 +1,283 @@
+"""Zero-decode relaying of actions for broker implementations.
+
+A broker built on :py:meth:`meru.sockets.CollectorSocket.collect` and
+:py:meth:`meru.sockets.PublisherSocket.publish` decodes every action and encodes it again for
+publishing.  :py:class:`ActionRelay` forwards the raw frames instead and only decodes the topics the
+broker asks for.
+"""
+
+import asyncio
+import logging
+import threading
+from itertools import count
+from typing import Awaitable, Callable, Hashable, List, Union
+
+import zmq
+
+from meru.conflation import ConflationMetrics, conflate_messages
+from meru.constants import (
+    BIND_ADDRESS,
+    COLLECTOR_PORT,
+    MERU_PRIORITY_LANES,
+    MERU_STAMP_HOPS,
+    MERU_TRANSPORT,
+    PUBLISHER_PORT,
+)
+from meru.helpers import build_address, get_lane_port, now_ns
+from meru.serialization import decode_object
+from meru.sockets import (
+    BATCH_TOPIC,
+    ExpiryMetrics,
+    MessagingSocket,
+    add_hop,
+    is_expired,
+    unpack_batch,
+)
+
+logger = logging.getLogger("meru.relay")
+
+_relay_ids = count()
+
+# Maximum number of messages conflated at once, so a flood of actions can not stall the relay.
+MAX_CONFLATED_MESSAGES = 10000
+
+
+class ActionRelay:  # pylint: disable=too-many-instance-attributes
+    """Forwards actions from the collector to the publisher address without decoding them.
+
+    The frames are moved by ``zmq.proxy_steerable`` in a background thread, so relayed actions never
+    touch the event loop.  Actions whose topic starts with one of ``inspect_topics`` are additionally
+    copied to an inspection socket, decoded and passed to ``hook``.  Batches sent by
+    :py:class:`meru.sockets.PushSocket` are forwarded as they are and unpacked for the inspection::
+
+        relay = ActionRelay(inspect_topics=[SomeStateAction.topic], hook=update_state)
+        await relay.run()
+
+    The hook runs concurrently to the forwarding, i.e. subscribers might receive an action before
+    the hook has processed it.
+
+    The relay binds the same addresses as :py:class:`meru.sockets.CollectorSocket` and
+    :py:class:`meru.sockets.PublisherSocket` and replaces both of them in a broker.
+
+    Every priority lane is forwarded by its own thread, so urgent actions never queue behind bulk
+    actions, see :py:const:`meru.constants.MERU_PRIORITY_LANES`.
+
+    With ``conflate_topics``, the relay forwards the actions in a Python loop instead.  All actions
+    that are pending at once are forwarded together, and of those with a topic starting with one of
+    ``conflate_topics`` only the newest per topic and ``conflation_key`` is forwarded, see
+    :py:func:`meru.conflation.conflate_messages`.  As all actions of a class share their topic,
+    actions concerning different entities need a ``conflation_key``, otherwise they supersede each
+    other.
+
+    With ``drop_expired``, the relay forwards the actions in the same loop and drops actions whose
+    :py:attr:`meru.base.Action.ttl` has passed, without decoding them.  With ``stamp_hops``, the
+    time of forwarding is added to the header of every action, see :py:mod:`meru.latency`.
+
+    Parameters:
+        inspect_topics: Topic prefixes of the actions that are passed to ``hook``.
+        hook: A coroutine function called with every inspected action.
+        transport: The ZeroMQ transport, defaults to :py:const:`meru.constants.MERU_TRANSPORT`.
+        conflate_topics: Topic prefixes of the actions that are conflated.
+        conflation_key: Returns the key of the multipart message of a conflated action, e.g. by
+            decoding it.  Without a function, all actions of a topic supersede each other.
+        lanes: Number of priority lanes, defaults to :py:const:`meru.constants.MERU_PRIORITY_LANES`.
+        drop_expired: Drop actions after their deadline.
+        stamp_hops: Add a hop stamp to every action, defaults to
+            :py:const:`meru.constants.MERU_STAMP_HOPS`.
+
+    Attributes:
+        conflation_metrics: The actions skipped by conflation.
+        expiry_metrics: The actions dropped after their deadline.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        inspect_topics: Union[List[bytes], None] = None,
+        hook: Union[Callable[..., Awaitable], None] = None,
+        transport: Union[str, None] = None,
+        *,
+        conflate_topics: Union[List[bytes], None] = None,
+        lanes: int = MERU_PRIORITY_LANES,
+        drop_expired: bool = False,
+        stamp_hops: bool = MERU_STAMP_HOPS,
+        conflation_key: Union[Callable[[List[bytes]], Hashable], None] = None,
+    ):
+        self.inspect_topics = inspect_topics or []
+        self.hook = hook
+        self.transport = transport or MERU_TRANSPORT
+        self.conflate_topics = tuple(conflate_topics or ())
+        self.conflation_key = conflation_key
+        self.conflation_metrics = ConflationMetrics()
+        self.lanes = max(lanes, 1)
+        self.drop_expired = drop_expired
+        self.stamp_hops = stamp_hops
+        self.expiry_metrics = ExpiryMetrics()
+
+        # A shadow of the shared context is used, so inproc addresses are reachable from the
+        # asyncio sockets.
+        self._ctx = zmq.Context.shadow(MessagingSocket.ctx.underlying)
+        relay_id = next(_relay_ids)
+        self._control_address = f"inproc://meru-relay-control-{relay_id}"
+        self._capture_address = f"inproc://meru-relay-capture-{relay_id}"
+        self._controls = []
+        self._threads = []
+
+    @property
+    def is_running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        """Bind the relay sockets and start forwarding every lane in a background thread."""
+        for lane in range(self.lanes):
+            self._start_lane(lane)
+        logger.debug("Started action relay")
+
+    def _start_lane(self, lane: int):
+        collector = self._ctx.socket(zmq.PULL)
+        collector.setsockopt(zmq.LINGER, 0)
+        collector_port = get_lane_port(COLLECTOR_PORT, lane)
+        collector.bind(build_address(BIND_ADDRESS, collector_port, self.transport))
+
+        publisher = self._ctx.socket(zmq.PUB)
+        publisher.setsockopt(zmq.LINGER, 0)
+        publisher_port = get_lane_port(PUBLISHER_PORT, lane)
+        publisher.bind(build_address(BIND_ADDRESS, publisher_port, self.transport))
+
+        capture = None
+        if self.hook and self.inspect_topics:
+            capture = self._ctx.socket(zmq.PUB)
+            capture.setsockopt(zmq.LINGER, 0)
+            capture.bind(f"{self._capture_address}-{lane}")
+
+        control = self._ctx.socket(zmq.PAIR)
+        control.bind(f"{self._control_address}-{lane}")
+        steering = self._ctx.socket(zmq.PAIR)
+        steering.connect(f"{self._control_address}-{lane}")
+        self._controls.append(steering)
+
+        filtered = self.conflate_topics or self.drop_expired or self.stamp_hops
+        thread = threading.Thread(
+            target=self._forward_filtered if filtered else self._forward,
+            args=(collector, publisher, capture, control),
+            name=f"meru-relay-{lane}",
+            daemon=True,
+        )
+        thread.start()
+        self._threads.append(thread)
+
+    @staticmethod
+    def _forward(collector, publisher, capture, control):
+        try:
+            zmq.proxy_steerable(collector, publisher, capture, control)
+        except zmq.ContextTerminated:
+            pass
+        finally:
+            for socket in (collector, publisher, capture, control):
+                if socket is not None:
+                    socket.close(linger=0)
+
+    def _forward_filtered(self, collector, publisher, capture, control):
+        poller = zmq.Poller()
+        poller.register(collector, zmq.POLLIN)
+        poller.register(control, zmq.POLLIN)
+
+        try:
+            while True:
+                events = dict(poller.poll())
+                if control in events and control.recv() == b"TERMINATE":
+                    break
+                if collector not in events:
+                    continue
+
+                for frames in self._filter(self._receive_pending(collector)):
+                    publisher.send_multipart(frames)
+                    if capture is not None:
+                        capture.send_multipart(frames)
+        except zmq.ContextTerminated:
+            pass
+        finally:
+            for socket in (collector, publisher, capture, control):
+                if socket is not None:
+                    socket.close(linger=0)
+
+    @staticmethod
+    def _receive_pending(collector):
+        messages = []
+        while len(messages) < MAX_CONFLATED_MESSAGES:
+            try:
+                frames = collector.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            if frames[0] == BATCH_TOPIC:
+                messages.extend(unpack_batch(frames[1]))
+            else:
+                messages.append(frames)
+        return messages
+
+    def _filter(self, messages):
+        if self.drop_expired:
+            messages = self._drop_expired(messages)
+
+        messages = conflate_messages(
+            messages, self.conflate_topics, self.conflation_metrics, self.conflation_key
+        )
+        if self.stamp_hops:
+            stamp = now_ns()
+            messages = [add_hop(frames, stamp) for frames in messages]
+        return messages
+
+    def _drop_expired(self, messages):
+        now = now_ns() // 1_000_000
+        remaining = []
+        for frames in messages:
+            if is_expired(frames, now):
+                self.expiry_metrics.record(frames[0])
+            else:
+                remaining.append(frames)
+        return remaining
+
+    async def run(self):
+        """Start the relay and pass inspected actions to the hook until cancelled."""
+        if not self.is_running:
+            self.start()
+
+        inspector = MessagingSocket.ctx.socket(zmq.SUB)
+        inspector.setsockopt(zmq.LINGER, 0)
+        for lane in range(self.lanes):
+            inspector.connect(f"{self._capture_address}-{lane}")
+        for topic in self.inspect_topics:
+            inspector.setsockopt(zmq.SUBSCRIBE, topic)
+        inspector.setsockopt(zmq.SUBSCRIBE, BATCH_TOPIC)
+
+        inspect_topics = tuple(self.inspect_topics)
+        try:
+            if self.hook and self.inspect_topics:
+                while True:
+                    frames = await inspector.recv_multipart()
+                    if frames[0] != BATCH_TOPIC:
+                        await self.hook(decode_object(frames[-1]))
+                        continue
+                    for message in unpack_batch(frames[1]):
+                        if message[0].startswith(inspect_topics):
+                            await self.hook(decode_object(message[-1]))
+            else:
+                # Nothing to inspect, the forwarding happens in the background thread only.
+                await asyncio.get_event_loop().create_future()
+        finally:
+            inspector.close(linger=0)
+            self.close()
+
+    def close(self):
+        """Stop forwarding and close the relay sockets."""
+        if not self._controls:
+            return
+
+        for control, thread in zip(self._controls, self._threads):
+            if thread.is_alive():
+                control.send(b"TERMINATE")
+                thread.join()
+            control.close(linger=0)
+
+        self._controls = []
+        self._threads = []
+        logger.debug("Stopped action relay")
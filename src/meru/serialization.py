@@ -6,9 +6,21 @@ from dataclasses import fields
 from meru.actions import Action
 from meru.base import MeruObject
 from meru.constants import MERU_SERIALIZATION_METHOD
-from meru.exceptions import ActionException
+from meru.exceptions import ActionException, MeruException
 from meru.introspection import get_subclasses
 
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+if MERU_SERIALIZATION_METHOD == "msgpack" and msgpack is None:
+    raise MeruException(
+        'MERU_SERIALIZATION_METHOD "msgpack" requires the msgpack package. Install meru[msgpack].'
+    )
+
+MSGPACK_MERU_OBJECT_EXT = 1
+
 
 def serialize_objects(obj):
     """Serializes a Python object to a dictionary.
@@ -29,6 +41,167 @@ def serialize_objects(obj):
     return data
 
 
+class CodecPlan:
+    """Precompiled de-/serialization plan for a single :py:class:`MeruObject` subclass.
+
+    The plan is built once per class and holds everything :py:func:`deserialize_objects` needs to
+    rebuild an object, so no dataclass reflection happens per message.  Binary formats encode
+    objects with :py:meth:`encode` as well.  JSON keeps using ``to_dict()``, as the copy of
+    ``__dict__`` is the fastest way to build the dictionary with the established key order.
+
+    Attributes:
+        cls: The class the plan was built for.
+        init_fields: Tuples of ``(field_name, cast)`` for all fields passed to ``__init__``, in
+            declaration order.  ``cast`` is ``None`` if the field has no ``"cast"`` metadata.
+        restored_fields: Names of fields that can not be passed to ``__init__`` but have to be
+            restored from the serialized data (``timestamp`` and ``origin`` of Actions).
+        restores_timestamp_ns: True for Actions.  ``timestamp_ns`` is restored as well, but derived
+            from ``timestamp`` if the data was encoded without it.
+        field_names: Names of all serialized fields in the order used by :py:meth:`encode_values`.
+        custom_to_dict: True if the class overrides ``to_dict()``, which :py:meth:`encode` then
+            has to use.
+    """
+
+    __slots__ = (
+        "cls",
+        "init_fields",
+        "restored_fields",
+        "restores_timestamp_ns",
+        "field_names",
+        "custom_to_dict",
+    )
+
+    def __init__(self, cls):
+        self.cls = cls
+        self.init_fields = tuple(
+            (field.name, field.metadata.get("cast", None))
+            for field in fields(cls)
+            if field.init
+        )
+        # Force timestamp and origin to be added correctly to Actions.
+        # Both fields can not be found with getfullargsspec, since
+        # it can not be in __init__.
+        # see: https://bugs.python.org/issue36077
+        self.restored_fields = ("timestamp", "origin") if issubclass(cls, Action) else ()
+        self.restores_timestamp_ns = issubclass(cls, Action)
+        self.field_names = tuple(name for name, _ in self.init_fields) + self.restored_fields
+        if self.restores_timestamp_ns:
+            self.field_names += ("timestamp_ns",)
+        self.custom_to_dict = cls.to_dict is not MeruObject.to_dict
+
+    def decode(self, data: dict):
+        """Builds an instance of ``self.cls`` from a dictionary.
+
+        Parameters:
+            data: A dictionary containing the object's attributes.
+
+        Returns:
+            The reconstructed object.
+        """
+        calling_args = [
+            cast_to(data[name]) if cast_to else data[name]
+            for name, cast_to in self.init_fields
+        ]
+        obj = self.cls(*calling_args)
+
+        for name in self.restored_fields:
+            setattr(obj, name, data[name])
+
+        if self.restores_timestamp_ns:
+            obj.timestamp_ns = data.get("timestamp_ns", None) or obj.timestamp * 1_000_000
+
+        return obj
+
+    def encode(self, obj) -> list:
+        """Flattens an object into a list in plan order, see :py:meth:`encode_values`.
+
+        The values are read from the attributes directly, without building the dictionary of the
+        object first.
+
+        Parameters:
+            obj: An instance of ``self.cls``.
+        """
+        if self.custom_to_dict:
+            return self.encode_values(obj.to_dict())
+
+        values = [obj.object_type]
+        values.extend(getattr(obj, name) for name in self.field_names)
+        return values
+
+    def encode_values(self, data: dict) -> list:
+        """Flattens the dictionary of an object into a list in plan order.
+
+        This is the compact counterpart to :py:meth:`decode_values` used by binary formats that
+        don't need the field names on the wire.
+
+        Parameters:
+            data: The dictionary returned by the object's ``to_dict()`` method.
+        """
+        values = [data["object_type"]]
+        values.extend(data[name] for name, _ in self.init_fields)
+        values.extend(data[name] for name in self.restored_fields)
+        if self.restores_timestamp_ns:
+            values.append(data["timestamp_ns"])
+        return values
+
+    def decode_values(self, values: list):
+        """Builds an instance of ``self.cls`` from a list created by :py:meth:`encode_values`.
+
+        Parameters:
+            values: The flattened object.  The leading object type is skipped.
+        """
+        init_count = len(self.init_fields)
+        calling_args = [
+            cast_to(value) if cast_to else value
+            for (_, cast_to), value in zip(self.init_fields, values[1 : init_count + 1])
+        ]
+        obj = self.cls(*calling_args)
+
+        for name, value in zip(self.restored_fields, values[init_count + 1 :]):
+            setattr(obj, name, value)
+
+        if self.restores_timestamp_ns:
+            # Objects encoded by older versions end before timestamp_ns.
+            if len(values) > len(self.field_names):
+                obj.timestamp_ns = values[-1]
+            else:
+                obj.timestamp_ns = obj.timestamp * 1_000_000
+
+        return obj
+
+
+_codec_plans = {}
+
+
+def get_codec_plan(object_type: str) -> CodecPlan:
+    """Returns the codec plan for the :py:class:`MeruObject` subclass named ``object_type``.
+
+    Plans are built on first use and cached for the lifetime of the process.
+
+    Parameters:
+        object_type: The class name as found in :py:attr:`MeruObject.object_type`.
+
+    Raises:
+        :py:class:`ActionException` if no subclass with that name exists.
+    """
+    try:
+        return _codec_plans[object_type]
+    except KeyError:
+        pass
+
+    subclass = get_subclasses(MeruObject).get(object_type, None)
+    if subclass is None:
+        # The subclass lookup is cached, so classes defined after the first call are missing.
+        get_subclasses.cache_clear()
+        subclass = get_subclasses(MeruObject).get(object_type, None)
+
+    if subclass is None:
+        raise ActionException(f"Object {object_type} not found.")
+
+    plan = _codec_plans[object_type] = CodecPlan(subclass)
+    return plan
+
+
 def deserialize_objects(obj):
     """Deserializes an object from a dictionary.
 
@@ -38,35 +211,64 @@ def deserialize_objects(obj):
     Returns:
         An object with the attributes in ``obj`` set to the specified values.  If the object's type
         can not be determined, ``obj`` is returned unchanged.
+
+    See Also:
+        :py:func:`get_codec_plan`
     """
-    if "object_type" in obj.keys():
-        subclass = get_subclasses(MeruObject)[obj["object_type"]]
+    object_type = obj.get("object_type", None)
+    if object_type is None:
+        return obj
+
+    return get_codec_plan(object_type).decode(obj)
+
+
+def _msgpack_default(obj):
+    """Packs objects msgpack can not handle natively.
+
+    :py:class:`MeruObject` instances are packed as an array of their values in the order given by
+    their :py:class:`CodecPlan`.  The first element is an ext type holding the object type, which
+    marks the array as an object for :py:func:`_msgpack_list_hook`.  Nested objects, e.g. the nodes
+    of a :py:class:`meru.actions.StateUpdate`, are handled recursively by msgpack.
+    """
+    if isinstance(obj, MeruObject):
+        values = get_codec_plan(obj.object_type).encode(obj)
+        values[0] = msgpack.ExtType(MSGPACK_MERU_OBJECT_EXT, values[0].encode())
+        return values
+
+    return serialize_objects(obj)
+
+
+def _msgpack_ext_hook(code, data):
+    if code == MSGPACK_MERU_OBJECT_EXT:
+        return get_codec_plan(data.decode())
+
+    return msgpack.ExtType(code, data)
+
 
-        if subclass:
-            calling_args = []
-            for field in fields(subclass):
-                if not field.init:
-                    continue
+def _msgpack_list_hook(values):
+    if values and values[0].__class__ is CodecPlan:
+        return values[0].decode_values(values)
 
-                cast_to = field.metadata.get("cast", None)
-                if cast_to:
-                    calling_args.append(cast_to(obj[field.name]))
-                else:
-                    calling_args.append(obj[field.name])
-            action = subclass(*calling_args)
+    return values
 
-            # Force timestamp and origin to be added correctly to Actions.
-            # Both fields can not be found with getfullargsspec, since
-            # it can not be in __init__.
-            # see: https://bugs.python.org/issue36077
-            if isinstance(action, Action):
-                action.timestamp = obj["timestamp"]
-                action.origin = obj["origin"]
 
-            return action
-        raise ActionException(f'Object {obj["object_type"]} not found.')
+def _msgpack_unpackb(data):
+    return msgpack.unpackb(
+        data,
+        ext_hook=_msgpack_ext_hook,
+        list_hook=_msgpack_list_hook,
+        raw=False,
+        strict_map_key=False,
+    )
 
-    return obj
+
+# Creating these for every message is more expensive than the actual decoding of small objects.
+_json_encoder = json.JSONEncoder(default=serialize_objects)
+_json_decoder = json.JSONDecoder(object_hook=deserialize_objects)
+# Serialization happens on the event loop thread only, so a single packer can be shared.
+_msgpack_packer = (
+    msgpack.Packer(default=_msgpack_default, use_bin_type=True) if msgpack else None
+)
 
 
 def encode_object(action: any, method_override=None):
@@ -77,7 +279,8 @@ def encode_object(action: any, method_override=None):
 
     Parameters:
         action: The action to serialize.
-        method_override: Can be used to override the default serialization method.
+        method_override: Can be used to override the default serialization method.  One of
+            ``"json"``, ``"pickle"`` or ``"msgpack"``.
 
     Returns:
         The encoded object.
@@ -85,8 +288,12 @@ def encode_object(action: any, method_override=None):
     See Also:
         :py:func:`decode_object`
     """
-    if "json" in (MERU_SERIALIZATION_METHOD, method_override):
-        encoded_object = json.dumps(action, default=serialize_objects).encode()
+    method = method_override or MERU_SERIALIZATION_METHOD
+
+    if method == "json":
+        encoded_object = _json_encoder.encode(action).encode()
+    elif method == "msgpack":
+        encoded_object = _msgpack_packer.pack(action)
     else:
         encoded_object = pickle.dumps(action)
 
@@ -103,7 +310,8 @@ def decode_object(action: any, method_override=None):
 
     Parameters:
         action: The action to deserialize.
-        method_override: Can be used to override the default serialization method.
+        method_override: Can be used to override the default serialization method.  One of
+            ``"json"``, ``"pickle"`` or ``"msgpack"``.
 
     Returns:
         The decoded object.
@@ -111,8 +319,61 @@ def decode_object(action: any, method_override=None):
     See Also:
         :py:func:`encode_object`
     """
-    if "json" in (MERU_SERIALIZATION_METHOD, method_override):
-        data = json.loads(action, object_hook=deserialize_objects)
+    method = method_override or MERU_SERIALIZATION_METHOD
+
+    if method == "json":
+        if isinstance(action, (bytes, bytearray)):
+            action = action.decode()
+        data = _json_decoder.decode(action)
+    elif method == "msgpack":
+        data = _msgpack_unpackb(action)
     else:
         data = pickle.loads(action)
     return data
+
+
+def encode_with_fragments(obj: MeruObject, field_name: str, fragments: list, method_override=None):
+    """Serializes an object whose list field is given as already encoded elements.
+
+    This allows caching the encoded elements, e.g. the nodes of a
+    :py:class:`meru.actions.StateUpdate`, and assembling messages from the cached fragments.  The
+    result decodes to the same object as encoding ``obj`` with :py:func:`encode_object`.
+
+    Parameters:
+        obj: The object to serialize.  The value of ``field_name`` is ignored.
+        field_name: The name of a list field of ``obj``.
+        fragments: The elements of the list field, each encoded with :py:func:`encode_object`.
+        method_override: Can be used to override the default serialization method.
+
+    Returns:
+        The encoded object or ``None`` if the serialization method does not support fragments,
+        which is the case for pickle.
+    """
+    method = method_override or MERU_SERIALIZATION_METHOD
+    data = obj.to_dict()
+
+    if method == "json":
+        parts = [b'{"', field_name.encode(), b'": [', b", ".join(fragments), b"]"]
+        for key, value in data.items():
+            if key != field_name:
+                encoded_item = f", {_json_encoder.encode(key)}: {_json_encoder.encode(value)}"
+                parts.append(encoded_item.encode())
+        parts.append(b"}")
+        return b"".join(parts)
+
+    if method == "msgpack":
+        plan = get_codec_plan(data["object_type"])
+        values = plan.encode_values(data)
+        parts = [
+            _msgpack_packer.pack_array_header(len(values)),
+            _msgpack_packer.pack(msgpack.ExtType(MSGPACK_MERU_OBJECT_EXT, values[0].encode())),
+        ]
+        for key, value in zip(plan.field_names, values[1:]):
+            if key == field_name:
+                parts.append(_msgpack_packer.pack_array_header(len(fragments)))
+                parts.extend(fragments)
+            else:
+                parts.append(_msgpack_packer.pack(value))
+        return b"".join(parts)
+
+    return None
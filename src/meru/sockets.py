@@ -4,97 +4,398 @@ This module contains sockets for the implementation of both the broker and other
 """
 
 import asyncio
+from collections import defaultdict, deque, namedtuple
+from itertools import count
 import logging
-from typing import Union
+import math
+import struct
+from typing import List, Union
 
 import zmq
 import zmq.asyncio
 from zmq.ssh import tunnel
 
 from meru.actions import Action
+from meru.conflation import ConflationMetrics, conflate_actions
 from meru.constants import (
     BIND_ADDRESS,
     BROKER_ADDRESS,
     COLLECTOR_PORT,
+    MERU_AUTO_SUBSCRIBE,
+    MERU_BATCH_INTERVAL,
+    MERU_BATCH_SIZE,
+    MERU_PRIORITY_LANES,
     MERU_RECEIVE_TIMEOUT,
+    MERU_STAMP_HOPS,
+    MERU_TRACK_LATENCY,
+    MERU_TRANSPORT,
     PUBLISHER_PORT,
     SSH_TUNNEL,
     STATE_PORT,
 )
-from meru.helpers import build_address, get_process_identity
+from meru.helpers import build_address, get_lane_port, get_process_identity, now_ns
+from meru.latency import record_latencies
 from meru.serialization import decode_object, encode_object
 
 logger = logging.getLogger("meru.socket")
 
+# Topic of messages that contain a batch of actions, see :py:func:`pack_batch`.
+BATCH_TOPIC = b"\x00meru-batch"
+
+_frame_count = struct.Struct("!H")
+_frame_length = struct.Struct("!I")
+_deadline = struct.Struct("!d")
+_hop = struct.Struct("!q")
+
+
+def encode_frames(action: Action) -> List[bytes]:
+    """Encodes an action as a multipart message.
+
+    Actions with a :py:attr:`meru.base.Action.ttl` carry their deadline in a header frame between
+    the topic and the encoded action, so expired actions can be dropped without decoding them.
+    The header is followed by the hop stamps added with :py:func:`add_hop`.
+
+    Returns:
+        ``[topic, encoded_action]`` or ``[topic, header, encoded_action]``.
+    """
+    if action.ttl is None:
+        return [action.topic, encode_object(action)]
+    return [action.topic, _deadline.pack(action.timestamp + action.ttl), encode_object(action)]
+
+
+def is_expired(frames: List[bytes], now: float) -> bool:
+    """Checks the deadline header of a message created by :py:func:`encode_frames`.
+
+    Parameters:
+        frames: The multipart message.
+        now: The current Unix time in ms, taken from :py:func:`meru.helpers.now_ns` like the
+            timestamps of the actions, so both follow the same clock.
+    """
+    return len(frames) == 3 and _deadline.unpack_from(frames[1])[0] < now
+
+
+def add_hop(frames: List[bytes], stamp: int) -> List[bytes]:
+    """Appends a hop stamp to the header of a message created by :py:func:`encode_frames`.
+
+    A header without deadline is added to messages without header.
+
+    Parameters:
+        frames: The multipart message.
+        stamp: The time in ns the message passed the hop, see :py:func:`meru.helpers.now_ns`.
+
+    Returns:
+        The message with the extended header.
+    """
+    if len(frames) == 3:
+        header = frames[1] + _hop.pack(stamp)
+    else:
+        header = _deadline.pack(math.inf) + _hop.pack(stamp)
+    return [frames[0], header, frames[-1]]
+
+
+def get_hops(frames: List[bytes]) -> tuple:
+    """Returns the hop stamps of a message in the order they were added, see :py:func:`add_hop`."""
+    if len(frames) != 3:
+        return ()
+    header = frames[1]
+    return tuple(
+        _hop.unpack_from(header, offset)[0]
+        for offset in range(_deadline.size, len(header), _hop.size)
+    )
+
+
+def pack_batch(messages: List[List[bytes]]) -> bytes:
+    """Packs multiple multipart messages into a single frame.
+
+    Each message is stored as its number of frames followed by the length prefixed frames.
+
+    Parameters:
+        messages: The multipart messages, usually ``[topic, encoded_action]``.
+
+    See Also:
+        :py:func:`unpack_batch`
+    """
+    parts = []
+    for frames in messages:
+        parts.append(_frame_count.pack(len(frames)))
+        for frame in frames:
+            parts.append(_frame_length.pack(len(frame)))
+            parts.append(frame)
+    return b"".join(parts)
+
+
+def unpack_batch(data: bytes) -> List[List[bytes]]:
+    """Unpacks a frame created by :py:func:`pack_batch`.
+
+    Parameters:
+        data: The packed batch.
+
+    Returns:
+        The multipart messages contained in the batch.
+    """
+    messages = []
+    offset = 0
+    end = len(data)
+    while offset < end:
+        (frame_count,) = _frame_count.unpack_from(data, offset)
+        offset += _frame_count.size
+        frames = []
+        for _ in range(frame_count):
+            (length,) = _frame_length.unpack_from(data, offset)
+            offset += _frame_length.size
+            frames.append(data[offset : offset + length])
+            offset += length
+        messages.append(frames)
+    return messages
+
+
+class BatchMetrics:
+    """Counters for the batches sent by a :py:class:`PushSocket`.
+
+    Attributes:
+        batches: Number of sent batches.  Single actions sent without a batch are counted as well.
+        actions: Number of actions sent in all batches.
+        max_size: The size of the largest batch.
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.actions = 0
+        self.max_size = 0
+
+    def record(self, size: int):
+        self.batches += 1
+        self.actions += size
+        self.max_size = max(self.max_size, size)
+
+    @property
+    def mean_size(self) -> float:
+        return self.actions / self.batches if self.batches else 0.0
+
+
+class ExpiryMetrics:
+    """Counters for the actions dropped after their deadline.
+
+    Attributes:
+        dropped: Number of dropped actions by topic.
+    """
+
+    def __init__(self):
+        self.dropped = defaultdict(int)
+
+    def record(self, topic: bytes, amount: int = 1):
+        self.dropped[topic] += amount
+
+    @property
+    def total(self) -> int:
+        return sum(self.dropped.values())
+
 
 class MessagingSocket:
     """Base class for the other socket classes in this module.
 
+    Sockets for distributed actions use a separate ZeroMQ socket per priority lane, see
+    :py:const:`meru.constants.MERU_PRIORITY_LANES`.  Messages of higher lanes are always received
+    first.
+
+    Parameters:
+        transport: The ZeroMQ transport, one of ``"tcp"``, ``"ipc"`` or ``"inproc"``.  Defaults to
+            :py:const:`meru.constants.MERU_TRANSPORT`.
+
     Attributes:
         ctx: The ZeroMQ context.
         loop: The ZeroMQ event loop.
         is_closed: True if the underlying ZeroMQ socket is closed.
+        unpacked_pending: Number of messages unpacked from received batches that were not
+            received yet.
     """
 
     ctx = zmq.asyncio.Context()
 
-    def __init__(self):
+    def __init__(self, transport: Union[str, None] = None):
         self._socket = None
+        self._lane_sockets = []
+        self._lane_poller = None
+        self._pending = deque()
         self.loop = asyncio.get_event_loop()
+        self.transport = transport or MERU_TRANSPORT
+
+    def _build_address(self, ip_address, port):
+        return build_address(ip_address, port, self.transport)
+
+    def _connect(self, connect_address, socket=None):
+        socket = socket or self._socket
+        # SSH tunnels are only possible for TCP connections to a remote broker.
+        if SSH_TUNNEL and self.transport == "tcp":
+            tunnel.tunnel_connection(socket, connect_address, SSH_TUNNEL)
+        else:
+            socket.connect(connect_address)
+
+    def _create_lanes(self, socket_type, ip_address, port, lanes: int, bind: bool):
+        """Create the sockets of the priority lanes above lane 0."""
+        for lane in range(1, lanes):
+            socket = self.ctx.socket(socket_type)
+            socket.setsockopt(zmq.LINGER, 0)
+            address = self._build_address(ip_address, get_lane_port(port, lane))
+            if bind:
+                socket.bind(address)
+            else:
+                self._connect(address, socket)
+            self._lane_sockets.append(socket)
+
+    def _lane_socket(self, action: Action):
+        """Returns the socket of the priority lane of an action."""
+        lane = min(action.priority, len(self._lane_sockets))
+        return self._lane_sockets[lane - 1] if lane > 0 else self._socket
+
+    async def _receive_lane_frames(self, wait: bool):
+        if self._lane_poller is None:
+            self._lane_poller = zmq.asyncio.Poller()
+            for socket in (self._socket, *self._lane_sockets):
+                self._lane_poller.register(socket, zmq.POLLIN)
+
+        while True:
+            for socket in reversed(self._lane_sockets):
+                if socket.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                    # Actions of higher lanes are never batched.
+                    return await socket.recv_multipart()
+
+            if self._pending:
+                return self._pending.popleft()
+
+            if self._socket.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                frames = await self._socket.recv_multipart()
+                if frames[0] != BATCH_TOPIC:
+                    return frames
+                self._pending.extend(self._accept_batch(unpack_batch(frames[1])))
+                continue
+
+            if not wait:
+                return None
+            await self._lane_poller.poll()
+
+    async def _receive_frames(self):
+        """Receive a single multipart message.
+
+        Batches sent by a :py:class:`PushSocket` are unpacked transparently.  The contained
+        messages are buffered and returned one by one.
+        """
+        if self._lane_sockets:
+            return await self._receive_lane_frames(wait=True)
+
+        while not self._pending:
+            frames = await self._socket.recv_multipart()
+            if frames[0] != BATCH_TOPIC:
+                return frames
+            self._pending.extend(self._accept_batch(unpack_batch(frames[1])))
+        return self._pending.popleft()
+
+    async def _receive_frames_nowait(self):
+        """Receive a single multipart message if one is ready.
+
+        Returns:
+            The message or ``None`` if no message is queued on the socket.
+        """
+        if self._lane_sockets:
+            return await self._receive_lane_frames(wait=False)
+
+        while not self._pending:
+            try:
+                # The future of a non-blocking receive is already done, so this never suspends.
+                frames = await self._socket.recv_multipart(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                return None
+            if frames[0] != BATCH_TOPIC:
+                return frames
+            self._pending.extend(self._accept_batch(unpack_batch(frames[1])))
+        return self._pending.popleft()
+
+    def _accept_batch(self, messages):
+        return messages
 
     def close(self):
         self._socket.close(linger=0)
+        for socket in self._lane_sockets:
+            socket.close(linger=0)
 
     def __del__(self):
         self._socket.close(linger=0)
+        for socket in self._lane_sockets:
+            socket.close(linger=0)
 
     @property
     def is_closed(self):
         return self._socket.closed
 
+    @property
+    def unpacked_pending(self) -> int:
+        return len(self._pending)
+
 
 class PublisherSocket(MessagingSocket):
     """Broker-side socket for distributing broadcasted :py:class:`Action` objects.
 
+    Parameters:
+        transport: See :py:class:`MessagingSocket`.
+        lanes: Number of priority lanes, defaults to :py:const:`meru.constants.MERU_PRIORITY_LANES`.
+        stamp_hops: Add the time of publishing to the header of every action, see
+            :py:mod:`meru.latency`.
+
     See Also:
         :py:class:`SubscriberSocket`
     """
 
-    def __init__(self):
-        super().__init__()
-        address = build_address(BIND_ADDRESS, PUBLISHER_PORT)
+    def __init__(
+        self,
+        transport: Union[str, None] = None,
+        lanes: int = MERU_PRIORITY_LANES,
+        stamp_hops: bool = MERU_STAMP_HOPS,
+    ):
+        super().__init__(transport)
+        self.stamp_hops = stamp_hops
+        address = self._build_address(BIND_ADDRESS, PUBLISHER_PORT)
         self._socket = self.ctx.socket(zmq.PUB)
         self._socket.bind(address)
+        self._create_lanes(zmq.PUB, BIND_ADDRESS, PUBLISHER_PORT, lanes, bind=True)
         logger.debug(f"Bound publisher to {address}")
 
     async def publish(self, action: Action):
         """Transmits an action object from the broker to the connected processes."""
 
-        data = [action.topic, encode_object(action)]
-        await self._socket.send_multipart(data)
+        data = encode_frames(action)
+        if self.stamp_hops:
+            data = add_hop(data, now_ns())
+        if self._lane_sockets and action.priority > 0:
+            await self._lane_socket(action).send_multipart(data)
+        else:
+            await self._socket.send_multipart(data)
 
 
 class CollectorSocket(MessagingSocket):
     """Broker-side socket for sending :py:class:`Action` objects to the broker for distribution.
 
+    Parameters:
+        transport: See :py:class:`MessagingSocket`.
+        lanes: Number of priority lanes, defaults to :py:const:`meru.constants.MERU_PRIORITY_LANES`.
+
     See Also:
         :py:class:`PushSocket`
     """
 
-    def __init__(self):
-        super().__init__()
-        bind_address = build_address(BIND_ADDRESS, COLLECTOR_PORT)
+    def __init__(self, transport: Union[str, None] = None, lanes: int = MERU_PRIORITY_LANES):
+        super().__init__(transport)
+        bind_address = self._build_address(BIND_ADDRESS, COLLECTOR_PORT)
         self._socket = self.ctx.socket(zmq.PULL)
         self._socket.bind(bind_address)
         self._socket.setsockopt(zmq.LINGER, 0)
+        self._create_lanes(zmq.PULL, BIND_ADDRESS, COLLECTOR_PORT, lanes, bind=True)
         logger.debug(f"Bound collector to {bind_address}")
 
     async def collect(self):
         """Receives actions from the connected processes in an endless loop."""
         while True:
-            data = await self._socket.recv_multipart()
-            _, action_data = data
-            action = decode_object(action_data)
+            data = await self._receive_frames()
+            action = decode_object(data[-1])
             # logger.debug('Collected %s', action)
             return action
 
@@ -102,73 +403,266 @@ class CollectorSocket(MessagingSocket):
 class SubscriberSocket(MessagingSocket):
     """Broker-facing socket for receiving the distributed :py:class:`Action` objects.
 
+    Parameters:
+        topics: Topic prefixes to subscribe to.  All actions are received if no topics are given.
+        transport: See :py:class:`MessagingSocket`.
+        auto_subscribe: Subscribe to the topics of the actions handled by this process only, see
+            :py:func:`meru.handlers.get_handled_topics`.  Actions nobody handles are then dropped
+            by ZeroMQ before they reach Python.  Handlers have to be registered before the socket is
+            created.  Ignored if ``topics`` are given.
+        lanes: Number of priority lanes, defaults to :py:const:`meru.constants.MERU_PRIORITY_LANES`.
+        track_latency: Record the latency of every received action, see :py:mod:`meru.latency`.
+
+    Actions whose :py:attr:`meru.base.Action.ttl` has passed are dropped before they are decoded.
+    The deadline is compared to the local clock, so the clocks of the processes should be in sync.
+
+    Attributes:
+        conflation_metrics: The actions skipped by conflation in :py:meth:`receive_many`.  Actions
+            received by :py:meth:`receive_action` are never conflated.
+        expiry_metrics: The actions dropped after their deadline.
+
     See Also:
         :py:class:`PublisherSocket`
     """
 
-    def __init__(self, topics: Union[list, None] = None):
-        super().__init__()
-        connect_address = build_address(BROKER_ADDRESS, PUBLISHER_PORT)
+    def __init__(
+        self,
+        topics: Union[list, None] = None,
+        transport: Union[str, None] = None,
+        auto_subscribe: bool = MERU_AUTO_SUBSCRIBE,
+        lanes: int = MERU_PRIORITY_LANES,
+        track_latency: bool = MERU_TRACK_LATENCY,
+    ):
+        super().__init__(transport)
+        self.track_latency = track_latency
+        connect_address = self._build_address(BROKER_ADDRESS, PUBLISHER_PORT)
         self._socket = self.ctx.socket(zmq.SUB)
-        if SSH_TUNNEL:
-            tunnel.tunnel_connection(self._socket, connect_address, SSH_TUNNEL)
-        else:
-            self._socket.connect(connect_address)
-
-        if not topics:
-            self._socket.setsockopt_string(zmq.SUBSCRIBE, "")
-        else:
-            for topic in topics:
-                self._socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+        self._connect(connect_address)
+        self._create_lanes(zmq.SUB, BROKER_ADDRESS, PUBLISHER_PORT, lanes, bind=False)
+
+        if not topics and auto_subscribe:
+            # meru.handlers imports this module.
+            from meru.handlers import get_handled_topics  # pylint: disable=import-outside-toplevel
+
+            topics = get_handled_topics()
+            if not topics:
+                logger.warning("No handled actions found, the subscriber will not receive any")
+
+        self._topics = tuple(
+            topic.encode() if isinstance(topic, str) else topic for topic in topics or []
+        )
+        self._subscribe_all = (not topics and not auto_subscribe) or b"" in self._topics
+        for socket in (self._socket, *self._lane_sockets):
+            if self._subscribe_all:
+                socket.setsockopt(zmq.SUBSCRIBE, b"")
+            else:
+                for topic in self._topics:
+                    socket.setsockopt(zmq.SUBSCRIBE, topic)
+        if not self._subscribe_all:
+            # Batches can contain any topic and are filtered after unpacking.
+            self._socket.setsockopt(zmq.SUBSCRIBE, BATCH_TOPIC)
 
         self._socket.setsockopt(zmq.LINGER, 0)
+        self.conflation_metrics = ConflationMetrics()
+        self.expiry_metrics = ExpiryMetrics()
 
         logger.debug(f"Connected subscriber to {connect_address}")
 
-    async def handle_incoming_actions(self):
-        """Retrieve one received :py:class:`Action` object and calls the registered handlers.
+    async def handle_incoming_actions(self, max_items: int = 1):
+        """Retrieve received :py:class:`Action` objects and calls the registered handlers.
+
+        Parameters:
+            max_items: Maximum number of actions handled in one call.  Waits for one action and
+                handles all further actions that are already queued, see :py:meth:`receive_many`.
+
+        Batch handlers whose interval passes while waiting for an action are called as well, see
+        :py:func:`meru.handlers.flush_batches`.
 
         Yields:
             Actions returned by the handler.
         """
-        from meru.handlers import handle_action
+        from meru.handlers import flush_batches, handle_action, next_batch_deadline
 
-        action = await self.receive_action()
-        async for response in handle_action(action):
+        deadline = next_batch_deadline()
+        if deadline is None:
+            actions = await self._receive_actions(max_items)
+        else:
+            try:
+                actions = await asyncio.wait_for(
+                    self._receive_actions(max_items), max(0, deadline - self.loop.time())
+                )
+            except asyncio.TimeoutError:
+                actions = []
+
+        for action in actions:
+            async for response in handle_action(action):
+                yield response
+
+        async for response in flush_batches():
             yield response
 
+    async def _receive_actions(self, max_items: int):
+        if max_items == 1:
+            return [await self.receive_action()]
+        return await self.receive_many(max_items)
+
+    def _accept_batch(self, messages):
+        if self._subscribe_all:
+            return messages
+        return [frames for frames in messages if frames[0].startswith(self._topics)]
+
+    def _is_expired(self, frames, now):
+        if is_expired(frames, now):
+            self.expiry_metrics.record(frames[0])
+            return True
+        return False
+
     async def receive_encoded(self):
         """Retrieve a single (serialized) action from the socket and return it."""
-        return await self._socket.recv_multipart()
+        while True:
+            frames = await self._receive_frames()
+            if not self._is_expired(frames, now_ns() // 1_000_000):
+                return frames
 
     async def receive_action(self):
         """Retrieve a single (serialized) action from the socket and deserialize it."""
         data = await self.receive_encoded()
-        _, action_data = data
-        return decode_object(action_data)
+        action = decode_object(data[-1])
+        if self.track_latency:
+            record_latencies(action, get_hops(data))
+        return action
+
+    async def receive_many_encoded(self, max_items: int) -> List[List[bytes]]:
+        """Wait for a (serialized) action and drain all further actions already queued.
+
+        Parameters:
+            max_items: Maximum number of actions to return.
+        """
+        messages = [await self.receive_encoded()]
+        now = now_ns() // 1_000_000
+        while len(messages) < max_items:
+            frames = await self._receive_frames_nowait()
+            if frames is None:
+                break
+            if not self._is_expired(frames, now):
+                messages.append(frames)
+        return messages
+
+    async def receive_many(self, max_items: int) -> List[Action]:
+        """Wait for an action and drain all further actions already queued on the socket.
+
+        In contrast to calling :py:meth:`receive_action` repeatedly, all ready actions are received
+        in a single wakeup of the event loop.
+
+        Parameters:
+            max_items: Maximum number of actions to return.
+
+        Actions with a conflation policy are conflated, i.e. only the newest of the received
+        actions per key is returned, see :py:func:`meru.conflation.register_conflation`.
+
+        Returns:
+            The deserialized actions, at least one.
+        """
+        messages = await self.receive_many_encoded(max_items)
+        actions = [decode_object(frames[-1]) for frames in messages]
+        if self.track_latency:
+            now = now_ns()
+            for frames, action in zip(messages, actions):
+                record_latencies(action, get_hops(frames), now)
+        return conflate_actions(actions, self.conflation_metrics)
 
 
 class PushSocket(MessagingSocket):
     """Broker-facing socket for transmitting :py:class:`Action` objects for distribution.
 
+    Actions can optionally be batched: they are collected until either ``batch_size`` actions are
+    pending or ``batch_interval`` µs have passed since the first pending action, and are then sent
+    as a single frame.  Call :py:meth:`flush` to send pending actions immediately, e.g. before
+    closing the socket.
+
+    Parameters:
+        batch_size: Maximum number of actions per batch.  ``1`` disables batching.
+        batch_interval: Maximum time in µs an action is held back.
+        transport: See :py:class:`MessagingSocket`.
+        lanes: Number of priority lanes, defaults to :py:const:`meru.constants.MERU_PRIORITY_LANES`.
+            Actions of higher lanes are sent immediately without batching.
+
+    Attributes:
+        batch_metrics: A :py:class:`BatchMetrics` object with statistics about sent batches.
+
     See Also:
         :py:class:`CollectorSocket`
     """
 
-    def __init__(self):
-        super().__init__()
-        connect_address = build_address(BROKER_ADDRESS, COLLECTOR_PORT)
+    def __init__(
+        self,
+        batch_size: int = MERU_BATCH_SIZE,
+        batch_interval: int = MERU_BATCH_INTERVAL,
+        transport: Union[str, None] = None,
+        lanes: int = MERU_PRIORITY_LANES,
+    ):
+        super().__init__(transport)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.batch_metrics = BatchMetrics()
+        self._batch = []
+        self._flush_handle = None
+        self._flush_task = None
+
+        connect_address = self._build_address(BROKER_ADDRESS, COLLECTOR_PORT)
         self._socket = self.ctx.socket(zmq.PUSH)
         self._socket.setsockopt(zmq.LINGER, 0)
-        if SSH_TUNNEL:
-            tunnel.tunnel_connection(self._socket, connect_address, SSH_TUNNEL)
-        else:
-            self._socket.connect(connect_address)
+        self._connect(connect_address)
+        self._create_lanes(zmq.PUSH, BROKER_ADDRESS, COLLECTOR_PORT, lanes, bind=False)
         logger.debug(f"Connected pusher to {connect_address}")
 
     async def push(self, action: Action):
         """Send an action to the broker."""
-        await self._socket.send_multipart([action.topic, encode_object(action)])
+        if self._lane_sockets and action.priority > 0:
+            await self._lane_socket(action).send_multipart(encode_frames(action))
+            return
+
+        if self.batch_size <= 1:
+            await self._socket.send_multipart(encode_frames(action))
+            return
+
+        self._batch.append(encode_frames(action))
+        if len(self._batch) >= self.batch_size:
+            await self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(
+                self.batch_interval / 1_000_000, self._schedule_flush
+            )
+
+    def _schedule_flush(self):
+        self._flush_handle = None
+        self._flush_task = self.loop.create_task(self.flush())
+        self._flush_task.add_done_callback(self._log_flush_error)
+
+    def _log_flush_error(self, task: asyncio.Task):
+        if task is self._flush_task:
+            self._flush_task = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Failed to send pending actions", exc_info=task.exception())
+
+    async def flush(self):
+        """Send all pending actions."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        self.batch_metrics.record(len(batch))
+        if len(batch) == 1:
+            await self._socket.send_multipart(batch[0])
+        else:
+            await self._socket.send_multipart([BATCH_TOPIC, pack_batch(batch)])
+
+
+StateRequest = namedtuple("StateRequest", "identity request_id action")
 
 
 class StateManagerSocket(MessagingSocket):
@@ -177,13 +671,19 @@ class StateManagerSocket(MessagingSocket):
     In contrast to the :py:class:`PublisherSocket`, :py:class:`Action` objects received by this
     socket are not distributed to the other processes, but answered by the broker directly instead.
 
+    :py:meth:`get_state_request` and :py:meth:`answer_state_request` answer the requests of a
+    process in the order they were received.  The correlation ids of the requests are kept by the
+    socket, so these methods can answer requests sent with :py:meth:`StateConsumerSocket.request`.
+
     See Also:
         :py:class:`StateConsumerSocket`
     """
 
-    def __init__(self):
-        super().__init__()
-        bind_address = build_address(BIND_ADDRESS, STATE_PORT)
+    def __init__(self, transport: Union[str, None] = None):
+        super().__init__(transport)
+        # Correlation ids of the requests received by get_state_request, by identity.
+        self._unanswered = defaultdict(deque)
+        bind_address = self._build_address(BIND_ADDRESS, STATE_PORT)
         self._socket = self.ctx.socket(zmq.ROUTER)
         self._socket.setsockopt(zmq.LINGER, 0)
         self._socket.bind(bind_address)
@@ -197,36 +697,93 @@ class StateManagerSocket(MessagingSocket):
             action: The :py:class:`Action` object to respond with.
         """
         logger.debug(f"Sending state update to {identity}")
-        await self._socket.send_multipart([identity, encode_object(action)])
+        await self._answer(identity, action)
 
     async def send(self, identity, action):
         """The same as ``self.answer_state_request``"""
-        await self._socket.send_multipart([identity, encode_object(action)])
+        await self._answer(identity, action)
+
+    async def _answer(self, identity, action):
+        request_id = None
+        unanswered = self._unanswered.get(identity, None)
+        if unanswered:
+            request_id = unanswered.popleft()
+            if not unanswered:
+                del self._unanswered[identity]
+        await self.reply_encoded(StateRequest(identity, request_id, None), encode_object(action))
 
     async def get_state_request(self):
         """Receives a :py:class:`Action` object and deserialize it.
 
+        The request has to be answered with :py:meth:`answer_state_request`.
+
         Returns:
             A tuple that contains the sender process' identity and the received and deserialized
             action.
         """
-        data = await self._socket.recv_multipart()
-        identity, action_data = data
-        action = decode_object(action_data)
-        return identity, action
+        request = await self.receive_request()
+        self._unanswered[request.identity].append(request.request_id)
+        return request.identity, request.action
+
+    async def receive_request(self) -> StateRequest:
+        """Receives a request sent with :py:meth:`StateConsumerSocket.request` or ``send``.
+
+        Requests carry a correlation id, so they can be answered in any order with :py:meth:`reply`.
+
+        Returns:
+            A :py:class:`StateRequest` with the sender process' identity, the correlation id
+            (``None`` for requests sent with :py:meth:`StateConsumerSocket.send`) and the action.
+        """
+        frames = await self._socket.recv_multipart()
+        if len(frames) == 3:
+            identity, request_id, action_data = frames
+        else:
+            identity, action_data = frames
+            request_id = None
+        return StateRequest(identity, request_id, decode_object(action_data))
+
+    async def reply(self, request: StateRequest, action):
+        """Send the answer to a request received with :py:meth:`receive_request`.
+
+        Parameters:
+            request: The request to answer.
+            action: The :py:class:`Action` object to respond with.
+        """
+        await self.reply_encoded(request, encode_object(action))
+
+    async def reply_encoded(self, request: StateRequest, data: bytes):
+        """Send an already encoded answer to a request received with :py:meth:`receive_request`.
+
+        Parameters:
+            request: The request to answer.
+            data: The encoded :py:class:`Action` object to respond with.
+        """
+        frames = [request.identity]
+        if request.request_id is not None:
+            frames.append(request.request_id)
+        frames.append(data)
+        await self._socket.send_multipart(frames)
 
 
 class StateConsumerSocket(MessagingSocket):
     """Broker-facing socket for 1:1 communication.
 
+    :py:meth:`request` can be used by multiple coroutines concurrently.  Each request carries a
+    correlation id and the answer is routed to the matching caller.  :py:meth:`send` and
+    :py:meth:`receive` are the lock-step alternative and must not be mixed with :py:meth:`request`
+    on the same socket.
+
     See Also:
         :py:class:`StateManagerSocket`
     """
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, transport: Union[str, None] = None):
+        super().__init__(transport)
+        self._request_ids = count()
+        self._requests = {}
+        self._reader = None
 
-        connect_address = build_address(BROKER_ADDRESS, STATE_PORT)
+        connect_address = self._build_address(BROKER_ADDRESS, STATE_PORT)
         self._socket = self.ctx.socket(zmq.DEALER)
         self._socket.setsockopt(zmq.LINGER, 0)
         self._socket.setsockopt(zmq.RCVTIMEO, MERU_RECEIVE_TIMEOUT)
@@ -236,10 +793,7 @@ class StateConsumerSocket(MessagingSocket):
         if process_id:
             self._socket.setsockopt_string(zmq.IDENTITY, process_id)
 
-        if SSH_TUNNEL:
-            tunnel.tunnel_connection(self._socket, connect_address, SSH_TUNNEL)
-        else:
-            self._socket.connect(connect_address)
+        self._connect(connect_address)
 
         logger.debug(f"Connected state consumer to {connect_address}")
 
@@ -256,3 +810,61 @@ class StateConsumerSocket(MessagingSocket):
         data = await self._socket.recv_multipart()
         action = decode_object(data[0])
         return action
+
+    async def request(self, action, timeout: int = MERU_RECEIVE_TIMEOUT):
+        """Send an :py:class:`Action` object to the broker and wait for the answer.
+
+        Parameters:
+            action: The action to send.
+            timeout: Time in ms to wait for the answer.
+
+        Returns:
+            The answer of the broker.
+
+        Raises:
+            :py:class:`asyncio.TimeoutError` if no answer was received in time.
+        """
+        request_id = next(self._request_ids).to_bytes(8, "big")
+        future = self.loop.create_future()
+        self._requests[request_id] = future
+
+        if self._reader is None or self._reader.done():
+            self._reader = self.loop.create_task(self._read_replies())
+
+        try:
+            await self._socket.send_multipart([request_id, encode_object(action)])
+            return await asyncio.wait_for(future, timeout / 1000)
+        finally:
+            self._requests.pop(request_id, None)
+
+    async def _read_replies(self):
+        """Resolve the futures of pending requests until no request is left."""
+        while self._requests:
+            try:
+                frames = await self._socket.recv_multipart()
+            except zmq.Again:
+                continue
+
+            if len(frames) == 2:
+                request_id, action_data = frames
+            elif len(frames) == 1:
+                # A broker that does not know correlation ids answers in the order of the requests.
+                request_id, action_data = next(iter(self._requests), None), frames[0]
+            else:
+                logger.warning("Dropping malformed reply")
+                continue
+
+            future = self._requests.get(request_id, None)
+            if future is None or future.done():
+                # The request timed out already.
+                continue
+
+            try:
+                future.set_result(decode_object(action_data))
+            except Exception as exc:  # pylint: disable=broad-except
+                future.set_exception(exc)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        super().close()
@@ -1,25 +1,65 @@
 """Functionality related to state management.
 
 This module maintains a global list of :py:class:`StateNode` objects.
+
+The broker can additionally keep track of the changes of each state node, see
+:py:func:`enable_state_versioning`.  Processes that request states again, e.g. after a reconnect,
+then only receive the changes since the version they already know.
+
+The broker caches the encoded state nodes in :py:data:`ENCODED_STATES`, so unchanged nodes are not
+serialized again for every state request.
 """
-from collections import defaultdict
+import asyncio
+from collections import defaultdict, deque
+from copy import deepcopy
 from dataclasses import fields
 import logging
-from typing import Type
+from typing import Dict, Iterable, Type, Union
+import uuid
 
-from meru.actions import RequireState, StateUpdate
+from meru.actions import RequireState, StateNodeDelta, StateUpdate
 from meru.base import Action, StateNode
-from meru.helpers import get_type_from_string
+from meru.constants import MERU_STATE_HISTORY_SIZE
+from meru.helpers import get_full_path_to_class, get_type_from_string
+from meru.serialization import encode_object, encode_with_fragments
 from meru.introspection import discover_state_action_handlers
 from meru.sockets import StateConsumerSocket, StateManagerSocket
 from meru.types import StateModelType
 
 STATES = {}
 STATE_ACTION_HANDLERS = defaultdict(lambda: [])
+# The state action handlers of each action class including the handlers of its base classes.
+STATE_DISPATCH_INDEX = {}
+# The broker's current version of each state node, or the version last received by a process.
+STATE_VERSIONS = {}
+# The most recent changes of each state node, only maintained by the broker.
+STATE_HISTORY = {}
+# Identifies this broker instance, versions of different instances are not comparable.
+STATE_EPOCH = uuid.uuid4().hex
+# The encoded state nodes, used by the broker to answer state requests.
+ENCODED_STATES = {}
+# The projected fields of state nodes only partially needed by this process.
+STATE_PROJECTIONS = {}
 logger = logging.getLogger("meru.state")
 
 
-async def request_states():
+class _StateSettings:  # pylint: disable=too-few-public-methods
+    """The state management settings of this process, changed by the functions of this module."""
+
+    def __init__(self):
+        self.history_size = 0
+        self.synced_epoch = ""
+        self.journal = None
+        self.lazy_states = False
+        self.state_consumer = None
+
+
+_settings = _StateSettings()
+# The pending or completed requests of state nodes in lazy mode by state class.
+_state_fetches = {}
+
+
+async def request_states(lazy: bool = False):
     """
     Request states from the state manager. In order for this do have any effect
     all required states have to be registered::
@@ -28,24 +68,112 @@ async def request_states():
 
     Used by the processes.
 
+    In lazy mode no state is requested up front.  Instead, each state node is requested when it is
+    accessed for the first time, see :py:func:`get_state`, :py:func:`load_state` and
+    :py:func:`prefetch_states`.
+
+    Parameters:
+        lazy: Request each state node on its first access instead.
+
     Returns:
         All loaded states
     """
+    if lazy:
+        _settings.lazy_states = True
+        return STATES
+
     state_consumer = StateConsumerSocket()
+    state = await state_consumer.request(_build_state_request(list(STATES.keys())))
+    _apply_state_update(state)
+
+    return STATES
+
 
-    states_to_request = list(STATES.keys())
+def _build_state_request(states_to_request: list) -> RequireState:
+    known_versions = {}
+    projections = {}
+    for state_cls in states_to_request:
+        if state_cls in STATE_VERSIONS:
+            known_versions[get_full_path_to_class(state_cls)] = STATE_VERSIONS[state_cls]
+        if state_cls in STATE_PROJECTIONS:
+            projections[get_full_path_to_class(state_cls)] = STATE_PROJECTIONS[state_cls]
 
-    action = RequireState(states_to_request)
-    await state_consumer.send(action)
+    return RequireState(states_to_request, known_versions, _settings.synced_epoch, projections)
 
-    state = await state_consumer.receive()
 
+def _apply_state_update(state: StateUpdate):
     for node in state.nodes:
         for f in fields(node):
             setattr(STATES[node.__class__], f.name, getattr(node, f.name))
+        STATE_VERSIONS[node.__class__] = state.versions.get(
+            get_full_path_to_class(node.__class__), 0
+        )
         logging.info(f"Loaded state from broker: {node.__class__.__name__}")
 
-    return STATES
+    for delta in state.deltas:
+        state_cls = get_type_from_string(delta.node)
+        delta.apply(STATES[state_cls])
+        STATE_VERSIONS[state_cls] = delta.version
+        logging.info(f"Loaded state changes from broker: {state_cls.__name__}")
+
+    _settings.synced_epoch = state.epoch
+    invalidate_encoded_state()
+
+
+def prefetch_states(*state_classes: Type[StateNode]):
+    """Start requesting state nodes in lazy mode.
+
+    All given nodes that were not requested yet are requested with a single request in the
+    background.  This is a hint for nodes that are about to be used, e.g. at the start of a
+    process, and does nothing outside of lazy mode.
+
+    Parameters:
+        state_classes: The classes of the state nodes.
+    """
+    if not _settings.lazy_states:
+        return
+
+    missing = [state_cls for state_cls in state_classes if state_cls not in _state_fetches]
+    if not missing:
+        return
+
+    fetch = asyncio.ensure_future(_fetch_states(missing))
+    for state_cls in missing:
+        _state_fetches[state_cls] = fetch
+
+
+async def _fetch_states(states_to_request: list):
+    if _settings.state_consumer is None:
+        _settings.state_consumer = StateConsumerSocket()
+
+    try:
+        state = await _settings.state_consumer.request(_build_state_request(states_to_request))
+    except BaseException:
+        # Allow the next access to request the nodes again.
+        for state_cls in states_to_request:
+            _state_fetches.pop(state_cls, None)
+        raise
+
+    _apply_state_update(state)
+
+
+async def load_state(state_cls: StateModelType) -> StateModelType:
+    """Get the instance of the given :py:class:`StateNode` once it is loaded.
+
+    In lazy mode, the node is requested from the broker if this did not happen yet.  Otherwise
+    this is the same as :py:func:`get_state`.
+
+    Parameters:
+        state_cls: The class object of the requested state object.
+
+    Returns:
+        The instance local to this process.
+    """
+    if _settings.lazy_states:
+        if state_cls not in _state_fetches:
+            prefetch_states(state_cls)
+        await asyncio.shield(_state_fetches[state_cls])
+    return STATES[state_cls]
 
 
 async def answer_state_requests():
@@ -59,26 +187,326 @@ async def answer_state_requests():
 
         import asyncio
         asyncio.create_task(answer_state_requests())
+
+    Requests are answered in the order they are received.  Answering does not wait for anything but
+    the socket, the encoded state nodes are cached, see :py:func:`get_encoded_state`.
     """
     state_manager = StateManagerSocket()
 
     while True:
-        identity, action = await state_manager.get_state_request()
-        nodes = []
-        states = get_all_states()
-        for node in action.nodes:
-            node_cls = get_type_from_string(node)
-            nodes.append(states[node_cls])
+        request = await state_manager.receive_request()
+        await _answer_state_request(state_manager, request)
+
+
+async def _answer_state_request(state_manager: StateManagerSocket, request):
+    nodes = []
+    versions = {}
+    deltas = []
+    states = get_all_states()
+    known_versions = request.action.versions if request.action.epoch == STATE_EPOCH else {}
+    projections = request.action.projections
+    for node in request.action.nodes:
+        node_cls = get_type_from_string(node)
+
+        delta = None
+        if node in known_versions:
+            delta = get_state_delta(node_cls, known_versions[node])
+
+        if node in projections:
+            if delta is None:
+                delta = StateNodeDelta.from_projection(
+                    states[node_cls], STATE_VERSIONS.get(node_cls, 0), projections[node]
+                )
+            else:
+                delta = delta.project(projections[node])
+            deltas.append(delta)
+        elif delta is None:
+            nodes.append(node_cls)
+            versions[node] = STATE_VERSIONS.get(node_cls, 0)
+        else:
+            deltas.append(delta)
+
+    action = StateUpdate([], versions, deltas, STATE_EPOCH)
+    data = encode_with_fragments(action, "nodes", [get_encoded_state(node) for node in nodes])
+    if data is None:
+        action.nodes = [states[node_cls] for node_cls in nodes]
+        data = encode_object(action)
+
+    await state_manager.reply_encoded(request, data)
+
+
+def get_encoded_state(state_cls: Type[StateNode]) -> bytes:
+    """Returns the encoded state node, encoding it only if it changed since the last call.
+
+    Parameters:
+        state_cls: The class of the state node.
+
+    Returns:
+        The state node encoded with :py:func:`meru.serialization.encode_object`.
+    """
+    encoded_state = ENCODED_STATES.get(state_cls, None)
+    if encoded_state is None:
+        encoded_state = ENCODED_STATES[state_cls] = encode_object(STATES[state_cls])
+    return encoded_state
+
+
+def invalidate_encoded_state(state_cls: Union[Type[StateNode], None] = None):
+    """Discard the cached encoding of a state node.
+
+    State action handlers invalidate the nodes they belong to automatically.  This only needs to be
+    called if a state node is changed in any other way.
 
-        action = StateUpdate(nodes)
-        await state_manager.answer_state_request(identity, action)
+    Parameters:
+        state_cls: The class of the state node, or ``None`` to discard all cached encodings.
+    """
+    if state_cls is None:
+        ENCODED_STATES.clear()
+    else:
+        ENCODED_STATES.pop(state_cls, None)
+
+
+def enable_state_versioning(history_size: int = MERU_STATE_HISTORY_SIZE):
+    """Keep track of the changes of all state nodes.
+
+    Every time a state action handler changes a state node, the version of the node is increased
+    and the changes are recorded.  :py:func:`answer_state_requests` uses the recorded changes to
+    answer requests of processes that already know an older version of a node.
+
+    The changes are tracked while the handlers run.  Dict fields are replaced by a dict subclass
+    that records the keys that are assigned, removed or whose mutable value is read, as the value
+    might be changed in place, e.g. ``self.orders[key].append(quantity)``.  Replaced fields and
+    other mutable fields, like lists, are recorded completely.
+
+    This is meant to be called by the broker.
+
+    Parameters:
+        history_size: Number of changes kept per state node.  Processes that know an older version
+            receive the complete node instead.
+    """
+    _settings.history_size = history_size
+
+
+def enable_state_journal(journal):
+    """Record every action that changes a state node in a journal.
+
+    This is meant to be called by the broker, see :py:class:`meru.persistence.StateJournal`.
+
+    Parameters:
+        journal: The journal the actions are appended to, or ``None`` to stop recording.
+    """
+    _settings.journal = journal
+
+
+def get_state_delta(state_cls: Type[StateNode], since: int) -> Union[StateNodeDelta, None]:
+    """Returns the changes of a state node since the given version.
+
+    Parameters:
+        state_cls: The class of the state node.
+        since: The version the changes are requested for.
+
+    Returns:
+        A :py:class:`StateNodeDelta` containing all changes, or ``None`` if the changes are no
+        longer available.
+    """
+    if not _settings.history_size:
+        return None
 
+    current = STATE_VERSIONS.get(state_cls, 0)
+    history = STATE_HISTORY.get(state_cls, ())
+    oldest = history[0].version if history else current + 1
 
-def register_state(state_cls: Type[StateNode]):
+    if since > current or since + 1 < oldest:
+        return None
+
+    return StateNodeDelta.merge(
+        get_full_path_to_class(state_cls),
+        current,
+        (delta for delta in history if delta.version > since),
+    )
+
+
+# Values that can not be changed in place.
+_IMMUTABLE_VALUES = (str, bytes, int, float, complex, type(None), tuple, frozenset)
+_MISSING = object()
+
+
+class _TrackedDict(dict):
+    """A dict field of a versioned state node that records the keys changed by the handlers.
+
+    Copies and pickles of the dict are plain dicts.
+    """
+
+    __slots__ = ("changed", "removed")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed = set()
+        self.removed = set()
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    def reset(self):
+        self.changed.clear()
+        self.removed.clear()
+
+    def _mark_mutable(self, items):
+        self.changed.update(key for key, value in items if not isinstance(value, _IMMUTABLE_VALUES))
+
+    def _mark_removed(self, key):
+        self.changed.discard(key)
+        self.removed.add(key)
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if not isinstance(value, _IMMUTABLE_VALUES):
+            self.changed.add(key)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __setitem__(self, key, value):
+        old = dict.get(self, key, _MISSING)
+        if old is _MISSING or not isinstance(value, _IMMUTABLE_VALUES) or old != value:
+            self.changed.add(key)
+            self.removed.discard(key)
+        dict.__setitem__(self, key, value)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._mark_removed(key)
+
+    def pop(self, key, *default):
+        present = key in self
+        value = dict.pop(self, key, *default)
+        if present:
+            self._mark_removed(key)
+        return value
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._mark_removed(key)
+        return key, value
+
+    def clear(self):
+        self.removed.update(self.keys())
+        self.changed.clear()
+        dict.clear(self)
+
+    def values(self):
+        self._mark_mutable(dict.items(self))
+        return dict.values(self)
+
+    def items(self):
+        self._mark_mutable(dict.items(self))
+        return dict.items(self)
+
+
+def _track_state(state_node: StateNode) -> dict:
+    """Start tracking the changes of a state node, returns the current values of its fields."""
+    values = {}
+    for f in fields(state_node):
+        value = getattr(state_node, f.name)
+        if isinstance(value, _TrackedDict):
+            value.reset()
+        elif isinstance(value, dict):
+            value = _TrackedDict(value)
+            setattr(state_node, f.name, value)
+        values[f.name] = value
+    return values
+
+
+def _snapshot_state(state_node: StateNode) -> dict:
+    snapshot = {}
+    for f in fields(state_node):
+        value = getattr(state_node, f.name)
+        if isinstance(value, (dict, list, set)):
+            value = value.copy()
+        snapshot[f.name] = value
+    return snapshot
+
+
+def _record_state_changes(state_node: StateNode, values: dict):
+    # The values are copied, the history must not change with the state node.
+    changed_fields = {}
+    changed_entries = {}
+    removed_entries = {}
+
+    for name, old in values.items():
+        new = getattr(state_node, name)
+        if new is not old:
+            if new != old:
+                changed_fields[name] = deepcopy(new)
+        elif isinstance(new, _TrackedDict):
+            if new.changed:
+                changed_entries[name] = {
+                    key: deepcopy(dict.__getitem__(new, key)) for key in new.changed
+                }
+            if new.removed:
+                removed_entries[name] = list(new.removed)
+            new.reset()
+        elif not isinstance(new, _IMMUTABLE_VALUES):
+            # Changes in place can not be detected for other mutable values.
+            changed_fields[name] = deepcopy(new)
+
+    if not (changed_fields or changed_entries or removed_entries):
+        return
+
+    state_cls = state_node.__class__
+    version = STATE_VERSIONS.get(state_cls, 0) + 1
+    STATE_VERSIONS[state_cls] = version
+
+    history = STATE_HISTORY.get(state_cls, None)
+    if history is None:
+        history = STATE_HISTORY[state_cls] = deque(maxlen=_settings.history_size)
+    history.append(
+        StateNodeDelta(
+            get_full_path_to_class(state_cls),
+            version,
+            changed_fields,
+            changed_entries,
+            removed_entries,
+        )
+    )
+
+
+def register_state(
+    state_cls: Type[StateNode],
+    projection_fields: Union[Iterable[str], None] = None,
+    keys: Union[Dict[str, Iterable], None] = None,
+):
     """Add a state to the list of registered states.
 
     This needs to get called at process initialization for every :py:class:`StateNode` that the
     process plans on using.
+
+    A process that only needs a part of a large state node can restrict it to some fields and to
+    some keys of dict fields.  The broker then only sends the projected parts of the node, the other
+    fields keep their default values::
+
+        register_state(MarketState, projection_fields=["name"], keys={"prices": ["A", "B"]})
+
+    Entries outside the projection that are added by state action handlers are removed again.  The
+    projection has to be declared before the states are requested.
+
+    Parameters:
+        state_cls: The class of the state node.
+        projection_fields: Names of the complete fields the process needs.
+        keys: Names of dict fields mapped to the keys the process needs.
     """
     if state_cls not in STATES:
         STATES[state_cls] = state_cls()
@@ -86,33 +514,111 @@ def register_state(state_cls: Type[StateNode]):
             STATES[state_cls]
         ).items():
             STATE_ACTION_HANDLERS[action] += handlers
+        STATE_DISPATCH_INDEX.clear()
     else:
         pass
 
+    if projection_fields is not None or keys is not None:
+        projection = {name: None for name in projection_fields or ()}
+        projection.update({name: list(entries) for name, entries in (keys or {}).items()})
+        STATE_PROJECTIONS[state_cls] = projection
+
 
 def get_all_states():
     """Returns the global list of states."""
     return STATES
 
 
+def get_state_action_handlers(action_cls: Type[Action]) -> tuple:
+    """Returns the state action handlers that are triggered by an action class.
+
+    Handlers of base classes of ``action_cls`` are included, i.e. a handler annotated with an
+    action class also handles all subclasses.  The result is computed once per action class and
+    cached until another state node is registered.
+
+    Parameters:
+        action_cls: The action class.
+
+    Returns:
+        A tuple of bound handler methods in the order of the method resolution order of
+        ``action_cls``.  Every method is contained once.
+    """
+    handlers = STATE_DISPATCH_INDEX.get(action_cls, None)
+    if handlers is None:
+        collected = {}
+        for cls in action_cls.__mro__:
+            for method in STATE_ACTION_HANDLERS.get(cls, ()):
+                collected.setdefault((id(method.__self__), method.__func__), method)
+        handlers = STATE_DISPATCH_INDEX[action_cls] = tuple(collected.values())
+    return handlers
+
+
 async def update_state(action: Action):
     """Calls the state update handlers that are triggered by an :py:class:`Action` oject.
 
     Parameters:
         action: The action.
+
+    See Also:
+        :py:func:`get_state_action_handlers`
     """
-    if action.__class__ in STATE_ACTION_HANDLERS:
-        for method in STATE_ACTION_HANDLERS[action.__class__]:
-            method(action)
+    handlers = STATE_DISPATCH_INDEX.get(action.__class__, None)
+    if handlers is None:
+        handlers = get_state_action_handlers(action.__class__)
+
+    if handlers:
+        if not _settings.history_size:
+            for method in handlers:
+                method(action)
+                ENCODED_STATES.pop(method.__self__.__class__, None)
+        else:
+            tracked = {}
+            for method in handlers:
+                state_node = method.__self__
+                if id(state_node) not in tracked:
+                    tracked[id(state_node)] = (state_node, _track_state(state_node))
+                method(action)
+                ENCODED_STATES.pop(state_node.__class__, None)
+
+            for state_node, values in tracked.values():
+                _record_state_changes(state_node, values)
+
+        # Only actions whose handlers succeed are recorded, so a replay never fails on them again.
+        if _settings.journal is not None:
+            _settings.journal.append(action)
+
+        if STATE_PROJECTIONS:
+            _prune_projected_entries(handlers)
+
+
+def _prune_projected_entries(handlers):
+    state_nodes = {id(method.__self__): method.__self__ for method in handlers}
+    for state_node in state_nodes.values():
+        projection = STATE_PROJECTIONS.get(state_node.__class__, None)
+        if projection is None:
+            continue
+
+        for name, keys in projection.items():
+            if keys is None:
+                continue
+            entries = getattr(state_node, name)
+            for key in entries.keys() - set(keys):
+                del entries[key]
 
 
 def get_state(state_cls: StateModelType) -> StateModelType:
     """Get the instance of the given :py:class:`StateNode` used by this process.
 
+    In lazy mode, the first access starts requesting the node from the broker in the background.
+    Until the answer arrives, the node has its default values.  Use :py:func:`load_state` to wait
+    for the node.
+
     Parameters:
         state_cls: The class object of the requested state object.
 
     Returns:
         The instance local to this process.
     """
+    if _settings.lazy_states and state_cls not in _state_fetches:
+        prefetch_states(state_cls)
     return STATES[state_cls]
@@ -5,7 +5,9 @@ from dataclasses import dataclass, field
 import pytest
 
 from meru.base import Action, MeruObject, StateNode
+from meru.helpers import get_process_identity
 from meru.sockets import StateConsumerSocket, StateManagerSocket
+from meru.state import _StateSettings
 
 
 @dataclass
@@ -31,8 +33,15 @@ class DummyState(StateNode):
         self.state_field = action.field
 
 
+@pytest.fixture(autouse=True, scope="function")
+def cleared_process_identity():
+    # The identity is cached by the first action created in a test.
+    get_process_identity.cache_clear()
+
+
 @pytest.fixture(autouse=True, scope="function")
 def mocked_state_action_handlers(mocker):
+    mocker.patch("meru.state.STATE_DISPATCH_INDEX", {})
     return mocker.patch("meru.state.STATE_ACTION_HANDLERS", defaultdict(lambda: list()))
 
 
@@ -41,6 +50,24 @@ def mocked_states(mocker):
     return mocker.patch("meru.state.STATES", {})
 
 
+@pytest.fixture(autouse=True, scope="function")
+def mocked_encoded_states(mocker):
+    return mocker.patch("meru.state.ENCODED_STATES", {})
+
+
+@pytest.fixture(autouse=True, scope="function")
+def mocked_state_projections(mocker):
+    return mocker.patch("meru.state.STATE_PROJECTIONS", {})
+
+
+@pytest.fixture(autouse=True, scope="function")
+def mocked_state_versions(mocker):
+    mocker.patch("meru.state.STATE_HISTORY", {})
+    mocker.patch("meru.state._settings", _StateSettings())
+    mocker.patch("meru.state._state_fetches", {})
+    return mocker.patch("meru.state.STATE_VERSIONS", {})
+
+
 @pytest.yield_fixture()
 def event_loop():
     loop = asyncio.get_event_loop()
@@ -75,15 +102,20 @@ def dummy_state_cls():
     return DummyState
 
 
+@pytest.fixture(params=["tcp", "ipc", "inproc"])
+def transport(request):
+    return request.param
+
+
 @pytest.fixture()
-def state_manager():
-    socket = StateManagerSocket()
+def state_manager(transport):
+    socket = StateManagerSocket(transport=transport)
     yield socket
     socket.close()
 
 
 @pytest.fixture()
-def state_consumer():
-    socket = StateConsumerSocket()
+def state_consumer(transport):
+    socket = StateConsumerSocket(transport=transport)
     yield socket
     socket.close()
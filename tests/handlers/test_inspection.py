@@ -1,7 +1,9 @@
+from typing import List
+
 import pytest
 
 from meru.exceptions import HandlerException
-from meru.introspection import inspect_action_handler_args
+from meru.introspection import inspect_action_handler_args, is_batch_action_handler
 
 
 def test_successful_inspection_action_and_state(dummy_action, dummy_state_cls):
@@ -88,3 +90,14 @@ def test_failed_inspection_invalid_type(dummy_state_cls):
         "An action handler can only have Actions and StateNodes as calling args"
         in str(exc.value)
     )
+
+
+def test_inspect_batch_handler(dummy_action, dummy_state_cls):
+    def handle_dummy_actions(actions: List[dummy_action], state: dummy_state_cls):
+        pass
+
+    action, required_states = inspect_action_handler_args(handle_dummy_actions)
+
+    assert action == dummy_action
+    assert required_states == {dummy_state_cls}
+    assert is_batch_action_handler(handle_dummy_actions)
@@ -1,8 +1,24 @@
+import asyncio
+from dataclasses import dataclass
+import os
+import threading
+from typing import List
 from unittest.mock import create_autospec
 
 import pytest
 
-from meru.handlers import ActionHandler, handle_action, register_action_handler
+from meru.base import Action, StateNode
+from meru.exceptions import HandlerException
+from meru.handlers import (
+    ActionHandler,
+    flush_batches,
+    get_handled_topics,
+    handle_action,
+    next_batch_deadline,
+    register_action_handler,
+    shutdown_executors,
+)
+from meru.state import register_state
 
 
 def test_register_handler(mocker, dummy_action, dummy_state_cls, mocked_states):
@@ -38,3 +54,126 @@ async def test_call_handler(mocker, dummy_action, dummy_state_cls, mocked_states
         action=dummy_action(),
         state=mocked_states[dummy_state_cls],
     )
+
+
+def test_get_handled_topics(mocker, dummy_action, dummy_action_with_field, dummy_state_cls):
+    mocker.patch("meru.handlers.HANDLERS", {})
+
+    def dummy_handler(action: dummy_action):
+        pass
+
+    register_action_handler(dummy_handler)
+    register_state(dummy_state_cls)
+
+    assert get_handled_topics() == {dummy_action.topic, dummy_action_with_field.topic}
+
+
+def test_get_handled_topics_includes_subclasses(mocker, dummy_action_with_field, dummy_state_cls):
+    mocker.patch("meru.handlers.HANDLERS", {})
+
+    @dataclass
+    class SpecialAction(dummy_action_with_field):
+        pass
+
+    register_state(dummy_state_cls)
+
+    assert get_handled_topics() == {dummy_action_with_field.topic, SpecialAction.topic}
+
+
+@dataclass
+class MultiplyAction(Action):
+    value: str
+
+
+@dataclass
+class PrefixState(StateNode):
+    prefix: str = "state-"
+
+
+def multiply_in_process(action: MultiplyAction, state: PrefixState):
+    yield MultiplyAction(f"{state.prefix}{action.value * 2}")
+    yield MultiplyAction(str(os.getpid()))
+
+
+@pytest.fixture
+def executors():
+    yield
+    shutdown_executors()
+
+
+@pytest.mark.asyncio
+async def test_call_handler_in_thread(mocker, executors, dummy_action_with_field):
+    mocker.patch("meru.handlers.HANDLERS", {})
+
+    @register_action_handler(executor="thread")
+    def handler(action: dummy_action_with_field):
+        return threading.current_thread().name
+
+    responses = [response async for response in handle_action(dummy_action_with_field("a"))]
+
+    assert len(responses) == 1
+    assert responses[0].startswith("meru-handler")
+
+
+@pytest.mark.asyncio
+async def test_call_handler_in_process(mocker, executors):
+    mocker.patch("meru.handlers.HANDLERS", {})
+    register_action_handler(executor="process")(multiply_in_process)
+
+    responses = [response async for response in handle_action(MultiplyAction("ab"))]
+
+    assert responses[0].value == "state-abab"
+    assert responses[1].value != str(os.getpid())
+
+
+def test_executor_requires_sync_handler(mocker, dummy_action):
+    mocker.patch("meru.handlers.HANDLERS", {})
+
+    async def handler(action: dummy_action):
+        pass
+
+    with pytest.raises(HandlerException):
+        register_action_handler(executor="thread")(handler)
+
+    with pytest.raises(HandlerException):
+        register_action_handler(lambda action: None, executor="fiber")
+
+
+@pytest.mark.asyncio
+async def test_batch_handler_by_size(mocker, dummy_action_with_field):
+    mocker.patch("meru.handlers.HANDLERS", {})
+    mocker.patch("meru.handlers.PENDING_BATCHES", {})
+
+    @register_action_handler(batch_size=3)
+    async def handler(actions: List[dummy_action_with_field]):
+        return [action.field for action in actions]
+
+    responses = []
+    for field in "abcd":
+        responses += [response async for response in handle_action(dummy_action_with_field(field))]
+
+    assert responses == [["a", "b", "c"]]
+
+    responses = [response async for response in flush_batches(force=True)]
+    assert responses == [["d"]]
+
+
+@pytest.mark.asyncio
+async def test_batch_handler_by_interval(mocker, dummy_action_with_field):
+    mocker.patch("meru.handlers.HANDLERS", {})
+    mocker.patch("meru.handlers.PENDING_BATCHES", {})
+
+    @register_action_handler(batch_interval=20000)
+    async def handler(actions: List[dummy_action_with_field]):
+        yield len(actions)
+
+    [_ async for _ in handle_action(dummy_action_with_field("a"))]
+    [_ async for _ in handle_action(dummy_action_with_field("b"))]
+
+    assert [response async for response in flush_batches()] == []
+    assert next_batch_deadline() is not None
+
+    await asyncio.sleep(0.02)
+
+    assert [response async for response in flush_batches()] == [2]
+    assert next_batch_deadline() is None
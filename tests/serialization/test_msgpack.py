@@ -0,0 +1,67 @@
+import pytest
+
+from meru.actions import RequireState, StateUpdate
+from meru.serialization import decode_object, encode_object, get_codec_plan
+
+pytest.importorskip("msgpack")
+
+
+def test_msgpack_roundtrip_object(dummy_object):
+    obj = dummy_object()
+
+    assert decode_object(encode_object(obj, "msgpack"), "msgpack") == obj
+
+
+def test_msgpack_roundtrip_action(dummy_action_with_field):
+    action = dummy_action_with_field("some value")
+
+    result = decode_object(encode_object(action, "msgpack"), "msgpack")
+
+    assert result == action
+    assert result.timestamp == action.timestamp
+    assert result.origin == action.origin
+
+
+def test_msgpack_nested_state_nodes(dummy_state_cls):
+    action = StateUpdate([dummy_state_cls("a"), dummy_state_cls("b")])
+
+    result = decode_object(encode_object(action, "msgpack"), "msgpack")
+
+    assert result.nodes == [dummy_state_cls("a"), dummy_state_cls("b")]
+
+
+def test_msgpack_require_state(dummy_state_cls):
+    action = RequireState([dummy_state_cls])
+
+    result = decode_object(encode_object(action, "msgpack"), "msgpack")
+
+    assert result.nodes == ["conftest.DummyState"]
+
+
+def test_msgpack_smaller_than_json(dummy_action_with_field):
+    action = dummy_action_with_field("some value")
+
+    assert len(encode_object(action, "msgpack")) < len(encode_object(action, "json"))
+
+
+def test_msgpack_values_without_timestamp_ns(dummy_action_with_field):
+    action = dummy_action_with_field("some value")
+    plan = get_codec_plan(action.object_type)
+
+    # Actions encoded by older versions end before timestamp_ns.
+    result = plan.decode_values(plan.encode_values(action.to_dict())[:-1])
+
+    assert result.timestamp == action.timestamp
+    assert result.timestamp_ns == action.timestamp * 1_000_000
+
+
+def test_codec_plan_encode(dummy_action_with_field, dummy_state_cls):
+    action = dummy_action_with_field("some value")
+    plan = get_codec_plan(action.object_type)
+
+    assert plan.encode(action) == plan.encode_values(action.to_dict())
+
+    require_state = RequireState([dummy_state_cls])
+    plan = get_codec_plan(require_state.object_type)
+
+    assert plan.encode(require_state) == plan.encode_values(require_state.to_dict())
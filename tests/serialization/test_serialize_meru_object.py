@@ -1,9 +1,23 @@
-from freezegun import freeze_time
+from dataclasses import dataclass, field
 
-from meru.serialization import decode_object, encode_object
+import pytest
+
+from meru.actions import StateUpdate
+from meru.base import MeruObject
+from meru.exceptions import ActionException
+from meru.serialization import (
+    decode_object,
+    encode_object,
+    encode_with_fragments,
+    get_codec_plan,
+)
 
 encoded_object = b'{"object_type": "DummyObject"}'
 encoded_action = b'{"timestamp": 1495584000000, "origin": "does not matter", "object_type": "DummyAction"}'
+encoded_action_ns = (
+    b'{"timestamp": 1495584000000, "origin": "does not matter", '
+    b'"timestamp_ns": 1495584000000123456, "object_type": "DummyAction"}'
+)
 
 
 def test_encode_custom_object(dummy_object):
@@ -19,22 +33,76 @@ def test_decode_custom_object(dummy_object):
     assert custom_object == dummy_object()
 
 
-def test_encode_action(dummy_action):
-    with freeze_time('2017-05-24'):
-        action = dummy_action()
-        action.origin = "does not matter"
+def test_encode_action(mocker, dummy_action):
+    mocker.patch("meru.base.now_ns", return_value=1495584000000123456)
+    action = dummy_action()
+    action.origin = "does not matter"
 
     result = encode_object(action)
-    assert result == encoded_action
+    assert result == encoded_action_ns
 
 
-def test_decode_action(dummy_action):
-    action = decode_object(encoded_action)
+def test_decode_action(mocker, dummy_action):
+    action = decode_object(encoded_action_ns)
 
-    with freeze_time('2017-05-24'):
-        expected_action = dummy_action()
-        expected_action.origin = "does not matter"
+    mocker.patch("meru.base.now_ns", return_value=1495584000000123456)
+    expected_action = dummy_action()
+    expected_action.origin = "does not matter"
 
     assert action.object_type == expected_action.object_type
     assert action.timestamp == expected_action.timestamp
+    assert action.timestamp_ns == expected_action.timestamp_ns
     assert action.topic == action.topic
+
+
+def test_decode_action_without_timestamp_ns():
+    action = decode_object(encoded_action)
+
+    assert action.timestamp == 1495584000000
+    assert action.timestamp_ns == 1495584000000000000
+
+
+def test_decode_unknown_object():
+    with pytest.raises(ActionException):
+        decode_object(b'{"object_type": "NotAMeruObject"}')
+
+
+def test_codec_plan_applies_cast():
+    @dataclass
+    class CastObject(MeruObject):
+        value: int = field(metadata={"cast": int})
+
+    plan = get_codec_plan("CastObject")
+
+    assert plan.cls is CastObject
+    assert plan.restored_fields == ()
+    assert decode_object(b'{"object_type": "CastObject", "value": "12"}') == CastObject(12)
+
+
+def test_codec_plan_is_reused(dummy_action):
+    assert get_codec_plan("DummyAction") is get_codec_plan("DummyAction")
+    assert get_codec_plan("DummyAction").restored_fields == ("timestamp", "origin")
+
+
+@pytest.mark.parametrize("method", ["json", "msgpack"])
+def test_encode_with_fragments(method, dummy_state_cls):
+    if method == "msgpack":
+        pytest.importorskip("msgpack")
+    nodes = [dummy_state_cls("a"), dummy_state_cls("b")]
+    action = StateUpdate([], {"some.Node": 3}, [], "epoch")
+
+    encoded = encode_with_fragments(
+        action, "nodes", [encode_object(node, method) for node in nodes], method
+    )
+    result = decode_object(encoded, method)
+
+    assert result.nodes == nodes
+    assert result.versions == {"some.Node": 3}
+    assert result.epoch == "epoch"
+    assert result.timestamp == action.timestamp
+
+
+def test_encode_with_fragments_unsupported(dummy_state_cls):
+    action = StateUpdate([])
+
+    assert encode_with_fragments(action, "nodes", [], "pickle") is None
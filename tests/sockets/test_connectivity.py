@@ -1,7 +1,24 @@
+import asyncio
+import time
+from typing import List
+
 import pytest
 
 from meru.actions import RequireState, StateUpdate
-from meru.sockets import CollectorSocket, PublisherSocket, PushSocket, SubscriberSocket
+from meru.conflation import register_conflation
+from meru.handlers import register_action_handler
+from meru.sockets import (
+    CollectorSocket,
+    PublisherSocket,
+    PushSocket,
+    SubscriberSocket,
+    add_hop,
+    encode_frames,
+    get_hops,
+    is_expired,
+    pack_batch,
+    unpack_batch,
+)
 
 
 @pytest.mark.asyncio
@@ -26,6 +43,26 @@ async def test_push_to_collector(dummy_action, wait):
     await wait()
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("transport", ["tcp", "ipc", "inproc"])
+async def test_push_to_collector_transports(transport, dummy_action, wait):
+    collector = CollectorSocket(transport=transport)
+    pusher = PushSocket(transport=transport)
+    publisher = PublisherSocket(transport=transport)
+    subscriber = SubscriberSocket(transport=transport)
+    await wait()
+
+    action = dummy_action()
+    await pusher.push(action)
+    await publisher.publish(await collector.collect())
+
+    assert await subscriber.receive_action() == action
+
+    for socket in (pusher, collector, publisher, subscriber):
+        socket.close()
+    await wait()
+
+
 @pytest.mark.asyncio
 async def test_publisher_to_subscriber(dummy_action, wait):
     publisher = PublisherSocket()
@@ -59,3 +96,298 @@ async def test_state_manager_to_state_consumer(state_manager, state_consumer, wa
     state = await state_consumer.receive()
 
     assert state == action
+
+
+@pytest.mark.asyncio
+async def test_state_manager_answers_correlated_requests(
+    state_manager, state_consumer, dummy_state_cls
+):
+    async def answer():
+        for _ in range(2):
+            identity, action = await state_manager.get_state_request()
+            nodes = [dummy_state_cls()] if action.nodes else []
+            await state_manager.answer_state_request(identity, StateUpdate(nodes))
+
+    task = asyncio.create_task(answer())
+
+    first = await state_consumer.request(RequireState([]))
+    second = await state_consumer.request(RequireState([dummy_state_cls]))
+    await task
+
+    assert first.nodes == []
+    assert second.nodes == [dummy_state_cls()]
+
+
+@pytest.mark.asyncio
+async def test_state_consumer_routes_replies_without_id(state_manager, state_consumer):
+    async def answer():
+        request = await state_manager.receive_request()
+        await state_manager.reply(request._replace(request_id=None), StateUpdate(["answer"]))
+
+    task = asyncio.create_task(answer())
+
+    result = await state_consumer.request(RequireState([]))
+    await task
+
+    assert result.nodes == ["answer"]
+
+
+@pytest.mark.asyncio
+async def test_push_batch_to_collector(dummy_action_with_field, wait):
+    collector = CollectorSocket()
+    pusher = PushSocket(batch_size=3, batch_interval=1_000_000)
+    await wait()
+
+    actions = [dummy_action_with_field(str(i)) for i in range(3)]
+    for action in actions:
+        await pusher.push(action)
+
+    results = [await collector.collect() for _ in actions]
+
+    assert results == actions
+    assert pusher.batch_metrics.batches == 1
+    assert pusher.batch_metrics.max_size == 3
+
+    pusher.close()
+    collector.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_push_batch_flushed_after_interval(dummy_action, wait):
+    collector = CollectorSocket()
+    pusher = PushSocket(batch_size=100, batch_interval=1000)
+    await wait()
+
+    action = dummy_action()
+    await pusher.push(action)
+    await wait()
+
+    assert await collector.collect() == action
+    assert pusher.batch_metrics.mean_size == 1
+
+    pusher.close()
+    collector.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_urgent_lane_received_first(mocker, dummy_action, dummy_action_with_field, wait):
+    mocker.patch.object(dummy_action_with_field, "priority", 1)
+    collector = CollectorSocket(lanes=2)
+    pusher = PushSocket(lanes=2)
+    publisher = PublisherSocket(lanes=2)
+    subscriber = SubscriberSocket(lanes=2)
+    await wait()
+
+    for _ in range(10):
+        await pusher.push(dummy_action())
+    await pusher.push(dummy_action_with_field("urgent"))
+    await wait()
+
+    collected = [await collector.collect() for _ in range(11)]
+    assert collected[0].field == "urgent"
+
+    for action in collected[1:]:
+        await publisher.publish(action)
+    await publisher.publish(collected[0])
+    await wait()
+
+    received = [await subscriber.receive_action() for _ in range(11)]
+    assert received[0].field == "urgent"
+    assert received[1:] == collected[1:]
+
+    for socket in (pusher, collector, publisher, subscriber):
+        socket.close()
+    await wait()
+
+
+def test_pack_unpack_batch():
+    messages = [[b"topic", b"payload"], [b"", b""], [b"a", b"b", b"c"]]
+
+    assert unpack_batch(pack_batch(messages)) == messages
+
+
+@pytest.mark.asyncio
+async def test_subscriber_receive_many(dummy_action_with_field, wait):
+    publisher = PublisherSocket()
+    subscriber = SubscriberSocket()
+    await wait()
+
+    actions = [dummy_action_with_field(str(i)) for i in range(5)]
+    for action in actions:
+        await publisher.publish(action)
+    await wait()
+
+    assert await subscriber.receive_many(3) == actions[:3]
+    assert await subscriber.receive_many(10) == actions[3:]
+
+    publisher.close()
+    subscriber.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_subscriber_flushes_batch_handlers(mocker, dummy_action_with_field, wait):
+    mocker.patch("meru.handlers.HANDLERS", {})
+    mocker.patch("meru.handlers.PENDING_BATCHES", {})
+
+    @register_action_handler(batch_interval=50000)
+    async def handler(actions: List[dummy_action_with_field]):
+        return [action.field for action in actions]
+
+    publisher = PublisherSocket()
+    subscriber = SubscriberSocket()
+    await wait()
+
+    await publisher.publish(dummy_action_with_field("a"))
+    await publisher.publish(dummy_action_with_field("b"))
+    await wait()
+
+    assert [response async for response in subscriber.handle_incoming_actions(10)] == []
+    assert [response async for response in subscriber.handle_incoming_actions(10)] == [
+        ["a", "b"]
+    ]
+
+    publisher.close()
+    subscriber.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_subscriber_conflation(mocker, dummy_action, dummy_action_with_field, wait):
+    mocker.patch("meru.conflation.CONFLATION_POLICIES", {})
+    register_conflation(dummy_action_with_field, key=lambda action: action.field[0])
+    publisher = PublisherSocket()
+    subscriber = SubscriberSocket()
+    await wait()
+
+    for field in ["a1", "b1", "a2", "a3"]:
+        await publisher.publish(dummy_action_with_field(field))
+    await publisher.publish(dummy_action())
+    await wait()
+
+    received = await subscriber.receive_many(10)
+
+    assert [getattr(action, "field", None) for action in received] == ["b1", "a3", None]
+    assert subscriber.conflation_metrics.total == 2
+
+    publisher.close()
+    subscriber.close()
+    await wait()
+
+
+def test_deadline_header(mocker, dummy_action):
+    action = dummy_action()
+    assert len(encode_frames(action)) == 2
+    assert not is_expired(encode_frames(action), action.timestamp + 1_000_000)
+
+    mocker.patch.object(dummy_action, "ttl", 100)
+    frames = encode_frames(action)
+
+    assert len(frames) == 3
+    assert not is_expired(frames, action.timestamp + 100)
+    assert is_expired(frames, action.timestamp + 101)
+
+
+def test_hop_stamps(mocker, dummy_action):
+    action = dummy_action()
+    frames = add_hop(add_hop(encode_frames(action), 10), 20)
+
+    assert get_hops(encode_frames(action)) == ()
+    assert get_hops(frames) == (10, 20)
+    assert not is_expired(frames, action.timestamp + 1_000_000)
+
+    mocker.patch.object(dummy_action, "ttl", 100)
+    frames = add_hop(encode_frames(action), 10)
+
+    assert get_hops(frames) == (10,)
+    assert is_expired(frames, action.timestamp + 101)
+
+
+@pytest.mark.asyncio
+async def test_subscriber_drops_expired_actions(
+    mocker, dummy_action, dummy_action_with_field, wait
+):
+    mocker.patch.object(dummy_action_with_field, "ttl", 1000)
+    publisher = PublisherSocket()
+    subscriber = SubscriberSocket()
+    await wait()
+
+    expired = dummy_action_with_field("expired")
+    expired.timestamp -= 2000
+    await publisher.publish(expired)
+    await publisher.publish(dummy_action_with_field("valid"))
+    await publisher.publish(expired)
+    await publisher.publish(dummy_action())
+    await wait()
+
+    assert (await subscriber.receive_action()).field == "valid"
+    assert isinstance((await subscriber.receive_many(10))[0], dummy_action)
+    assert subscriber.expiry_metrics.total == 2
+    assert subscriber.expiry_metrics.dropped[dummy_action_with_field.topic] == 2
+
+    publisher.close()
+    subscriber.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_subscriber_expiry_follows_action_clock(mocker, dummy_action_with_field, wait):
+    mocker.patch.object(dummy_action_with_field, "ttl", 1000)
+    mocker.patch("time.time", return_value=time.time() + 3600)
+    publisher = PublisherSocket()
+    subscriber = SubscriberSocket()
+    await wait()
+
+    await publisher.publish(dummy_action_with_field("valid"))
+    await wait()
+
+    assert (await asyncio.wait_for(subscriber.receive_action(), 1)).field == "valid"
+    assert subscriber.expiry_metrics.total == 0
+
+    publisher.close()
+    subscriber.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_subscriber_auto_subscribe(mocker, dummy_action, dummy_action_with_field, wait):
+    mocker.patch("meru.handlers.get_handled_topics", return_value={dummy_action_with_field.topic})
+    publisher = PublisherSocket()
+    subscriber = SubscriberSocket(auto_subscribe=True)
+    await wait()
+
+    await publisher.publish(dummy_action())
+    await publisher.publish(dummy_action_with_field("value"))
+    await wait()
+
+    received = await subscriber.receive_many(10)
+
+    assert [action.field for action in received] == ["value"]
+
+    publisher.close()
+    subscriber.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_answered_out_of_order(
+    state_manager, state_consumer, dummy_state_cls
+):
+    first = asyncio.create_task(state_consumer.request(RequireState([])))
+    second = asyncio.create_task(state_consumer.request(RequireState([dummy_state_cls])))
+
+    requests = [await state_manager.receive_request(), await state_manager.receive_request()]
+    for request in reversed(requests):
+        nodes = [dummy_state_cls(node) for node in request.action.nodes]
+        await state_manager.reply(request, StateUpdate(nodes))
+
+    assert (await first).nodes == []
+    assert (await second).nodes == [dummy_state_cls("conftest.DummyState")]
+
+
+@pytest.mark.asyncio
+async def test_request_timeout(state_manager, state_consumer):
+    with pytest.raises(asyncio.TimeoutError):
+        await state_consumer.request(RequireState([]), timeout=100)
@@ -0,0 +1,251 @@
+import asyncio
+
+import pytest
+
+from meru.relay import ActionRelay
+from meru.serialization import decode_object
+from meru.sockets import PushSocket, SubscriberSocket, get_hops
+
+
+@pytest.mark.asyncio
+async def test_relay_forwards_without_inspection(dummy_action, wait):
+    relay = ActionRelay()
+    relay.start()
+    await wait()
+
+    subscriber = SubscriberSocket()
+    pusher = PushSocket()
+    await wait()
+
+    action = dummy_action()
+    await pusher.push(action)
+
+    assert await subscriber.receive_action() == action
+
+    relay.close()
+    assert relay.is_running is False
+    pusher.close()
+    subscriber.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_relay_inspects_selected_topics(dummy_action, dummy_action_with_field, wait, mocker):
+    mocker.patch.object(dummy_action_with_field, "topic", b"inspected")
+    inspected = []
+
+    async def hook(action):
+        inspected.append(action)
+
+    relay = ActionRelay(inspect_topics=[b"inspected"], hook=hook)
+    relay.start()
+    task = asyncio.create_task(relay.run())
+    await wait()
+
+    subscriber = SubscriberSocket()
+    pusher = PushSocket()
+    await wait()
+
+    await pusher.push(dummy_action())
+    await pusher.push(dummy_action_with_field("value"))
+
+    await subscriber.receive_action()
+    await subscriber.receive_action()
+    await wait()
+
+    assert [action.field for action in inspected] == ["value"]
+
+    task.cancel()
+    await wait()
+    assert relay.is_running is False
+    pusher.close()
+    subscriber.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_relay_forwards_batches(dummy_action, dummy_action_with_field, wait, mocker):
+    mocker.patch.object(dummy_action_with_field, "topic", b"wanted")
+    relay = ActionRelay()
+    relay.start()
+    await wait()
+
+    subscriber = SubscriberSocket(topics=["wanted"])
+    pusher = PushSocket(batch_size=2)
+    await wait()
+
+    await pusher.push(dummy_action())
+    await pusher.push(dummy_action_with_field("value"))
+
+    result = await subscriber.receive_action()
+    assert result.field == "value"
+
+    relay.close()
+    pusher.close()
+    subscriber.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_relay_inspects_batches(dummy_action, dummy_action_with_field, wait, mocker):
+    mocker.patch.object(dummy_action_with_field, "topic", b"inspected")
+    inspected = []
+
+    async def hook(action):
+        inspected.append(action)
+
+    relay = ActionRelay(inspect_topics=[b"inspected"], hook=hook)
+    relay.start()
+    task = asyncio.create_task(relay.run())
+    await wait()
+
+    subscriber = SubscriberSocket()
+    pusher = PushSocket(batch_size=3)
+    await wait()
+
+    await pusher.push(dummy_action_with_field("first"))
+    await pusher.push(dummy_action())
+    await pusher.push(dummy_action_with_field("second"))
+
+    for _ in range(3):
+        await subscriber.receive_action()
+    await wait()
+
+    assert [action.field for action in inspected] == ["first", "second"]
+
+    task.cancel()
+    await wait()
+    pusher.close()
+    subscriber.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_relay_conflates_topics(dummy_action, dummy_action_with_field, wait):
+    relay = ActionRelay(conflate_topics=[dummy_action_with_field.topic])
+    relay.start()
+    await wait()
+
+    subscriber = SubscriberSocket()
+    pusher = PushSocket(batch_size=6)
+    await wait()
+
+    for i in range(5):
+        await pusher.push(dummy_action_with_field(str(i)))
+    await pusher.push(dummy_action())
+    await wait()
+
+    received = await subscriber.receive_many(10)
+
+    assert [getattr(action, "field", None) for action in received] == ["4", None]
+    assert relay.conflation_metrics.skipped == {dummy_action_with_field.topic: 4}
+
+    relay.close()
+    pusher.close()
+    subscriber.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_relay_conflates_by_key(dummy_action_with_field, wait):
+    relay = ActionRelay(
+        conflate_topics=[dummy_action_with_field.topic],
+        conflation_key=lambda frames: decode_object(frames[-1]).field[0],
+    )
+    relay.start()
+    await wait()
+
+    subscriber = SubscriberSocket()
+    pusher = PushSocket(batch_size=4)
+    await wait()
+
+    for field in ["a0", "b0", "a1", "b1"]:
+        await pusher.push(dummy_action_with_field(field))
+    await wait()
+
+    received = await subscriber.receive_many(10)
+
+    assert [action.field for action in received] == ["a1", "b1"]
+    assert relay.conflation_metrics.skipped == {dummy_action_with_field.topic: 2}
+
+    relay.close()
+    pusher.close()
+    subscriber.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_relay_forwards_priority_lanes(dummy_action, dummy_action_with_field, wait, mocker):
+    mocker.patch.object(dummy_action_with_field, "priority", 1)
+    relay = ActionRelay(lanes=2)
+    relay.start()
+    await wait()
+
+    subscriber = SubscriberSocket(lanes=2)
+    pusher = PushSocket(lanes=2)
+    await wait()
+
+    bulk_action = dummy_action()
+    await pusher.push(bulk_action)
+    await pusher.push(dummy_action_with_field("urgent"))
+    await wait()
+
+    result = await subscriber.receive_action()
+    assert result.field == "urgent"
+    assert await subscriber.receive_action() == bulk_action
+
+    relay.close()
+    assert relay.is_running is False
+    pusher.close()
+    subscriber.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_relay_drops_expired_actions(dummy_action_with_field, wait, mocker):
+    mocker.patch.object(dummy_action_with_field, "ttl", 1000)
+    relay = ActionRelay(drop_expired=True)
+    relay.start()
+    await wait()
+
+    subscriber = SubscriberSocket()
+    pusher = PushSocket(batch_size=2)
+    await wait()
+
+    expired = dummy_action_with_field("expired")
+    expired.timestamp -= 2000
+    await pusher.push(expired)
+    await pusher.push(dummy_action_with_field("valid"))
+
+    result = await subscriber.receive_action()
+    assert result.field == "valid"
+    assert relay.expiry_metrics.total == 1
+    assert subscriber.expiry_metrics.total == 0
+
+    relay.close()
+    pusher.close()
+    subscriber.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_relay_stamps_hops(dummy_action, wait):
+    relay = ActionRelay(stamp_hops=True)
+    relay.start()
+    await wait()
+
+    subscriber = SubscriberSocket()
+    pusher = PushSocket()
+    await wait()
+
+    action = dummy_action()
+    await pusher.push(action)
+
+    frames = await subscriber.receive_encoded()
+    (hop,) = get_hops(frames)
+    assert hop >= action.timestamp_ns
+
+    relay.close()
+    pusher.close()
+    subscriber.close()
+    await wait()
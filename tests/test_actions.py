@@ -9,3 +9,19 @@ def test_get_all_actions():
     assert Action in actions.values()
     assert RequireState in actions.values()
     assert StateUpdate in actions.values()
+
+
+def test_topic_derived_from_class_name(dummy_action):
+    assert dummy_action.topic == b"DummyAction\x00"
+
+
+def test_explicit_topic_is_inherited():
+    class ExplicitTopicAction(Action):
+        topic = b"explicit"
+
+    class InheritedTopicAction(ExplicitTopicAction):
+        pass
+
+    assert ExplicitTopicAction.topic == b"explicit"
+    assert InheritedTopicAction.topic == b"explicit"
+    assert StateUpdate.topic == b"StateUpdate"
@@ -1,5 +1,8 @@
+import os
+
 from click.testing import CliRunner
 
+from meru import constants
 from meru.command_line import (
     main_cli,
     process_cli,
@@ -83,3 +86,20 @@ def test_register_process(mocker):
 
     assert result.exit_code == 0
     assert "process_name" in result.output
+
+
+def test_event_loop_option(mocker):
+    run_process = mocker.patch("meru.command_line.run_process")
+    mocker.patch("meru.command_line.AVAILABLE_PROCESSES", {})
+    environ = mocker.patch.dict(os.environ, {})
+    mocker.patch("meru.constants.MERU_EVENT_LOOP", "asyncio")
+
+    register_process("process1", "x")
+
+    runner = CliRunner()
+    result = runner.invoke(main_cli, ["--event-loop", "uvloop", "process", "multi", "process1"])
+
+    assert result.exit_code == 0
+    assert environ["MERU_EVENT_LOOP"] == "uvloop"
+    assert constants.MERU_EVENT_LOOP == "uvloop"
+    run_process.assert_called_once_with("x")
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from meru.dispatch import ActionDispatcher
+from meru.handlers import register_action_handler
+from meru.state import register_state
+
+
+class QueueSubscriber:
+    def __init__(self, actions):
+        self.queue = asyncio.Queue()
+        for action in actions:
+            self.queue.put_nowait(action)
+
+    async def receive_action(self):
+        return await self.queue.get()
+
+
+@pytest.fixture
+def handlers(mocker):
+    return mocker.patch("meru.handlers.HANDLERS", {})
+
+
+async def collect(dispatcher, count):
+    responses = []
+    generator = dispatcher.handle_incoming_actions()
+    try:
+        async for response in generator:
+            responses.append(response)
+            if len(responses) == count:
+                break
+    finally:
+        await generator.aclose()
+    return responses
+
+
+@pytest.mark.asyncio
+async def test_bounded_concurrency(handlers, dummy_action_with_field):
+    running = []
+    max_running = 0
+
+    async def slow_handler(action: dummy_action_with_field):
+        nonlocal max_running
+        running.append(action)
+        max_running = max(max_running, len(running))
+        await asyncio.sleep(0.01)
+        running.remove(action)
+        return action.field
+
+    register_action_handler(slow_handler)
+    subscriber = QueueSubscriber([dummy_action_with_field(str(i)) for i in range(6)])
+    dispatcher = ActionDispatcher(subscriber, max_concurrency=2)
+
+    responses = await collect(dispatcher, 6)
+
+    assert sorted(responses) == [str(i) for i in range(6)]
+    assert max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_ordering_by_key(handlers, dummy_action_with_field):
+    async def handler(action: dummy_action_with_field):
+        # Earlier actions take longer, so unordered handling would reverse them.
+        await asyncio.sleep(0.01 * (3 - int(action.field[1])))
+        return action.field
+
+    register_action_handler(handler)
+    fields = ["a0", "b0", "a1", "b1", "a2", "b2"]
+    subscriber = QueueSubscriber([dummy_action_with_field(field) for field in fields])
+    dispatcher = ActionDispatcher(subscriber, key=lambda action: action.field[0])
+
+    responses = await collect(dispatcher, 6)
+
+    assert [response for response in responses if response[0] == "a"] == ["a0", "a1", "a2"]
+    assert [response for response in responses if response[0] == "b"] == ["b0", "b1", "b2"]
+
+
+@pytest.mark.asyncio
+async def test_handler_exception_is_raised(handlers, dummy_action_with_field):
+    async def failing_handler(action: dummy_action_with_field):
+        raise ValueError(action.field)
+
+    register_action_handler(failing_handler)
+    dispatcher = ActionDispatcher(QueueSubscriber([dummy_action_with_field("failed")]))
+
+    with pytest.raises(ValueError, match="failed"):
+        await collect(dispatcher, 1)
+
+
+@pytest.mark.asyncio
+async def test_handler_exception_is_logged_without_consumer(
+    handlers, dummy_action_with_field, caplog
+):
+    async def failing_handler(action: dummy_action_with_field):
+        raise ValueError(action.field)
+
+    register_action_handler(failing_handler)
+    dispatcher = ActionDispatcher(QueueSubscriber([]))
+
+    await dispatcher.dispatch(dummy_action_with_field("failed"))
+    await asyncio.sleep(0.01)
+
+    assert any(
+        record.name == "meru.dispatch" and isinstance(record.exc_info[1], ValueError)
+        for record in caplog.records
+    )
+
+
+@pytest.mark.asyncio
+async def test_states_updated_in_order_across_keys(
+    handlers, dummy_state_cls, dummy_action_with_field, mocked_states
+):
+    async def slow_handler(action: dummy_action_with_field):
+        if action.field == "a1":
+            await asyncio.sleep(0.05)
+        return action.field
+
+    register_state(dummy_state_cls)
+    register_action_handler(slow_handler)
+    subscriber = QueueSubscriber([dummy_action_with_field(field) for field in ["a1", "a2", "b3"]])
+    dispatcher = ActionDispatcher(subscriber, key=lambda action: action.field[0])
+
+    responses = await collect(dispatcher, 3)
+
+    assert responses == ["b3", "a1", "a2"]
+    assert mocked_states[dummy_state_cls].state_field == "b3"
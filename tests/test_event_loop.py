@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from meru import create_event_loop
+from meru.exceptions import MeruException
+
+
+@pytest.fixture()
+def restore_event_loop():
+    policy = asyncio.get_event_loop_policy()
+    loop = asyncio.get_event_loop()
+    yield
+    asyncio.set_event_loop_policy(policy)
+    asyncio.set_event_loop(loop)
+
+
+def test_create_asyncio_event_loop(restore_event_loop):
+    loop = create_event_loop("asyncio")
+
+    assert isinstance(loop, asyncio.AbstractEventLoop)
+    loop.close()
+
+
+def test_create_uvloop_event_loop(restore_event_loop):
+    uvloop = pytest.importorskip("uvloop")
+    policy = asyncio.get_event_loop_policy()
+    loop = create_event_loop("uvloop")
+
+    assert isinstance(loop, uvloop.Loop)
+    assert asyncio.get_event_loop_policy() is policy
+    loop.close()
+
+
+def test_default_event_loop(restore_event_loop, mocker):
+    uvloop = pytest.importorskip("uvloop")
+    mocker.patch("meru.constants.MERU_EVENT_LOOP", "uvloop")
+    loop = create_event_loop()
+
+    assert isinstance(loop, uvloop.Loop)
+    loop.close()
+
+
+def test_uvloop_fallback(restore_event_loop, mocker):
+    mocker.patch.dict("sys.modules", {"uvloop": None})
+    loop = create_event_loop("uvloop")
+
+    assert isinstance(loop, asyncio.AbstractEventLoop)
+    loop.close()
+
+
+def test_unknown_event_loop():
+    with pytest.raises(MeruException):
+        create_event_loop("unknown")
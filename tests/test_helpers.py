@@ -18,6 +18,19 @@ def test_build_address():
     assert res == 'tcp://127.0.0.1:24051'
 
 
+def test_build_address_ipc(mocker):
+    mocker.patch("meru.helpers.MERU_IPC_PATH", "/tmp")
+    res = build_address('127.0.0.1', 24051, 'ipc')
+
+    assert res == 'ipc:///tmp/meru-24051.ipc'
+
+
+def test_build_address_inproc():
+    res = build_address('127.0.0.1', 24051, 'inproc')
+
+    assert res == 'inproc://meru-24051'
+
+
 def test_get_identity_full(mocker):
     mocker.patch("socket.gethostname", return_value="pytesthost")
     mocker.patch.dict(os.environ, {"MERU_PROCESS": "meru_process"})
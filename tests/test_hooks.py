@@ -0,0 +1,126 @@
+import pytest
+
+from meru import handlers, serialization, sockets, state
+from meru.actions import StateUpdate
+from meru.exceptions import MeruException
+from meru.hooks import clear_hooks, register_hook, remove_hook
+from meru.sockets import CollectorSocket, PushSocket
+from meru.state import register_state
+
+
+@pytest.fixture(autouse=True)
+def cleared_hooks():
+    yield
+    clear_hooks()
+
+
+def test_functions_unchanged_without_hooks():
+    encode_object = serialization.encode_object
+    push = PushSocket.push
+
+    def hook(*args, **kwargs):
+        pass
+
+    register_hook("encode", before=hook)
+    register_hook("send", after=hook)
+    assert sockets.encode_object is not encode_object
+    assert PushSocket.push is not push
+
+    remove_hook("encode", before=hook)
+    remove_hook("send", after=hook)
+    assert serialization.encode_object is encode_object
+    assert sockets.encode_object is encode_object
+    assert PushSocket.push is push
+
+
+def test_encode_and_decode_hooks(dummy_action_with_field):
+    calls = []
+    register_hook("encode", before=lambda obj: calls.append(("before encode", obj.field)))
+    register_hook(
+        "decode", after=lambda obj, elapsed, data: calls.append(("after decode", obj.field))
+    )
+
+    action = dummy_action_with_field("value")
+    serialization.decode_object(serialization.encode_object(action))
+
+    assert calls == [("before encode", "value"), ("after decode", "value")]
+
+
+def test_encode_hooks_of_state_replies(dummy_state_cls):
+    encoded = []
+    register_hook("encode", after=lambda data, elapsed, obj, *args: encoded.append((obj, data)))
+
+    action = StateUpdate([])
+    fragment = serialization.encode_object(dummy_state_cls("a"), "json")
+    data = state.encode_with_fragments(action, "nodes", [fragment], "json")
+
+    assert encoded[-1] == (action, data)
+
+
+@pytest.mark.asyncio
+async def test_send_and_receive_hooks(dummy_action, wait):
+    sent = []
+    received = []
+    register_hook("send", before=lambda socket, action: sent.append((socket, action)))
+    register_hook(
+        "receive", after=lambda result, elapsed, socket: received.append((socket, result))
+    )
+
+    collector = CollectorSocket()
+    pusher = PushSocket()
+    await wait()
+
+    action = dummy_action()
+    await pusher.push(action)
+    await collector.collect()
+
+    assert sent == [(pusher, action)]
+    assert received == [(collector, action)]
+
+    pusher.close()
+    collector.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_handle_and_update_state_hooks(
+    dummy_state_cls, dummy_action_with_field, mocked_states
+):
+    register_state(dummy_state_cls)
+    calls = []
+    register_hook("handle", after=lambda result, elapsed, action: calls.append("handle"))
+    register_hook(
+        "update_state",
+        before=lambda action: calls.append("before update"),
+        after=lambda result, elapsed, action: calls.append("after update"),
+    )
+
+    async for _ in handlers.handle_action(dummy_action_with_field("value")):
+        pass
+    await state.update_state(dummy_action_with_field("value"))
+
+    assert calls == ["before update", "after update", "handle", "before update", "after update"]
+
+
+def test_unknown_hook_point():
+    with pytest.raises(MeruException):
+        register_hook("unknown", before=print)
+
+
+@pytest.mark.asyncio
+async def test_after_hooks_of_closed_generators(dummy_action_with_field, mocker):
+    mocker.patch("meru.handlers.HANDLERS", {})
+
+    @handlers.register_action_handler
+    async def handle(action: dummy_action_with_field):
+        yield action
+        yield action
+
+    calls = []
+    register_hook("handle", after=lambda result, elapsed, action: calls.append(action.field))
+
+    generator = handlers.handle_action(dummy_action_with_field("closed"))
+    await generator.__anext__()
+    await generator.aclose()
+
+    assert calls == ["closed"]
@@ -0,0 +1,82 @@
+import pytest
+
+from meru.latency import (
+    LATENCIES,
+    LatencyHistogram,
+    clear_latencies,
+    get_latency_histogram,
+    record_latencies,
+)
+from meru.metrics import render_metrics
+from meru.sockets import PublisherSocket, SubscriberSocket
+
+
+@pytest.fixture(autouse=True)
+def cleared_latencies():
+    yield
+    clear_latencies()
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for value in range(1, 10001):
+        histogram.record(value * 1000)
+
+    assert histogram.count == 10000
+    assert histogram.max == 10_000_000
+    assert histogram.percentile(50) == pytest.approx(5_000_000, rel=1 / 64)
+    assert histogram.percentile(99) == pytest.approx(9_900_000, rel=1 / 64)
+    assert histogram.percentile(100) == 10_000_000
+    assert histogram.mean == pytest.approx(5_000_500)
+
+
+def test_histogram_small_values_are_exact():
+    histogram = LatencyHistogram()
+    for value in (3, 5, 7, -1):
+        histogram.record(value)
+
+    assert histogram.percentile(25) == 0
+    assert histogram.percentile(50) == 3
+    assert histogram.percentile(75) == 5
+
+
+def test_empty_histogram():
+    assert LatencyHistogram().percentile(99) == 0
+
+
+def test_record_latencies(dummy_action):
+    action = dummy_action()
+    start = action.timestamp_ns
+
+    record_latencies(action, (start + 1000, start + 1500), now=start + 4000)
+
+    assert get_latency_histogram(dummy_action).max == 4000
+    assert get_latency_histogram(dummy_action, "producer_to_broker").max == 1000
+    assert get_latency_histogram(dummy_action, "broker_to_consumer").max == 2500
+
+
+def test_record_latencies_without_hops(dummy_action):
+    record_latencies(dummy_action())
+
+    assert list(LATENCIES) == [(dummy_action.__name__, "end_to_end")]
+
+
+@pytest.mark.asyncio
+async def test_subscriber_tracks_latency(dummy_action, wait):
+    publisher = PublisherSocket(stamp_hops=True)
+    subscriber = SubscriberSocket(track_latency=True)
+    await wait()
+
+    await publisher.publish(dummy_action())
+    await subscriber.receive_action()
+
+    for segment in ("end_to_end", "producer_to_broker", "broker_to_consumer"):
+        assert get_latency_histogram(dummy_action, segment).count == 1
+
+    metrics = render_metrics()
+    assert 'meru_latency_seconds_count{action="DummyAction",segment="end_to_end"} 1' in metrics
+    assert 'segment="broker_to_consumer",quantile="0.99"' in metrics
+
+    publisher.close()
+    subscriber.close()
+    await wait()
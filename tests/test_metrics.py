@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from meru import handlers, metrics, serialization, sockets, state
+from meru.actions import StateUpdate
+from meru.handlers import handle_action
+from meru.metrics import (
+    ACTION_LATENCY,
+    ACTIONS_RECEIVED,
+    ACTIONS_SENT,
+    ENCODED_BYTES,
+    HANDLER_DURATION,
+    STATE_UPDATE_DURATION,
+    Histogram,
+    clear_metrics,
+    disable_metrics,
+    enable_metrics,
+    render_metrics,
+    start_metrics_server,
+)
+from meru.sockets import CollectorSocket, PushSocket
+from meru.state import register_state
+
+
+@pytest.fixture
+def enabled_metrics():
+    enable_metrics()
+    yield
+    disable_metrics()
+    clear_metrics()
+
+
+def test_enable_and_disable_metrics():
+    encode_object = sockets.encode_object
+    update_state = handlers.update_state
+
+    enable_metrics()
+    assert sockets.encode_object is not encode_object
+    assert serialization.encode_object is not encode_object
+    assert handlers.update_state is not update_state
+
+    disable_metrics()
+    assert sockets.encode_object is encode_object
+    assert serialization.encode_object is encode_object
+    assert handlers.update_state is update_state
+
+
+def test_metrics_of_state_replies(enabled_metrics, dummy_state_cls):
+    action = StateUpdate([])
+    fragment = serialization.encode_object(dummy_state_cls("a"), "json")
+
+    data = state.encode_with_fragments(action, "nodes", [fragment], "json")
+    assert ENCODED_BYTES.values[("StateUpdate",)] == len(data)
+
+    # Pickle does not support fragments, the fallback to encode_object is recorded instead.
+    assert state.encode_with_fragments(action, "nodes", [fragment], "pickle") is None
+    assert ENCODED_BYTES.values[("StateUpdate",)] == len(data)
+
+
+@pytest.mark.asyncio
+async def test_metrics_of_sent_and_received_actions(enabled_metrics, dummy_action, wait):
+    collector = CollectorSocket()
+    pusher = PushSocket()
+    await wait()
+
+    action = dummy_action()
+    await pusher.push(action)
+    await collector.collect()
+
+    name = dummy_action.__name__
+    assert ACTIONS_SENT.values[(name,)] == 1
+    assert ACTIONS_RECEIVED.values[(name, action.origin)] == 1
+    assert ACTION_LATENCY.count((name, action.origin)) == 1
+    assert ENCODED_BYTES.values[(name,)] > 0
+
+    pusher.close()
+    collector.close()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_metrics_of_handled_actions(
+    enabled_metrics, dummy_state_cls, dummy_action_with_field, mocked_states
+):
+    register_state(dummy_state_cls)
+
+    async for _ in handlers.handle_action(dummy_action_with_field("value")):
+        pass
+
+    name = dummy_action_with_field.__name__
+    assert HANDLER_DURATION.count((name,)) == 1
+    assert STATE_UPDATE_DURATION.count((name,)) == 1
+
+
+def test_render_histogram(mocker):
+    mocker.patch.dict(metrics.METRICS, clear=True)
+    histogram = Histogram("test_seconds", "A test.", ["action"], buckets=(0.1, 1))
+    histogram.observe(("Some\"Action",), 0.5)
+    histogram.observe(("Some\"Action",), 5)
+
+    assert render_metrics().splitlines() == [
+        "# HELP test_seconds A test.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{action="Some\\"Action",le="0.1"} 0',
+        'test_seconds_bucket{action="Some\\"Action",le="1"} 1',
+        'test_seconds_bucket{action="Some\\"Action",le="+Inf"} 2',
+        'test_seconds_sum{action="Some\\"Action"} 5.5',
+        'test_seconds_count{action="Some\\"Action"} 2',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(enabled_metrics):
+    ACTIONS_SENT.inc(("ScrapedAction",))
+    server = await start_metrics_server(0)
+    port = server.sockets[0].getsockname()[1]
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    response = await reader.read()
+    writer.close()
+    server.close()
+    await server.wait_closed()
+
+    assert response.startswith(b"HTTP/1.0 200 OK\r\n")
+    assert b'meru_actions_sent_total{action="ScrapedAction"} 1' in response
+
+
+def test_handle_action_not_wrapped_by_default():
+    assert handlers.handle_action is handle_action
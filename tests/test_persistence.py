@@ -0,0 +1,267 @@
+import asyncio
+from dataclasses import dataclass
+import os
+import time
+
+import pytest
+
+from meru import persistence
+from meru.base import Action, StateNode
+from meru.exceptions import MeruException
+from meru.persistence import (
+    StateJournal,
+    load_snapshot,
+    restore_states,
+    run_snapshots,
+    save_snapshot,
+)
+from meru.state import get_encoded_state, get_state, register_state, update_state
+
+
+@dataclass
+class RejectedAction(Action):
+    pass
+
+
+@dataclass
+class RejectingState(StateNode):
+    def handle_rejected(self, action: RejectedAction):
+        raise ValueError("rejected")
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    return str(tmp_path / "state.snapshot")
+
+
+@pytest.mark.asyncio
+async def test_snapshot_roundtrip(
+    snapshot_path, dummy_state_cls, dummy_action_with_field, mocked_states, mocked_state_versions
+):
+    register_state(dummy_state_cls)
+    await update_state(dummy_action_with_field("saved"))
+    mocked_state_versions[dummy_state_cls] = 7
+
+    await save_snapshot(snapshot_path)
+
+    state_node = get_state(dummy_state_cls)
+    state_node.state_field = "lost"
+    mocked_state_versions.clear()
+    get_encoded_state(dummy_state_cls)
+
+    assert load_snapshot(snapshot_path)
+    assert get_state(dummy_state_cls) is state_node
+    assert state_node.state_field == "saved"
+    assert mocked_state_versions[dummy_state_cls] == 7
+    assert b"saved" in get_encoded_state(dummy_state_cls)
+
+    # The handlers are still bound to the restored state node.
+    await update_state(dummy_action_with_field("changed"))
+    assert state_node.state_field == "changed"
+
+
+def test_load_missing_snapshot(snapshot_path):
+    assert not load_snapshot(snapshot_path)
+
+
+def test_load_invalid_snapshot(snapshot_path):
+    with open(snapshot_path, "wb") as snapshot_file:
+        snapshot_file.write(b"no snapshot")
+
+    with pytest.raises(MeruException):
+        load_snapshot(snapshot_path)
+
+
+@pytest.mark.asyncio
+async def test_load_snapshot_writable_by_others(snapshot_path, dummy_state_cls):
+    register_state(dummy_state_cls)
+    await save_snapshot(snapshot_path)
+    os.chmod(snapshot_path, 0o666)
+
+    with pytest.raises(MeruException):
+        load_snapshot(snapshot_path)
+
+
+@pytest.mark.asyncio
+async def test_load_snapshot_of_other_user(snapshot_path, dummy_state_cls, mocker):
+    register_state(dummy_state_cls)
+    await save_snapshot(snapshot_path)
+    mocker.patch("os.getuid", return_value=os.getuid() + 1)
+
+    with pytest.raises(MeruException):
+        load_snapshot(snapshot_path)
+
+
+@pytest.mark.asyncio
+async def test_snapshot_creates_private_directory(tmp_path, dummy_state_cls):
+    register_state(dummy_state_cls)
+    await save_snapshot(str(tmp_path / "meru" / "state.snapshot"))
+
+    assert (tmp_path / "meru").stat().st_mode & 0o777 == 0o700
+    assert load_snapshot(str(tmp_path / "meru" / "state.snapshot"))
+
+
+@pytest.mark.asyncio
+async def test_snapshot_on_shutdown(snapshot_path, dummy_state_cls):
+    register_state(dummy_state_cls)
+    task = asyncio.create_task(run_snapshots(3600, snapshot_path))
+    await asyncio.sleep(0)
+
+    get_state(dummy_state_cls).state_field = "final"
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    get_state(dummy_state_cls).state_field = ""
+    load_snapshot(snapshot_path)
+
+    assert get_state(dummy_state_cls).state_field == "final"
+
+
+@pytest.mark.asyncio
+async def test_snapshot_on_shutdown_waits_for_pending_write(
+    snapshot_path, dummy_state_cls, mocker
+):
+    write_snapshot_data = persistence._write_snapshot_data
+    writes = []
+
+    def slow_first_write(data, path):
+        writes.append(data)
+        if len(writes) == 1:
+            time.sleep(0.1)
+        write_snapshot_data(data, path)
+
+    mocker.patch("meru.persistence._write_snapshot_data", slow_first_write)
+    register_state(dummy_state_cls)
+    get_state(dummy_state_cls).state_field = "outdated"
+    task = asyncio.create_task(run_snapshots(0, snapshot_path))
+    await asyncio.sleep(0.01)
+
+    get_state(dummy_state_cls).state_field = "final"
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(0.2)
+
+    load_snapshot(snapshot_path)
+
+    assert len(writes) == 2
+    assert get_state(dummy_state_cls).state_field == "final"
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = StateJournal(str(tmp_path / "journal"))
+    yield journal
+    journal.close()
+
+
+@pytest.mark.asyncio
+async def test_journal_replay(journal, dummy_state_cls, dummy_action_with_field):
+    register_state(dummy_state_cls)
+    journal.open()
+
+    await update_state(dummy_action_with_field("first"))
+    await update_state(dummy_action_with_field("second"))
+    journal.close()
+
+    get_state(dummy_state_cls).state_field = ""
+
+    assert await journal.replay() == 2
+    assert get_state(dummy_state_cls).state_field == "second"
+    assert len(list(journal.read())) == 2
+
+
+@pytest.mark.asyncio
+async def test_journal_ignores_incomplete_record(journal, dummy_state_cls, dummy_action_with_field):
+    register_state(dummy_state_cls)
+    journal.open()
+    await update_state(dummy_action_with_field("complete"))
+    journal.close()
+
+    with open(journal.segment_path(journal.segment), "ab") as segment_file:
+        segment_file.write(b"\x00\x00\x01\x00incomplete")
+
+    journal.open()
+    await update_state(dummy_action_with_field("next segment"))
+    journal.close()
+
+    assert [action.field for action in journal.read()] == ["complete", "next segment"]
+
+
+@pytest.mark.asyncio
+async def test_journal_segment_writable_by_others(
+    journal, dummy_state_cls, dummy_action_with_field
+):
+    register_state(dummy_state_cls)
+    journal.open()
+    await update_state(dummy_action_with_field("planted"))
+    journal.close()
+    os.chmod(journal.segment_path(journal.segment), 0o666)
+
+    with pytest.raises(MeruException):
+        await journal.replay()
+
+
+def test_journal_creates_private_segments(journal):
+    journal.open()
+
+    assert os.stat(journal.directory).st_mode & 0o777 == 0o700
+    assert os.stat(journal.segment_path(journal.segment)).st_mode & 0o777 == 0o600
+
+
+@pytest.mark.asyncio
+async def test_journal_skips_failed_actions(journal):
+    register_state(RejectingState)
+    journal.open()
+
+    with pytest.raises(ValueError):
+        await update_state(RejectedAction())
+
+    assert list(journal.read()) == []
+
+
+@pytest.mark.asyncio
+async def test_journal_replay_skips_failing_actions(
+    journal, dummy_state_cls, dummy_action_with_field
+):
+    register_state(dummy_state_cls)
+    register_state(RejectingState)
+    journal.open()
+    journal.append(RejectedAction())
+    journal.append(dummy_action_with_field("after"))
+    journal.close()
+
+    assert await journal.replay() == 1
+    assert get_state(dummy_state_cls).state_field == "after"
+
+
+def test_journal_rotates_full_segments(journal, dummy_action_with_field):
+    journal.segment_size = 1
+    journal.open()
+
+    journal.append(dummy_action_with_field("a"))
+    journal.append(dummy_action_with_field("b"))
+
+    assert journal.segments() == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_restore_from_snapshot_and_journal(
+    snapshot_path, journal, dummy_state_cls, dummy_action_with_field, wait
+):
+    register_state(dummy_state_cls)
+    journal.open()
+
+    await update_state(dummy_action_with_field("in snapshot"))
+    await save_snapshot(snapshot_path, journal)
+    await update_state(dummy_action_with_field("in journal"))
+    journal.close()
+    await wait()
+
+    assert journal.segments() == [1]
+
+    get_state(dummy_state_cls).state_field = ""
+
+    assert await restore_states(snapshot_path, journal) == 1
+    assert get_state(dummy_state_cls).state_field == "in journal"
@@ -1,11 +1,23 @@
+import asyncio
+from dataclasses import dataclass
 import logging
+from typing import Union
 
 import pytest
 
+from meru.actions import RequireState
+from meru.base import Action, StateNode
+from meru.serialization import encode_object
+
 from meru.state import (
     answer_state_requests,
     get_all_states,
+    get_encoded_state,
     get_state,
+    get_state_action_handlers,
+    invalidate_encoded_state,
+    load_state,
+    prefetch_states,
     register_state,
     request_states,
     update_state,
@@ -64,3 +76,155 @@ async def test_state_request_cycle(event_loop, dummy_state_cls, wait):
 
     task.cancel()
     await wait()
+
+
+@pytest.mark.asyncio
+async def test_encoded_state_invalidated_by_handler(
+    dummy_state_cls, dummy_action_with_field, mocked_encoded_states
+):
+    register_state(dummy_state_cls)
+    encoded = get_encoded_state(dummy_state_cls)
+
+    assert get_encoded_state(dummy_state_cls) is encoded
+
+    await update_state(dummy_action_with_field("changed"))
+
+    assert dummy_state_cls not in mocked_encoded_states
+    assert b"changed" in get_encoded_state(dummy_state_cls)
+
+
+def test_invalidate_encoded_state(dummy_state_cls, mocked_encoded_states):
+    register_state(dummy_state_cls)
+    get_encoded_state(dummy_state_cls)
+
+    get_state(dummy_state_cls).state_field = "changed"
+    invalidate_encoded_state(dummy_state_cls)
+
+    assert b"changed" in get_encoded_state(dummy_state_cls)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_state_requests(
+    event_loop, dummy_state_cls, state_manager, state_consumer, wait, mocker
+):
+    mocker.patch("meru.state.StateManagerSocket", return_value=state_manager)
+    register_state(dummy_state_cls)
+    get_state(dummy_state_cls).state_field = "value"
+
+    task = event_loop.create_task(answer_state_requests())
+
+    answers = await asyncio.gather(
+        *(state_consumer.request(RequireState([dummy_state_cls])) for _ in range(10))
+    )
+
+    assert all(answer.nodes == [dummy_state_cls("value")] for answer in answers)
+
+    task.cancel()
+    await wait()
+
+
+@dataclass
+class BaseCounterAction(Action):
+    amount: int
+
+
+@dataclass
+class SpecialCounterAction(BaseCounterAction):
+    pass
+
+
+@dataclass
+class OtherCounterAction(Action):
+    amount: int
+
+
+@dataclass
+class CounterState(StateNode):
+    total: int = 0
+    special: int = 0
+
+    def handle_base(self, action: BaseCounterAction):
+        self.total += action.amount
+
+    def handle_special(self, action: Union[SpecialCounterAction, OtherCounterAction]):
+        self.special += action.amount
+
+
+@dataclass
+class OtherCounterState(StateNode):
+    total: int = 0
+
+    def handle_base(self, action: BaseCounterAction):
+        self.total += action.amount
+
+
+@pytest.mark.asyncio
+async def test_update_state_calls_handlers_of_base_classes():
+    register_state(CounterState)
+
+    await update_state(SpecialCounterAction(2))
+    await update_state(BaseCounterAction(3))
+    await update_state(OtherCounterAction(4))
+
+    assert get_state(CounterState) == CounterState(total=5, special=6)
+
+
+def test_dispatch_index_invalidated_by_register_state():
+    register_state(CounterState)
+
+    handlers = get_state_action_handlers(SpecialCounterAction)
+    assert [method.__func__ for method in handlers] == [
+        CounterState.handle_special,
+        CounterState.handle_base,
+    ]
+    assert get_state_action_handlers(SpecialCounterAction) is handlers
+
+    register_state(OtherCounterState)
+
+    assert len(get_state_action_handlers(SpecialCounterAction)) == 3
+
+
+@pytest.mark.asyncio
+async def test_lazy_state_loading(
+    event_loop, dummy_state_cls, state_manager, state_consumer, wait, mocker, mocked_encoded_states
+):
+    mocker.patch("meru.state.StateManagerSocket", return_value=state_manager)
+    mocker.patch("meru.state.StateConsumerSocket", return_value=state_consumer)
+    request = mocker.spy(state_consumer, "request")
+    register_state(dummy_state_cls)
+    register_state(CounterState)
+
+    # The broker answers with its cached encoding of the node.
+    mocked_encoded_states[dummy_state_cls] = encode_object(dummy_state_cls("from broker"))
+    task = event_loop.create_task(answer_state_requests())
+
+    await request_states(lazy=True)
+    assert request.call_count == 0
+
+    assert get_state(dummy_state_cls).state_field == ""
+    assert (await load_state(dummy_state_cls)).state_field == "from broker"
+    assert request.call_count == 1
+    assert request.call_args[0][0].nodes == [dummy_state_cls]
+
+    await load_state(dummy_state_cls)
+    assert request.call_count == 1
+
+    task.cancel()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_prefetch_states_single_request(dummy_state_cls, mocker):
+    register_state(dummy_state_cls)
+    register_state(CounterState)
+    fetch = mocker.patch("meru.state._fetch_states")
+
+    prefetch_states(dummy_state_cls)
+    fetch.assert_not_called()
+
+    await request_states(lazy=True)
+    prefetch_states(dummy_state_cls, CounterState)
+    prefetch_states(CounterState)
+    get_state(dummy_state_cls)
+
+    fetch.assert_called_once_with([dummy_state_cls, CounterState])
@@ -0,0 +1,254 @@
+from dataclasses import dataclass, field
+
+import pytest
+
+from meru.actions import RequireState, StateNodeDelta
+from meru.base import Action, StateNode
+from meru.helpers import get_full_path_to_class
+from meru.state import (
+    STATE_EPOCH,
+    answer_state_requests,
+    enable_state_versioning,
+    get_state,
+    get_state_delta,
+    register_state,
+    update_state,
+)
+
+
+@dataclass
+class SetPrice(Action):
+    symbol: str
+    price: int
+
+
+@dataclass
+class RemovePrice(Action):
+    symbol: str
+
+
+@dataclass
+class RenameMarket(Action):
+    name: str
+
+
+@dataclass
+class MarketState(StateNode):
+    name: str = ""
+    prices: dict = field(default_factory=dict)
+
+    def handle_set_price(self, action: SetPrice):
+        self.prices[action.symbol] = action.price
+
+    def handle_remove_price(self, action: RemovePrice):
+        del self.prices[action.symbol]
+
+    def handle_rename(self, action: RenameMarket):
+        self.name = action.name
+
+
+MARKET_STATE = get_full_path_to_class(MarketState)
+
+
+@dataclass
+class AddOrder(Action):
+    symbol: str
+    quantity: int
+
+
+@dataclass
+class OrderBook(StateNode):
+    orders: dict = field(default_factory=dict)
+
+    def handle_add_order(self, action: AddOrder):
+        self.orders.setdefault(action.symbol, [])
+        self.orders[action.symbol].append(action.quantity)
+
+
+@pytest.mark.asyncio
+async def test_update_state_records_versions(mocked_state_versions):
+    enable_state_versioning(10)
+    register_state(MarketState)
+
+    await update_state(SetPrice("A", 1))
+    await update_state(SetPrice("B", 2))
+    await update_state(RemovePrice("A"))
+    await update_state(RenameMarket("market"))
+
+    assert mocked_state_versions[MarketState] == 4
+
+    delta = get_state_delta(MarketState, 1)
+    assert delta.version == 4
+    assert delta.changed_fields == {"name": "market"}
+    assert delta.changed_entries == {"prices": {"B": 2}}
+    assert delta.removed_entries == {"prices": ["A"]}
+
+
+@pytest.mark.asyncio
+async def test_unchanged_state_keeps_version(mocked_state_versions):
+    enable_state_versioning(10)
+    register_state(MarketState)
+
+    await update_state(SetPrice("A", 1))
+    await update_state(SetPrice("A", 1))
+
+    assert mocked_state_versions[MarketState] == 1
+    assert get_state_delta(MarketState, 1) == StateNodeDelta(MARKET_STATE, 1)
+
+
+@pytest.mark.asyncio
+async def test_delta_keeps_recorded_values():
+    enable_state_versioning(10)
+    register_state(MarketState)
+
+    await update_state(SetPrice("A", [1]))
+    get_state(MarketState).prices["A"].append(2)
+
+    assert get_state_delta(MarketState, 0).changed_entries == {"prices": {"A": [1]}}
+
+
+@pytest.mark.asyncio
+async def test_truncated_history_returns_no_delta():
+    enable_state_versioning(2)
+    register_state(MarketState)
+
+    for price in range(4):
+        await update_state(SetPrice("A", price))
+
+    assert get_state_delta(MarketState, 1) is None
+    assert get_state_delta(MarketState, 2).changed_entries == {"prices": {"A": 3}}
+    assert get_state_delta(MarketState, 5) is None
+
+
+def test_apply_delta():
+    state = MarketState("old", {"A": 1, "B": 2})
+    delta = StateNodeDelta(
+        MARKET_STATE, 3, {"name": "new"}, {"prices": {"C": 3}}, {"prices": ["A"]}
+    )
+
+    delta.apply(state)
+
+    assert state == MarketState("new", {"B": 2, "C": 3})
+
+
+def test_merge_replaced_field():
+    deltas = [
+        StateNodeDelta(MARKET_STATE, 1, changed_entries={"prices": {"A": 1}}),
+        StateNodeDelta(MARKET_STATE, 2, changed_fields={"prices": {"B": 2}}),
+        StateNodeDelta(MARKET_STATE, 3, changed_entries={"prices": {"C": 3}}),
+        StateNodeDelta(MARKET_STATE, 4, removed_entries={"prices": ["B"]}),
+    ]
+
+    merged = StateNodeDelta.merge(MARKET_STATE, 4, deltas)
+
+    assert merged.changed_fields == {"prices": {"C": 3}}
+    assert merged.changed_entries == {}
+    assert merged.removed_entries == {}
+    assert deltas[1].changed_fields == {"prices": {"B": 2}}
+
+
+@pytest.mark.asyncio
+async def test_delta_request(event_loop, state_manager, state_consumer, wait, mocker):
+    mocker.patch("meru.state.StateManagerSocket", return_value=state_manager)
+    enable_state_versioning(10)
+    register_state(MarketState)
+    await update_state(SetPrice("A", 1))
+    await update_state(SetPrice("B", 2))
+
+    task = event_loop.create_task(answer_state_requests())
+
+    full = await state_consumer.request(RequireState([MarketState]))
+    assert full.nodes == [MarketState("", {"A": 1, "B": 2})]
+    assert full.versions == {MARKET_STATE: 2}
+
+    stale_epoch = await state_consumer.request(RequireState([MarketState], {MARKET_STATE: 1}))
+    assert len(stale_epoch.nodes) == 1
+
+    changes = await state_consumer.request(
+        RequireState([MarketState], {MARKET_STATE: 1}, STATE_EPOCH)
+    )
+    assert changes.nodes == []
+    assert changes.deltas == [
+        StateNodeDelta(MARKET_STATE, 2, changed_entries={"prices": {"B": 2}})
+    ]
+
+    task.cancel()
+    await wait()
+
+
+def test_project_delta():
+    delta = StateNodeDelta(
+        MARKET_STATE,
+        3,
+        {"name": "new"},
+        {"prices": {"A": 1, "C": 3}},
+        {"prices": ["B", "D"]},
+    )
+
+    projected = delta.project({"prices": ["A", "B"]})
+
+    assert projected == StateNodeDelta(
+        MARKET_STATE, 3, {}, {"prices": {"A": 1}}, {"prices": ["B"]}
+    )
+
+
+@pytest.mark.asyncio
+async def test_projected_request(event_loop, state_manager, state_consumer, wait, mocker):
+    mocker.patch("meru.state.StateManagerSocket", return_value=state_manager)
+    enable_state_versioning(10)
+    register_state(MarketState)
+    await update_state(RenameMarket("market"))
+    await update_state(SetPrice("A", 1))
+    await update_state(SetPrice("B", 2))
+
+    task = event_loop.create_task(answer_state_requests())
+    projections = {MARKET_STATE: {"prices": ["A"]}}
+
+    full = await state_consumer.request(
+        RequireState([MarketState], projections=projections)
+    )
+    assert full.nodes == []
+    assert full.deltas == [StateNodeDelta(MARKET_STATE, 3, {"prices": {"A": 1}})]
+
+    await update_state(SetPrice("B", 3))
+    await update_state(SetPrice("A", 4))
+
+    changes = await state_consumer.request(
+        RequireState([MarketState], {MARKET_STATE: 3}, STATE_EPOCH, projections)
+    )
+    assert changes.deltas == [
+        StateNodeDelta(MARKET_STATE, 5, changed_entries={"prices": {"A": 4}})
+    ]
+
+    task.cancel()
+    await wait()
+
+
+@pytest.mark.asyncio
+async def test_projection_prunes_entries(mocked_states):
+    register_state(MarketState, keys={"prices": ["A"]})
+
+    await update_state(SetPrice("A", 1))
+    await update_state(SetPrice("B", 2))
+
+    assert mocked_states[MarketState].prices == {"A": 1}
+
+
+def test_register_projection(mocked_state_projections):
+    register_state(MarketState, projection_fields=["name"], keys={"prices": ["A"]})
+
+    assert mocked_state_projections[MarketState] == {"name": None, "prices": ["A"]}
+
+
+@pytest.mark.asyncio
+async def test_nested_changes_in_place(mocked_state_versions):
+    enable_state_versioning(10)
+    register_state(OrderBook)
+
+    await update_state(AddOrder("a", 1))
+    await update_state(AddOrder("a", 2))
+
+    assert get_state(OrderBook).orders == {"a": [1, 2]}
+    assert mocked_state_versions[OrderBook] == 2
+    assert get_state_delta(OrderBook, 1).changed_entries == {"orders": {"a": [1, 2]}}
+    assert get_state_delta(OrderBook, 0).changed_entries == {"orders": {"a": [1, 2]}}